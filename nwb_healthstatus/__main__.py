@@ -1,13 +1,124 @@
+import json
+import os
 from pathlib import Path
+import signal
+import sys
+from time import time
 
 import click
-import pynwb
 
-from .base import get_cases_in_namespace
-from .spec import load_spec
+# Heavy dependencies (pynwb, h5py, pydantic, ...) are only imported by the
+# commands & job functions that need them; keep this list to modules that
+# import quickly.
+from .discovery import CaseIndex, get_sample_files, get_scale_dir, parse_scale
+from .manifest import MANIFEST_NAME, Manifest, get_case_key, get_versions
+from .pool import run_jobs
+from .results import RESULTS_DB_NAME, ResultsStore
+from .store import SampleStore, disk_usage, format_size, iter_sample_files
+from .trace import Tracer
 
 DEFAULT_SAMPLES_PATH = str(Path.home() / ".cache" / "nwb-healthstatus")
 
+TEST_SAMPLE = "nwb_healthstatus.runner:test_sample"
+
+
+def case_options(func):
+    func = click.option(
+        "-c",
+        "--case",
+        "casenames",
+        multiple=True,
+        help="Only operate on the sample case(s) with this class name",
+    )(func)
+    return click.option(
+        "--case-index",
+        type=click.Path(dir_okay=False),
+        help="Cache of case file contents  [default: in the user cache directory]",
+    )(func)
+
+
+def scale_option(func):
+    def parse(ctx, param, value):
+        if value is None:
+            return None
+        try:
+            return parse_scale(value)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+
+    return click.option(
+        "--scale",
+        metavar="NAME=VALUE[,...]",
+        callback=parse,
+        help="Override size parameters of the sample cases, operating only on"
+        " the cases that have all the given parameters",
+    )(func)
+
+
+def get_entry_id(entry, case, scale=None):
+    """Return the ID of a case's manifest entry"""
+    entry_id = f"{entry.producer}/{Path(entry.path).name}:{case.name}"
+    if scale:
+        entry_id += f"[{get_scale_dir(scale)}]"
+    return entry_id
+
+
+def iter_cases(casefiles, casenames=(), case_index=None, jobs=1, scale=None):
+    """
+    Yield the ``(file entry, case entry)`` pairs for the cases in the given
+    case files, optionally restricted to the given case names and to those
+    with all the parameters in ``scale``, as recorded in the case index
+    (updating it first as needed).  It is a usage error for ``scale`` to
+    have a parameter which none of the cases declares.
+    """
+    index = CaseIndex(case_index) if case_index is not None else CaseIndex()
+    try:
+        entries = index.scan(casefiles, jobs)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    index.save()
+    selected = [
+        (entries[path], case)
+        for path in casefiles
+        for case in entries[path].cases
+        if not casenames or case.name in casenames
+    ]
+    if scale:
+        declared = {p for _, case in selected for p in case.params}
+        unknown = sorted(set(scale) - declared)
+        if unknown:
+            raise click.UsageError(
+                f"--scale: no selected case has parameter(s) {', '.join(unknown)}"
+            )
+    for entry, case in selected:
+        if scale and not set(scale) <= set(case.params):
+            continue
+        yield entry, case
+
+
+def trace_options(func):
+    for opt in reversed(
+        [
+            click.option(
+                "--profile-dir",
+                type=click.Path(file_okay=False),
+                help="Save a cProfile profile of each job in this directory",
+            ),
+            click.option(
+                "--trace",
+                type=click.Path(dir_okay=False, writable=True),
+                help="Write a Chrome trace of the phases of each job to this file",
+            ),
+            click.option(
+                "--tracemalloc",
+                is_flag=True,
+                help="Record memory allocated by Python in each traced phase",
+            ),
+        ]
+    ):
+        func = opt(func)
+    return func
+
 
 @click.group()
 def main():
@@ -21,50 +132,931 @@ def sample():
 
 @sample.command()
 # @click.option("-e", "--environment")
-@click.option("--overwrite", is_flag=True)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of samples to create in parallel",
+)
+@click.option(
+    "--overwrite",
+    is_flag=True,
+    help="Recreate all samples, even those whose inputs have not changed",
+)
 @click.option(
     "--samples-path", type=click.Path(file_okay=False), default=DEFAULT_SAMPLES_PATH
 )
+@case_options
+@scale_option
+@trace_options
 @click.argument("casefile", type=click.Path(exists=True, dir_okay=False), nargs=-1)
-def create(casefile, overwrite, samples_path):
-    sample_dir = Path(samples_path)
-    for path in casefile:
-        p = Path(path)
-        producer = p.resolve().parent.name
-        namespace = {}
-        exec(p.read_text(), namespace)
-        for casecls in get_cases_in_namespace(namespace):
-            case = casecls()
-            for testsuite, filepath, nwbfile in case.create():
-                filepath = sample_dir / producer / filepath
-                filepath.parent.mkdir(parents=True, exist_ok=True)
-                if overwrite or not filepath.exists():
-                    with pynwb.NWBHDF5IO(str(filepath), "w") as io:
-                        io.write(nwbfile)  # , cache_spec=cache_spec)
+def create(
+    casefile,
+    jobs,
+    overwrite,
+    samples_path,
+    casenames,
+    case_index,
+    scale,
+    profile_dir,
+    trace,
+    tracemalloc,
+):
+    manifest = Manifest(Path(samples_path, MANIFEST_NAME))
+    joblist = []
+    keys = {}
+    # Number of jobs yet to finish, files created and whether any failed,
+    # for each case
+    remaining = {}
+    created = {}
+    case_failed = set()
+    # Cases yet to be keyed again once they have run (see below), with what
+    # their keys are computed from
+    rekey = {}
+    for entry, case in iter_cases(casefile, casenames, case_index, jobs, scale):
+        entry_id = get_entry_id(entry, case, scale)
+        key = get_case_key(entry.path, case.inputs, entry.packages)
+        if not overwrite and manifest.is_current(entry_id, key):
+            click.echo(f"{entry_id}: up to date")
+            continue
+        keys[entry.path, case.name] = (entry_id, key)
+        rekey[entry.path, case.name] = (case.inputs, entry.packages)
+        # Existing files are kept only if they were created from the same
+        # inputs (e.g., before an earlier run failed); files with no entry
+        # in the manifest are of unknown origin, and are rewritten
+        rewrite = overwrite or manifest.is_stale(entry_id, key)
+        # A job per sample for cases which can create them one at a time
+        parts = range(case.num_samples) if case.num_samples else [None]
+        remaining[entry.path, case.name] = len(parts)
+        created[entry.path, case.name] = []
+        for only in parts:
+            joblist.append((entry.path, case.name, samples_path, rewrite, scale, only))
+    tracer = get_tracer(profile_dir, trace, tracemalloc)
+    func = "nwb_healthstatus.runner:create_samples"
+    if tracer is not None:
+        func = tracer.wrap(func)
+    failed = 0
+    for args, outcome in run_jobs(func, joblist, jobs):
+        if tracer is not None:
+            outcome = tracer.collect(args, outcome)
+        path, casename, *_, only = args
+        if (path, casename) in rekey:
+            # Cases may install their inputs when they run (e.g., clone or
+            # update the testing data), so the key recorded is computed
+            # after the first of a case's jobs has finished
+            entry_id, _ = keys[path, casename]
+            key = get_case_key(path, *rekey.pop((path, casename)))
+            keys[path, casename] = (entry_id, key)
+        entry_id, key = keys[path, casename]
+        remaining[path, casename] -= 1
+        if not outcome.ok:
+            failed += 1
+            where = f"{path}:{casename}" + (f"[{only}]" if only is not None else "")
+            click.echo(f"{where}: FAILED\n{outcome.error}", err=True)
+            case_failed.add((path, casename))
+        else:
+            for r in outcome.value:
+                if r.status == "failed":
+                    failed += 1
+                    click.echo(f"{r.path}: FAILED\n{r.error}", err=True)
+                    case_failed.add((path, casename))
+                else:
+                    click.echo(f"{r.path}: {r.status}")
+                    created[path, casename].append(r.path)
+        # Record the files as they are created, so that those created before
+        # a failure are known; the entry is current once all were created
+        manifest.record(
+            entry_id,
+            key,
+            created[path, casename],
+            complete=not remaining[path, casename]
+            and (path, casename) not in case_failed,
+        )
+        manifest.save()
+    if trace is not None:
+        tracer.write(trace)
+    if failed:
+        raise click.ClickException(f"{failed} sample(s) failed to be created")
+
+
+@sample.command("list")
+@case_options
+@click.option(
+    "--samples-path",
+    type=click.Path(file_okay=False),
+    default=DEFAULT_SAMPLES_PATH,
+    show_default=True,
+)
+@click.argument("casefile", type=click.Path(exists=True, dir_okay=False), nargs=-1)
+def list_cases(casefile, casenames, case_index, samples_path):
+    """List the sample cases in the given case files and their sample files"""
+    for entry, case in iter_cases(casefile, casenames, case_index):
+        extensions = ", ".join(case.extensions) or "none"
+        params = "".join(f"; {k}={v}" for k, v in sorted(case.params.items()))
+        click.echo(f"{get_entry_id(entry, case)} (extensions: {extensions}{params})")
+        if case.filename is not None:
+            click.echo(f"  {Path(entry.producer, case.filename)}")
+        else:
+            for p in get_sample_files(entry.producer, case, samples_path):
+                click.echo(f"  {p.relative_to(samples_path)}")
 
 
 @sample.command()
-# @click.option("-e", "--environment")
+@click.option(
+    "-e",
+    "--environment",
+    default="local",
+    show_default=True,
+    help="Name of the environment the tests run in, for --results-db",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of sample files to test in parallel",
+)
+@click.option(
+    "--full-read",
+    is_flag=True,
+    help="Construct every object in the sample files, even for cases"
+    " declaring the objects their tests need",
+)
+@click.option(
+    "--in-process",
+    is_flag=True,
+    help="Run the tests one after another in this process instead of each"
+    " in its own, so that a crashing test takes down the whole run",
+)
+@click.option(
+    "--max-rss",
+    type=click.IntRange(min=1),
+    help="Kill a test whose resident memory exceeds this many MiB",
+)
+@click.option(
+    "--mmap/--no-mmap",
+    default=True,
+    show_default=True,
+    help="Compare contiguous, unfiltered datasets by memory-mapping them"
+    " instead of reading them through h5py",
+)
+@click.option(
+    "--results-db",
+    type=click.Path(dir_okay=False),
+    help="SQLite database in which to record the test outcomes",
+)
 @click.option(
     "--samples-path",
     type=click.Path(exists=True, file_okay=False),
     default=DEFAULT_SAMPLES_PATH,
 )
+@click.option(
+    "--timeout",
+    type=click.FloatRange(min=0),
+    help="Kill a test which runs for longer than this many seconds",
+)
+@click.option(
+    "--writer-environment",
+    help="Name of the environment the samples were created in, for"
+    " --results-db  [default: same as --environment]",
+)
+@case_options
+@scale_option
+@trace_options
 @click.argument("casefile", type=click.Path(exists=True, dir_okay=False), nargs=-1)
-def test(casefile, samples_path):
-    sample_dir = Path(samples_path)
-    for path in casefile:
-        p = Path(path)
-        producer = p.resolve().parent.name
-        namespace = {}
-        exec(p.read_text(), namespace)
-        for casecls in get_cases_in_namespace(namespace):
-            case = casecls()
-            filepath = sample_dir / producer / case.FILENAME
-            with pynwb.NWBHDF5IO(str(filepath), mode="r") as io:
-                ## TODO: Capture and display possible warnings
-                obj = io.read()
-                case.test(obj)
+def test(
+    casefile,
+    environment,
+    full_read,
+    in_process,
+    jobs,
+    max_rss,
+    mmap,
+    results_db,
+    samples_path,
+    timeout,
+    writer_environment,
+    casenames,
+    case_index,
+    scale,
+    profile_dir,
+    trace,
+    tracemalloc,
+):
+    if in_process and (jobs > 1 or timeout is not None or max_rss is not None):
+        raise click.UsageError(
+            "--in-process cannot be combined with --jobs, --timeout or --max-rss"
+        )
+    manifest = Manifest(Path(samples_path, MANIFEST_NAME))
+    joblist = []
+    entry_ids = {}
+    for entry, case in iter_cases(casefile, casenames, case_index, jobs, scale):
+        entry_ids[entry.path, case.name] = (
+            entry.producer,
+            get_entry_id(entry, case, scale),
+        )
+        for filepath in get_sample_files(entry.producer, case, samples_path, scale):
+            joblist.append(
+                (entry.path, case.name, str(filepath), mmap, scale, full_read)
+            )
+    store = ResultsStore(results_db) if results_db is not None else None
+    reader_versions = get_versions()
+    tracer = get_tracer(profile_dir, trace, tracemalloc)
+    failed = 0
+    for (path, casename, filepath, *_), outcome in run_jobs(
+        tracer.wrap(TEST_SAMPLE) if tracer is not None else TEST_SAMPLE,
+        joblist,
+        jobs,
+        timeout=timeout,
+        max_rss=max_rss * 1024 * 1024 if max_rss is not None else None,
+        isolate=not in_process,
+    ):
+        if tracer is not None:
+            outcome = tracer.collect((path, casename, filepath), outcome)
+        if outcome.ok:
+            click.echo(f"{filepath} [{casename}]: ok ({outcome.duration:.2f}s)")
+            for w in outcome.value:
+                click.echo(f"  {w}")
+        else:
+            failed += 1
+            click.echo(f"{filepath} [{casename}]: FAILED\n{outcome.error}", err=True)
+        if store is not None:
+            producer, entry_id = entry_ids[path, casename]
+            entry = manifest.entries.get(entry_id)
+            store.record(
+                producer=producer,
+                casename=casename,
+                filename=str(Path(filepath).relative_to(Path(samples_path, producer))),
+                writer_env=writer_environment or environment,
+                reader_env=environment,
+                writer_versions=entry["depends"]["versions"] if entry else {},
+                reader_versions=reader_versions,
+                status="ok" if outcome.ok else "failed",
+                duration=outcome.duration,
+                warnings=outcome.value if outcome.ok else [],
+                error=outcome.error,
+            )
+    if store is not None:
+        store.close()
+    if trace is not None:
+        tracer.write(trace)
+    if failed:
+        raise click.ClickException(f"{failed} sample(s) failed testing")
+
+
+@sample.command()
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of sample files to hash in parallel",
+)
+@click.option(
+    "--reflink",
+    is_flag=True,
+    help="Share identical files' data via reflinks rather than hardlinks"
+    " (requires a filesystem supporting them, such as Btrfs or XFS)",
+)
+@click.option(
+    "--samples-path",
+    type=click.Path(exists=True, file_okay=False),
+    default=DEFAULT_SAMPLES_PATH,
+    show_default=True,
+)
+def dedup(jobs, reflink, samples_path):
+    """
+    Store identical sample files only once.
+
+    Sample files (including those of each writer environment of a matrix
+    run) are hashed, and each one identical to a file already in the store
+    is replaced by a link to it.  Use ``rsync -H`` to preserve hardlinks when
+    syncing samples between machines.
+    """
+    try:
+        stats = SampleStore(samples_path).dedup(reflink=reflink, workers=jobs)
+    except OSError as e:
+        raise click.ClickException(f"Could not link sample files: {e}")
+    click.echo(
+        f"{stats.files} sample file(s), {stats.linked} newly linked,"
+        f" {format_size(stats.saved)} freed"
+    )
+
+
+@sample.command()
+@click.option(
+    "--datasets",
+    is_flag=True,
+    help="Also report the size of HDF5 datasets whose content appears in"
+    " more than one sample file",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of sample files to hash in parallel for --datasets",
+)
+@click.option(
+    "--samples-path",
+    type=click.Path(exists=True, file_okay=False),
+    default=DEFAULT_SAMPLES_PATH,
+    show_default=True,
+)
+def du(datasets, jobs, samples_path):
+    """Show the logical and physical size of the samples of each producer"""
+    rows, total = disk_usage(samples_path, datasets=datasets, workers=jobs)
+    table = [["ENVIRONMENT", "PRODUCER", "FILES", "LOGICAL", "PHYSICAL"]]
+    if datasets:
+        table[0].append("SHARED DATASETS")
+    for row in rows + [total]:
+        cells = [
+            row.environment,
+            row.producer,
+            str(row.files),
+            format_size(row.logical),
+            format_size(row.physical),
+        ]
+        if datasets:
+            cells.append(format_size(row.shared))
+        table.append(cells)
+    widths = [max(len(r[i]) for r in table) for i in range(len(table[0]))]
+    for cells in table:
+        click.echo(
+            "  ".join(
+                c.ljust(w) if i < 2 else c.rjust(w)
+                for i, (c, w) in enumerate(zip(cells, widths))
+            ).rstrip()
+        )
+
+
+@sample.command()
+@click.option(
+    "--compress",
+    is_flag=True,
+    help="Compress the files in the bundle (which then cannot be opened in place)",
+)
+@click.option(
+    "--samples-path",
+    type=click.Path(exists=True, file_okay=False),
+    default=DEFAULT_SAMPLES_PATH,
+    show_default=True,
+)
+@click.argument("bundle", type=click.Path(dir_okay=False, allow_dash=True))
+def pack(compress, samples_path, bundle):
+    """
+    Pack the samples into a single bundle file.
+
+    The sample files recorded in the manifests (including those of each
+    writer environment of a matrix run), their checksum files and the
+    manifests are written to a zip file ending with an index of the samples,
+    from which ``sample unpack`` extracts selected samples without reading
+    the rest.  Hardlinked sample files (see ``sample dedup``) are stored
+    once.  Use "-" to write the bundle to standard output.
+    """
+    from .bundle import pack_samples
+
+    if bundle == "-":
+        members = pack_samples(samples_path, sys.stdout.buffer, compress)
+    else:
+        path = Path(bundle)
+        tmppath = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            members = pack_samples(samples_path, tmppath, compress)
+            os.replace(str(tmppath), str(path))
+        except BaseException:
+            if tmppath.exists():
+                tmppath.unlink()
+            raise
+    samples = [m for m in members if m.kind == "sample"]
+    stored = {m.member: m.size for m in members}
+    click.echo(
+        f"{len(samples)} sample file(s) packed, {format_size(sum(stored.values()))}"
+        " stored",
+        err=bundle == "-",
+    )
+
+
+@sample.command()
+@click.option(
+    "-c",
+    "--case",
+    "casenames",
+    multiple=True,
+    help="Only extract the samples of the sample case(s) with this class name",
+)
+@click.option(
+    "--list",
+    "list_only",
+    is_flag=True,
+    help="List the selected sample files instead of extracting them",
+)
+@click.option(
+    "-p",
+    "--producer",
+    "producers",
+    multiple=True,
+    help="Only extract the samples of this producer",
+)
+@click.option(
+    "--samples-path",
+    type=click.Path(file_okay=False),
+    default=DEFAULT_SAMPLES_PATH,
+    show_default=True,
+)
+@click.argument("bundle", type=click.Path(exists=True, dir_okay=False))
+@click.argument("files", nargs=-1)
+def unpack(casenames, list_only, producers, samples_path, bundle, files):
+    """
+    Extract samples from a bundle made by ``sample pack``.
+
+    If cases, producers or paths in the bundle (as shown by --list) are
+    given, only the sample files matching all of them are extracted, along
+    with their checksum files and manifest entries.  Extracted files are
+    checked against the digests recorded in the bundle.
+    """
+    from .bundle import SampleBundle
+
+    try:
+        sb = SampleBundle(bundle)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    with sb:
+        members = sb.select(casenames, producers, files)
+        samples = [m for m in members if m.kind == "sample"]
+        if not samples:
+            raise click.ClickException("No sample files in the bundle match")
+        if list_only:
+            for m in samples:
+                click.echo(f"{m.path}  {m.case}  {format_size(m.size)}")
+            return
+        try:
+            sb.unpack(members, samples_path)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    click.echo(f"{len(samples)} sample file(s) extracted into {samples_path}")
+
+
+@sample.command()
+@click.option(
+    "-i",
+    "--ignore",
+    multiple=True,
+    metavar="PATTERN",
+    help="Skip objects (and attributes, given as PATH@NAME) whose paths match"
+    " this glob pattern, in addition to those which differ between any two"
+    " NWB files",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    show_default=True,
+    help="Number of threads hashing dataset chunks",
+)
+@click.option("--json", "as_json", is_flag=True, help="Output the report as JSON")
+@click.option(
+    "--no-default-ignore",
+    is_flag=True,
+    help="Also compare object IDs and file creation dates",
+)
+@click.argument("file_a", type=click.Path(exists=True, dir_okay=False))
+@click.argument("file_b", type=click.Path(exists=True, dir_okay=False))
+def diff(file_a, file_b, ignore, jobs, as_json, no_default_ignore):
+    """
+    Show the structural differences between two sample files.
+
+    Compares the files' groups, links, attributes, datasets' dtypes, shapes
+    & storage settings, and datasets' contents, and exits with status 1 if
+    they differ.
+    """
+    from .diff import DEFAULT_IGNORE, diff_files
+
+    patterns = list(ignore) + ([] if no_default_ignore else DEFAULT_IGNORE)
+    start = time()
+    report = diff_files(file_a, file_b, ignore=patterns, workers=jobs)
+    elapsed = time() - start
+    if as_json:
+        json.dump(
+            {
+                "a": file_a,
+                "b": file_b,
+                "ignore": patterns,
+                "differences": [d._asdict() for d in report.differences],
+                "groups": report.groups,
+                "datasets": report.datasets,
+                "hashed": report.hashed,
+                "duration": elapsed,
+            },
+            sys.stdout,
+            indent=2,
+        )
+        click.echo()
+    else:
+        for d in report.differences:
+            click.echo(str(d))
+        click.echo(
+            f"Compared {report.groups} groups and {report.datasets} datasets"
+            f" ({format_size(report.hashed)} hashed) in {elapsed:.2f}s",
+            err=True,
+        )
+    if report.differences:
+        sys.exit(1)
+
+
+@sample.command()
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of sample files to verify in parallel",
+)
+@click.option(
+    "--samples-path",
+    type=click.Path(exists=True, file_okay=False),
+    default=DEFAULT_SAMPLES_PATH,
+    show_default=True,
+    help="Directory whose sample files to verify if no files are given",
+)
+@click.argument("files", type=click.Path(exists=True, dir_okay=False), nargs=-1)
+def verify(jobs, samples_path, files):
+    """
+    Check sample files against the checksums recorded when they were created.
+
+    Only h5py is used, so this is much cheaper than testing the samples.
+    Without arguments, all sample files under --samples-path are verified.
+    """
+    if not files:
+        files = [str(sf.path) for sf in iter_sample_files(samples_path)]
+    failed = unverified = 0
+    for (filepath,), outcome in run_jobs(
+        "nwb_healthstatus.checksums:verify_file", [(f,) for f in files], jobs
+    ):
+        if not outcome.ok:
+            failed += 1
+            click.echo(f"{filepath}: FAILED\n{outcome.error}", err=True)
+        elif outcome.value is None:
+            unverified += 1
+            click.echo(f"{filepath}: no checksums")
+        elif outcome.value:
+            failed += 1
+            click.echo(f"{filepath}: FAILED", err=True)
+            for problem in outcome.value:
+                click.echo(f"  {problem}", err=True)
+        else:
+            click.echo(f"{filepath}: ok")
+    if unverified:
+        click.echo(f"{unverified} sample file(s) have no checksums", err=True)
+    if failed:
+        raise click.ClickException(f"{failed} sample file(s) failed verification")
+
+
+@sample.command()
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=0),
+    default=2.0,
+    show_default=True,
+    help="How often to check the samples and case files for changes, in seconds",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of worker processes testing sample files",
+)
+@click.option(
+    "--max-rss",
+    type=click.IntRange(min=1),
+    help="Kill (and replace) a worker whose resident memory exceeds this"
+    " many MiB while testing",
+)
+@click.option(
+    "--mmap/--no-mmap",
+    default=True,
+    show_default=True,
+    help="Compare contiguous, unfiltered datasets by memory-mapping them"
+    " instead of reading them through h5py",
+)
+@click.option(
+    "--samples-path",
+    type=click.Path(exists=True, file_okay=False),
+    default=DEFAULT_SAMPLES_PATH,
+    show_default=True,
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False),
+    help="Unix socket on which to accept check requests"
+    "  [default: .serve.sock in --samples-path]",
+)
+@click.option(
+    "--timeout",
+    type=click.FloatRange(min=0),
+    help="Kill (and replace) a worker testing a sample for longer than this"
+    " many seconds",
+)
+@case_options
+@scale_option
+@click.argument("casefile", type=click.Path(exists=True, dir_okay=False), nargs=-1)
+def serve(
+    casefile,
+    interval,
+    jobs,
+    max_rss,
+    mmap,
+    samples_path,
+    socket_path,
+    timeout,
+    casenames,
+    case_index,
+    scale,
+):
+    """
+    Keep testing samples as they and their case files change.
+
+    Tests run in long-lived worker processes with the NWB libraries already
+    loaded, so they start without delay.  Every sample is tested at
+    start-up, and then again whenever it or its case file changes.  Samples
+    can also be tested on demand with `sample check`.  Stop with Ctrl-C.
+    """
+    from .serve import SampleServer
+
+    def report(check, outcome):
+        if outcome.ok:
+            click.echo(
+                f"{check.filepath} [{check.casename}]: ok ({outcome.duration:.2f}s)"
+            )
+            for w in outcome.value:
+                click.echo(f"  {w}")
+        else:
+            click.echo(
+                f"{check.filepath} [{check.casename}]: FAILED\n{outcome.error}",
+                err=True,
+            )
+
+    try:
+        server = SampleServer(
+            casefile,
+            samples_path,
+            report=report,
+            warn=lambda msg: click.echo(msg, err=True),
+            casenames=casenames,
+            case_index=case_index,
+            scale=scale,
+            mmap=mmap,
+            workers=jobs,
+            timeout=timeout,
+            max_rss=max_rss * 1024 * 1024 if max_rss is not None else None,
+            socket_path=socket_path,
+            interval=interval,
+        )
+    except (OSError, RuntimeError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Listening on {server.socket_path}", err=True)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+
+@sample.command()
+@click.option(
+    "--casefile",
+    "casefiles",
+    type=click.Path(exists=True, dir_okay=False),
+    multiple=True,
+    help="Only test the samples of the cases in this case file",
+)
+@click.option(
+    "-c",
+    "--case",
+    "casenames",
+    multiple=True,
+    help="Only test the samples of the sample case(s) with this class name",
+)
+@click.option(
+    "--samples-path",
+    type=click.Path(file_okay=False),
+    default=DEFAULT_SAMPLES_PATH,
+    show_default=True,
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False),
+    help="Socket of the server  [default: .serve.sock in --samples-path]",
+)
+@click.argument("files", type=click.Path(dir_okay=False), nargs=-1)
+def check(casefiles, casenames, samples_path, socket_path, files):
+    """
+    Test samples now with a running `sample serve`.
+
+    Tests the given sample files (or all of those served) of the selected
+    cases, and waits for the results.
+    """
+    from .serve import SOCKET_NAME, request_checks
+
+    if socket_path is None:
+        socket_path = Path(samples_path, SOCKET_NAME)
+    try:
+        results = request_checks(socket_path, casefiles, casenames, files)
+    except (OSError, RuntimeError) as e:
+        raise click.ClickException(f"Could not check samples with server: {e}")
+    if not results:
+        raise click.ClickException("No samples served by the server matched")
+    failed = 0
+    for r in results:
+        if r["ok"]:
+            click.echo(f"{r['file']} [{r['case']}]: ok ({r['duration']:.2f}s)")
+            for w in r["warnings"]:
+                click.echo(f"  {w}")
+        else:
+            failed += 1
+            click.echo(f"{r['file']} [{r['case']}]: FAILED\n{r['error']}", err=True)
+    if failed:
+        raise click.ClickException(f"{failed} sample(s) failed testing")
+
+
+def get_tracer(profile_dir, trace, tracemalloc):
+    if profile_dir is None and trace is None and not tracemalloc:
+        return None
+    return Tracer(profile_dir=profile_dir, trace_malloc=tracemalloc)
+
+
+@main.command()
+@click.option(
+    "-e",
+    "--environment",
+    default="local",
+    show_default=True,
+    help="Name of the environment the benchmarks run in",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.File("w"),
+    default="-",
+    help="File to write the JSON results to  [default: stdout]",
+)
+@click.option(
+    "-r",
+    "--repeat",
+    type=click.IntRange(min=1),
+    default=5,
+    show_default=True,
+    help="Number of times to benchmark each case",
+)
+@case_options
+@click.argument("casefile", type=click.Path(exists=True, dir_okay=False), nargs=-1)
+def bench(casefile, environment, output, repeat, casenames, case_index):
+    """
+    Benchmark creating, writing, reading and testing each case's samples.
+
+    Each repetition runs in a fresh process so that peak memory usage is
+    measured per run.
+    """
+    joblist = [
+        (entry.path, case.name)
+        for entry, case in iter_cases(casefile, casenames, case_index)
+        for _ in range(repeat)
+    ]
+    records = []
+    failed = 0
+    for (path, casename), outcome in run_jobs(
+        "nwb_healthstatus.bench:bench_case", joblist, isolate=True
+    ):
+        if outcome.ok:
+            records.extend(outcome.value)
+        else:
+            failed += 1
+            click.echo(f"{path}:{casename}: FAILED\n{outcome.error}", err=True)
+    from .bench import summarize
+
+    json.dump(
+        {
+            "environment": environment,
+            "versions": get_versions(),
+            "repeat": repeat,
+            "summary": summarize(records),
+            "runs": records,
+        },
+        output,
+        indent=2,
+    )
+    output.write("\n")
+    if failed:
+        raise click.ClickException(f"{failed} benchmark run(s) failed")
+
+
+@main.group()
+def matrix():
+    pass
+
+
+@matrix.command("run")
+@click.option(
+    "--dockerfiles-dir",
+    type=click.Path(file_okay=False),
+    default="environments",
+    show_default=True,
+    help="Directory of Dockerfiles for the docker executor",
+)
+@click.option(
+    "--executor",
+    type=click.Choice(["local", "docker"]),
+    default="local",
+    show_default=True,
+    help="How to run commands in each environment",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    show_default=True,
+    help="Number of matrix jobs to run in parallel",
+)
+@click.option(
+    "--samples-path",
+    type=click.Path(file_okay=False),
+    default=str(Path(DEFAULT_SAMPLES_PATH, "matrix")),
+    show_default=True,
+    help="Directory under which each writer environment's samples are stored",
+)
+@click.option(
+    "--workdir",
+    type=click.Path(file_okay=False),
+    default=str(Path(DEFAULT_SAMPLES_PATH, "environments")),
+    show_default=True,
+    help="Directory for the local executor's virtualenvs",
+)
+@click.argument("specfile", type=click.Path(exists=True, dir_okay=False))
+def run(specfile, dockerfiles_dir, executor, jobs, samples_path, workdir):
+    from .matrix import DockerExecutor, LocalExecutor, run_matrix
+    from .spec import load_spec
+
+    spec = load_spec(specfile)
+    if executor == "docker":
+        ex = DockerExecutor(workdir, samples_path, dockerfiles_dir)
+    else:
+        ex = LocalExecutor(workdir, samples_path)
+    failed = 0
+    for job, outcome in run_matrix(spec, ex, jobs):
+        if outcome.ok:
+            click.echo(f"{job}: ok ({outcome.duration:.1f}s)")
+        else:
+            failed += 1
+            click.echo(f"{job}: FAILED\n{outcome.error}", err=True)
+    click.echo(f"Results recorded in {Path(samples_path, RESULTS_DB_NAME)}")
+    if failed:
+        raise click.ClickException(f"{failed} matrix job(s) failed")
+
+
+@main.group()
+def results():
+    pass
+
+
+@results.command()
+@click.option("-p", "--producer", help="Only show results for this producer")
+@click.option("-r", "--reader", help="Only show results for this reader environment")
+@click.option("-w", "--writer", help="Only show results for this writer environment")
+@click.option(
+    "-v",
+    "--verbose",
+    is_flag=True,
+    help="Show the latest outcome of each sample file rather than counts",
+)
+@click.argument("dbfile", type=click.Path(exists=True, dir_okay=False))
+def show(dbfile, producer, reader, writer, verbose):
+    with ResultsStore(dbfile) as store:
+        if verbose:
+            for row in store.latest(producer, writer, reader):
+                click.echo(
+                    f"{row['producer']}/{row['filename']} [{row['casename']}]"
+                    f" {row['writer_env']} -> {row['reader_env']}: {row['status']}"
+                )
+        else:
+            for row in store.summary(producer, writer, reader):
+                click.echo(
+                    f"{row['producer']} {row['writer_env']} -> {row['reader_env']}:"
+                    f" {row['ok']} ok, {row['failed']} failed"
+                )
 
 
 @main.group()
@@ -73,16 +1065,40 @@ def environments():
 
 
 @environments.command()
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    help="Number of Dockerfiles to generate in parallel  [default: one per CPU]",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Regenerate all Dockerfiles instead of reusing cached ones",
+)
 @click.option(
     "-o", "--outdir", type=click.Path(file_okay=False), default="environments"
 )
 @click.argument("specfile", type=click.Path(exists=True, dir_okay=False))
-def make_dockerfiles(specfile, outdir):
+def make_dockerfiles(specfile, jobs, no_cache, outdir):
+    from .spec import DOCKERFILE_CACHE_DIR, generate_dockerfiles, load_spec
+
     outdir = Path(outdir)
     outdir.mkdir(parents=True, exist_ok=True)
     spec = load_spec(specfile)
+    dockerfiles = generate_dockerfiles(
+        spec.environments,
+        cache_dir=None if no_cache else DOCKERFILE_CACHE_DIR,
+        workers=jobs,
+    )
     for env in spec.environments:
-        (outdir / f"Dockerfile.{env.name}").write_text(env.generate_dockerfile())
+        path = outdir / f"Dockerfile.{env.name}"
+        # Leave unchanged files untouched so as not to invalidate image builds
+        if not path.exists() or path.read_text() != dockerfiles[env.name]:
+            path.write_text(dockerfiles[env.name])
+            click.echo(f"{path}: updated")
+        else:
+            click.echo(f"{path}: unchanged")
 
 
 if __name__ == "__main__":
@@ -1,21 +1,84 @@
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from functools import reduce
 from inspect import isclass
+from io import BytesIO
+import mmap
 from operator import or_
+from pathlib import Path
 from types import ModuleType
-from typing import ClassVar, Iterator, Set, Tuple, Type
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    ClassVar,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
+import warnings
 
+import h5py
+from hdmf.backends.hdf5.h5_utils import H5DataIO
 from hdmf.container import Container
-import pynwb
+from hdmf.data_utils import AbstractDataChunkIterator, DataChunk
+import numpy as np
+
+if TYPE_CHECKING:
+    from hdmf.common import DynamicTable
+    import pynwb
+    from pynwb import NWBFile
+
+#: Default upper bound on the number of bytes of a dataset read into memory at
+#: once when comparing it block by block
+DEFAULT_BLOCK_BYTES = 64 * 1024 * 1024
+
+#: Whether `assert_data_equal` reads HDF5 datasets through `map_dataset`
+#: (disabled by ``sample test --no-mmap``)
+MAP_DATASETS = True
 
 
 class SampleCase(ABC):
     #: Set of extensions needed by the sample case
     EXTENSIONS: ClassVar[Set[str]]
 
+    #: Optional list of files and directories (relative to the case file) the
+    #: samples are generated from; changes to them cause the samples to be
+    #: recreated
+    INPUTS: ClassVar[List[Union[str, Path]]]
+
+    #: Optional list of the paths, in the sample files, of the objects the
+    #: test looks at.  If declared, only these objects (and whatever they link
+    #: to) are constructed when reading a sample for testing, along with the
+    #: file's metadata; an empty list means the metadata alone.
+    OBJECTS: ClassVar[List[str]]
+
+    #: Optional size parameters of the sample case and their default values.
+    #: A case declaring them is constructed with all of them as keyword
+    #: arguments, some of which may be overridden (with ``--scale``) to create
+    #: and test scaled-up samples.
+    PARAMS: ClassVar[Dict[str, Union[int, float]]]
+
+    #: Optional number of samples ``create`` yields, declared by cases whose
+    #: ``create`` also takes an ``only`` argument: the index of the one
+    #: sample to create.  Each sample of such a case is then created by a job
+    #: of its own, so that the samples are created in parallel.
+    NUM_SAMPLES: ClassVar[int]
+
     @abstractmethod
-    def create(self) -> Iterator[Tuple[str, str, pynwb.NWBFile]]:
-        """ Creates a sample NWB file """
+    def create(self) -> Iterator[Tuple[str, str, "pynwb.NWBFile"]]:
+        """
+        Creates a sample NWB file.  Large datasets can be given as
+        `stream_data` objects so that they are written without being held in
+        memory in full, large tables built with `build_table`, and files
+        which should be samples as written and read back staged in memory
+        with `staged_nwbfile`.
+        """
         ...
 
     @abstractmethod
@@ -46,3 +109,335 @@ def get_cases_in_namespace(namespace: dict) -> Iterator[Type[SampleCase]]:
     for obj in namespace.values():
         if isclass(obj) and issubclass(obj, SampleCase):
             yield obj
+
+
+def iter_blocks(data: Any, max_bytes: int = DEFAULT_BLOCK_BYTES) -> Iterator[slice]:
+    """
+    Yield slices along the first axis of ``data`` (an HDF5 dataset or
+    array-like) that split it into blocks of at most ``max_bytes`` bytes (but
+    at least one row each).  For chunked datasets, the blocks are aligned to
+    the chunk boundaries so that no chunk is read twice.
+    """
+    shape = data.shape
+    if not shape:
+        return
+    row_bytes = int(np.prod(shape[1:], dtype=np.int64)) * np.dtype(data.dtype).itemsize
+    rows = max(1, max_bytes // max(row_bytes, 1))
+    chunks = getattr(data, "chunks", None)
+    if chunks:
+        rows = max(chunks[0], rows - rows % chunks[0])
+    for start in range(0, shape[0], rows):
+        yield slice(start, min(start + rows, shape[0]))
+
+
+def map_dataset(data: Any) -> Any:
+    """
+    Return a read-only `numpy.memmap` of ``data`` if it is an HDF5 dataset
+    stored contiguously and unfiltered in its file, so that it can be read
+    straight from the file without being copied through h5py; otherwise,
+    return ``data`` as is
+    """
+    if (
+        not isinstance(data, h5py.Dataset)
+        or not data.shape
+        or data.size == 0
+        or data.dtype.hasobject
+        or data.is_virtual
+        or data.external
+        or data.file.driver != "sec2"
+        or data.id.get_create_plist().get_layout() != h5py.h5d.CONTIGUOUS
+    ):
+        return data
+    offset = data.id.get_offset()
+    if offset is None:  # Not yet allocated in the file
+        return data
+    return np.memmap(
+        data.file.filename,
+        dtype=data.dtype,
+        mode="r",
+        # The offset is from the start of the file, including any user block
+        offset=offset,
+        shape=data.shape,
+    )
+
+
+def _drop_pages(data: Any) -> None:
+    # Release the pages of a memory-mapped array read so far, so that they do
+    # not accumulate in the process's resident memory
+    mm = getattr(data, "_mmap", None)
+    if mm is not None and hasattr(mmap, "MADV_DONTNEED"):  # Python 3.8+
+        mm.madvise(mmap.MADV_DONTNEED)
+
+
+def iter_random_blocks(
+    shape: Tuple[int, ...], seed: int, max_bytes: int = DEFAULT_BLOCK_BYTES
+) -> Iterator[np.ndarray]:
+    """
+    Yield blocks (along the first axis) of a float64 array of the given
+    shape filled with pseudo-random values in [0, 1), each block of at most
+    ``max_bytes`` bytes.  The values depend only on the shape and the seed,
+    so that a sample case can generate arbitrarily large data when creating
+    a sample (e.g., with `stream_data`) and generate it again when testing
+    it (with `assert_data_equal`), without holding it in memory.
+    """
+    row_size = int(np.prod(shape[1:], dtype=np.int64))
+    rows = max(1, max_bytes // max(row_size * 8, 1))
+    for start in range(0, shape[0], rows):
+        stop = min(start + rows, shape[0])
+        # Seeded per block so that blocks can be generated independently
+        rng = np.random.RandomState([seed, start])
+        yield rng.random_sample((stop - start,) + tuple(shape[1:]))
+
+
+def assert_data_equal(
+    actual: Any,
+    expected: Union[np.ndarray, Iterable[np.ndarray], Any],
+    max_bytes: int = DEFAULT_BLOCK_BYTES,
+    err_msg: str = "",
+) -> None:
+    """
+    Assert that ``actual`` (typically an HDF5 dataset read from a sample) is
+    equal to ``expected`` without loading either of them into memory in full.
+
+    ``expected`` may be an array-like supporting ``shape`` and slicing (e.g.,
+    a NumPy array or another dataset), in which case both are compared in
+    blocks of at most ``max_bytes`` bytes along the first axis, or an
+    iterable of arrays (e.g., a generator) that, concatenated along the first
+    axis, give the expected data, in which case each yielded block is
+    compared against the corresponding rows of ``actual``.  The comparison
+    stops at the first mismatching block.  HDF5 datasets are read through
+    `map_dataset` where possible.
+    """
+    if MAP_DATASETS:
+        actual = map_dataset(actual)
+        expected = map_dataset(expected)
+    if not hasattr(expected, "shape") and not _is_block_iterable(expected):
+        expected = np.asarray(expected)
+    if not hasattr(actual, "shape"):
+        actual = np.asarray(actual)
+    if hasattr(expected, "shape"):
+        if tuple(actual.shape) != tuple(expected.shape):
+            raise AssertionError(
+                f"{err_msg}Shape mismatch: {tuple(actual.shape)} vs."
+                f" {tuple(expected.shape)}"
+            )
+        if not actual.shape:
+            np.testing.assert_array_equal(actual[()], expected[()], err_msg=err_msg)
+            return
+        for block in iter_blocks(actual, max_bytes):
+            np.testing.assert_array_equal(
+                actual[block],
+                expected[block],
+                err_msg=f"{err_msg}Mismatch in rows {block.start}:{block.stop}",
+            )
+            _drop_pages(actual)
+            _drop_pages(expected)
+        return
+    start = 0
+    for expected_block in expected:
+        expected_block = np.asarray(expected_block)
+        stop = start + len(expected_block)
+        if stop > actual.shape[0]:
+            raise AssertionError(
+                f"{err_msg}Expected data is longer than the actual"
+                f" {actual.shape[0]} rows"
+            )
+        np.testing.assert_array_equal(
+            actual[start:stop],
+            expected_block,
+            err_msg=f"{err_msg}Mismatch in rows {start}:{stop}",
+        )
+        _drop_pages(actual)
+        start = stop
+    if start != actual.shape[0]:
+        raise AssertionError(
+            f"{err_msg}Expected data has {start} rows, but actual has"
+            f" {actual.shape[0]}"
+        )
+
+
+def _is_block_iterable(obj: Any) -> bool:
+    return not isinstance(obj, (str, bytes, list, tuple)) and hasattr(obj, "__iter__")
+
+
+class BlockIterator(AbstractDataChunkIterator):
+    """
+    A data chunk iterator over an iterable of arrays which, concatenated
+    along their first axis, make up a dataset.  Only one block is held in
+    memory at a time, so that a dataset of any length can be written without
+    being materialized in full.
+
+    ``dtype`` and ``maxshape`` default to the dtype and shape (unlimited
+    along the first axis) of the first block; they must be given if
+    ``blocks`` may be empty.
+    """
+
+    def __init__(
+        self,
+        blocks: Iterable[np.ndarray],
+        dtype: Optional[np.dtype] = None,
+        maxshape: Optional[Tuple[Optional[int], ...]] = None,
+    ) -> None:
+        self._blocks = iter(blocks)
+        first = next(self._blocks, None)
+        self._next_block = None if first is None else np.asarray(first, dtype=dtype)
+        if self._next_block is None and (dtype is None or maxshape is None):
+            raise ValueError("dtype and maxshape must be given for empty data")
+        self._dtype = np.dtype(dtype) if dtype is not None else self._next_block.dtype
+        if maxshape is None:
+            maxshape = (None,) + self._next_block.shape[1:]
+        self._maxshape = tuple(maxshape)
+        self._initial_shape = (
+            self._next_block.shape
+            if self._next_block is not None
+            else (0,) + self._maxshape[1:]
+        )
+        self._position = 0
+
+    def __iter__(self) -> "BlockIterator":
+        return self
+
+    def __next__(self) -> DataChunk:
+        if self._next_block is not None:
+            block, self._next_block = self._next_block, None
+        else:
+            block = np.asarray(next(self._blocks), dtype=self._dtype)
+        start = self._position
+        self._position += len(block)
+        selection = (slice(start, self._position),) + tuple(
+            slice(0, n) for n in block.shape[1:]
+        )
+        return DataChunk(data=block, selection=selection)
+
+    def recommended_chunk_shape(self) -> None:
+        return None
+
+    def recommended_data_shape(self) -> Tuple[int, ...]:
+        return self._initial_shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+
+    @property
+    def maxshape(self) -> Tuple[Optional[int], ...]:
+        return self._maxshape
+
+
+def stream_data(
+    blocks: Iterable[np.ndarray],
+    dtype: Optional[np.dtype] = None,
+    maxshape: Optional[Tuple[Optional[int], ...]] = None,
+    chunks: Union[bool, Tuple[int, ...]] = True,
+    compression: Optional[str] = "gzip",
+    compression_opts: Any = 4,
+    **io_settings: Any,
+) -> H5DataIO:
+    """
+    Wrap an iterable of blocks (see `BlockIterator`) for use as the data of
+    an NWB object so that it is written to the sample file incrementally,
+    with the given chunking and compression settings, when the file is
+    written.  Further keyword arguments are passed to `H5DataIO`.
+    """
+    return H5DataIO(
+        BlockIterator(blocks, dtype=dtype, maxshape=maxshape),
+        chunks=chunks,
+        compression=compression,
+        compression_opts=compression_opts if compression is not None else None,
+        **io_settings,
+    )
+
+
+def build_table(
+    table_cls: Type["DynamicTable"],
+    columns: Dict[str, Any],
+    indices: Optional[Dict[str, Any]] = None,
+    descriptions: Optional[Dict[str, str]] = None,
+    **kwargs: Any,
+) -> "DynamicTable":
+    """
+    Construct a `DynamicTable` of the given class (e.g., ``TimeIntervals``
+    for trials, ``PlaneSegmentation``, or ``Units``) from whole columns at
+    once, rather than row by row with ``add_row`` and the like, which is
+    slow for large tables.
+
+    ``columns`` maps column names, in order, to their values: arrays,
+    `stream_data` objects, or ready-made ``VectorData`` (such as a
+    ``DynamicTableRegion``).  The values of a ragged column are given
+    flattened, with ``indices`` mapping its name to the offsets at which
+    each row's values end (as stored in its ``VectorIndex``).  Columns not
+    predefined by the class need a description in ``descriptions``.
+    Further keyword arguments (e.g., ``name`` and ``description``) are
+    passed to the class; the row ids default to ``0, 1, 2, ...``.
+    """
+    from hdmf.common import VectorData, VectorIndex
+
+    indices = indices or {}
+    descriptions = descriptions or {}
+    spec = {c["name"]: c for c in table_cls.__columns__}
+    cols = []
+    nrows = None
+    for name, values in columns.items():
+        if isinstance(values, VectorData):
+            col = values
+        else:
+            try:
+                description = descriptions.get(name) or spec[name]["description"]
+            except KeyError:
+                raise ValueError(f"No description given for column {name!r}")
+            col_cls = spec.get(name, {}).get("class", VectorData)
+            col = col_cls(name=name, description=description, data=values)
+        cols.append(col)
+        if name in indices:
+            col = VectorIndex(name=f"{name}_index", data=indices[name], target=col)
+            cols.append(col)
+        n = _num_rows(col.data)
+        if nrows is None:
+            nrows = n
+        elif n is not None and n != nrows:
+            raise ValueError(f"Column {name!r} has {n} rows, expected {nrows}")
+    if "id" not in kwargs:
+        kwargs["id"] = np.arange(nrows or 0)
+    return table_cls(columns=cols, **kwargs)
+
+
+def _num_rows(data: Any) -> Optional[int]:
+    if isinstance(data, H5DataIO):
+        data = data.data
+    if isinstance(data, AbstractDataChunkIterator):
+        return data.maxshape[0]
+    return len(data)
+
+
+@contextmanager
+def staged_nwbfile(nwbfile: "NWBFile") -> Iterator["NWBFile"]:
+    """
+    Write an NWB file to an HDF5 file held in memory and return it as read
+    back from there, for sample cases whose samples should be what the file
+    becomes once written (e.g., as converted by another tool), without a
+    round trip through a temporary file on disk.  The file read back must be
+    yielded by ``create`` within the context; the sample file is then
+    written by copying everything over from memory.  With pynwb versions
+    which cannot export a file read from another (before 1.4), ``nwbfile``
+    itself is yielded, to be written as is.
+    """
+    from pynwb import NWBHDF5IO
+
+    if not hasattr(NWBHDF5IO, "export"):
+        yield nwbfile
+        return
+
+    def open_io(mode: str) -> NWBHDF5IO:
+        with warnings.catch_warnings():
+            # pynwb recommends a ".nwb" extension for the path, of which
+            # there is none
+            warnings.filterwarnings(
+                "ignore", message="The file path provided: None", category=UserWarning
+            )
+            return NWBHDF5IO(file=h5py.File(buf, mode), mode=mode)
+
+    buf = BytesIO()
+    with open_io("w") as io:
+        io.write(nwbfile)
+    with open_io("r") as io:
+        yield io.read()
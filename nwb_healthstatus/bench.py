@@ -0,0 +1,121 @@
+import os
+from pathlib import Path
+import resource
+import statistics
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Dict, List
+
+import h5py
+
+from .base import iter_blocks
+from .runner import (
+    get_case,
+    get_type_map,
+    open_sample,
+    write_nwbfile,
+)
+
+#: Metrics of a benchmark run which are summarized across repetitions
+TIMED_METRICS = ["create", "write", "read", "test"]
+
+
+def bench_case(casefile: str, casename: str) -> List[Dict[str, Any]]:
+    """
+    Create, write, read and test each sample of the given case in a
+    temporary directory, returning a record of timings (in seconds) and the
+    on-disk size of each sample.  The peak resident memory of the process
+    (in bytes) is recorded as well, so this should be run in a fresh process.
+    """
+    producer, case = get_case(casefile, casename)
+    type_map = get_type_map(case.EXTENSIONS)
+    records = []
+    with TemporaryDirectory() as tmpdir:
+        samples = case.create()
+        while True:
+            start = perf_counter()
+            try:
+                _, filename, nwbfile = next(samples)
+            except StopIteration:
+                break
+            record = {
+                "producer": producer,
+                "case": casename,
+                "file": str(filename),
+                "create": perf_counter() - start,
+            }
+            filepath = Path(tmpdir, "sample.nwb")
+            start = perf_counter()
+            write_nwbfile(nwbfile, filepath, type_map)
+            record["write"] = perf_counter() - start
+            record["size"] = os.path.getsize(str(filepath))
+            with open_sample(filepath, type_map) as io:
+                start = perf_counter()
+                obj = io.read()
+                record["read"] = perf_counter() - start
+                start = perf_counter()
+                case.test(obj)
+                record["test"] = perf_counter() - start
+            record["datasets"] = time_dataset_access(filepath)
+            filepath.unlink()
+            records.append(record)
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    for record in records:
+        record["peak_rss"] = peak
+    return records
+
+
+def time_dataset_access(filepath: Path) -> Dict[str, float]:
+    """
+    Return the time taken to read each dataset in an HDF5 file in full (in
+    memory-bounded blocks), keyed by dataset path
+    """
+    timings = {}
+
+    def visit(name: str, obj: Any) -> None:
+        if isinstance(obj, h5py.Dataset):
+            start = perf_counter()
+            if obj.shape:
+                for block in iter_blocks(obj):
+                    obj[block]
+            else:
+                obj[()]
+            timings[name] = perf_counter() - start
+
+    with h5py.File(str(filepath), "r") as fp:
+        fp.visititems(visit)
+    return timings
+
+
+def summarize(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Summarize the records of repeated benchmark runs per sample file with the
+    minimum and median of each timing, the median dataset access times, and
+    the maximum size & peak memory
+    """
+    by_file = {}
+    for r in records:
+        by_file.setdefault((r["producer"], r["case"], r["file"]), []).append(r)
+    summary = []
+    for (producer, casename, filename), runs in by_file.items():
+        entry = {
+            "producer": producer,
+            "case": casename,
+            "file": filename,
+            "runs": len(runs),
+            "size": max(r["size"] for r in runs),
+            "peak_rss": max(r["peak_rss"] for r in runs),
+        }
+        for metric in TIMED_METRICS:
+            values = [r[metric] for r in runs]
+            entry[metric] = {
+                "min": min(values),
+                "median": statistics.median(values),
+            }
+        entry["datasets"] = {
+            name: statistics.median(r["datasets"].get(name, 0.0) for r in runs)
+            for name in runs[0]["datasets"]
+        }
+        summary.append(entry)
+    return summary
@@ -0,0 +1,293 @@
+from hashlib import sha256
+import io
+import json
+import os
+from pathlib import Path, PurePosixPath
+from typing import IO, Any, Dict, Iterable, List, NamedTuple, Optional, Set, Union
+from zipfile import ZIP_DEFLATED, ZIP_STORED, BadZipFile, ZipFile, ZipInfo
+
+from .checksums import checksums_path
+from .manifest import MANIFEST_NAME, Manifest
+from .store import ROOT_ENVIRONMENT, iter_environments
+
+#: Name of the bundle member holding the index, written last
+INDEX_NAME = ".bundle-index.json"
+
+#: Version of the bundle format recorded in (and required of) the index
+FORMAT_VERSION = 1
+
+
+class BundleMember(NamedTuple):
+    """A file packed in a sample bundle, as recorded in the bundle's index"""
+
+    #: Path of the file relative to the samples directory it was packed from
+    path: str
+    #: One of "sample", "checksums" (a sample's checksum file), or "manifest"
+    kind: str
+    environment: str
+    producer: Optional[str]
+    #: ID of the manifest entry of the case which created the sample
+    case: Optional[str]
+    #: SHA-256 digest of the file's content
+    sha256: str
+    size: int
+    #: Name of the zip member holding the file's content; hardlinked files
+    #: (see `SampleStore`) are stored once, under the first one's path
+    member: str
+    #: Offset in the bundle of the member's data
+    offset: int
+    compressed: bool
+
+    @property
+    def casename(self) -> Optional[str]:
+        """Name of the sample case's class"""
+        if self.case is None:
+            return None
+        return self.case.partition(":")[2].partition("[")[0]
+
+
+def pack_samples(
+    samples_path: Union[str, Path], dest: Union[str, Path, IO[bytes]], compress=False
+) -> List[BundleMember]:
+    """
+    Pack the sample files recorded in the manifests of a samples directory
+    (see `iter_environments`), with their checksum files and the manifests,
+    into a bundle: a zip file whose last member is an index of the files
+    (see `BundleMember`), so that single files can be found and extracted,
+    or opened in place (see `SampleBundle`), without reading the rest.
+    ``dest`` may be a stream which cannot seek, such as a pipe.  Files are
+    stored uncompressed, so that they can be opened in place, unless
+    ``compress`` is true.
+    """
+    root = Path(samples_path)
+    members: List[BundleMember] = []
+    packed: Dict[Any, BundleMember] = {}
+    with ZipFile(dest, "w", allowZip64=True) as zf:
+
+        def add(path: Path, kind: str, env: str, case: Optional[str]) -> None:
+            st = path.stat()
+            producer = case.split("/")[0] if case is not None else None
+            arcname = str(PurePosixPath(*path.relative_to(root).parts))
+            first = packed.get((st.st_dev, st.st_ino))
+            if first is not None:
+                members.append(
+                    first._replace(
+                        path=arcname,
+                        kind=kind,
+                        environment=env,
+                        producer=producer,
+                        case=case,
+                    )
+                )
+                return
+            zinfo = ZipInfo.from_file(str(path), arcname)
+            zinfo.compress_type = ZIP_DEFLATED if compress else ZIP_STORED
+            digest = sha256()
+            with path.open("rb") as fp, zf.open(zinfo, "w") as out:
+                # The member's local header has just been written
+                offset = zf.fp.tell()
+                for block in iter(lambda: fp.read(1 << 20), b""):
+                    digest.update(block)
+                    out.write(block)
+            packed[st.st_dev, st.st_ino] = member = BundleMember(
+                path=arcname,
+                kind=kind,
+                environment=env,
+                producer=producer,
+                case=case,
+                sha256=digest.hexdigest(),
+                size=st.st_size,
+                member=arcname,
+                offset=offset,
+                compressed=compress,
+            )
+            members.append(member)
+
+        for env, envdir in iter_environments(root):
+            manifest = Manifest(envdir / MANIFEST_NAME)
+            for entry_id, entry in sorted(manifest.entries.items()):
+                for f in entry["files"]:
+                    path = envdir / f
+                    if not path.exists():
+                        # Deleted since it was created
+                        continue
+                    add(path, "sample", env, entry_id)
+                    if checksums_path(path).exists():
+                        add(checksums_path(path), "checksums", env, entry_id)
+            add(envdir / MANIFEST_NAME, "manifest", env, None)
+        index = {
+            "format": FORMAT_VERSION,
+            "members": [m._asdict() for m in members],
+        }
+        zf.writestr(INDEX_NAME, json.dumps(index, indent=1), compress_type=ZIP_DEFLATED)
+    return members
+
+
+class SampleBundle:
+    """
+    A sample bundle (see `pack_samples`) open for reading.  Only the zip
+    file's central directory and the index are read on opening.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        try:
+            self.zip = ZipFile(str(path))
+        except BadZipFile as e:
+            raise ValueError(f"{path} is not a sample bundle: {e}")
+        try:
+            with self.zip.open(INDEX_NAME) as fp:
+                index = json.load(fp)
+        except KeyError:
+            self.zip.close()
+            raise ValueError(f"{path} is not a sample bundle: no index")
+        if index.get("format") != FORMAT_VERSION:
+            self.zip.close()
+            raise ValueError(
+                f"{path}: unsupported bundle format {index.get('format')!r}"
+            )
+        self.members = [BundleMember(**m) for m in index["members"]]
+
+    def __enter__(self) -> "SampleBundle":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.zip.close()
+
+    def select(
+        self,
+        casenames: Iterable[str] = (),
+        producers: Iterable[str] = (),
+        paths: Iterable[str] = (),
+    ) -> List[BundleMember]:
+        """
+        Return the sample files (and their checksum files) of the given case
+        names and producers, and those at the given paths (all, if no
+        criteria are given)
+        """
+        casenames = set(casenames)
+        producers = set(producers)
+        paths = {str(PurePosixPath(p)) for p in paths}
+        samples = [
+            m
+            for m in self.members
+            if m.kind == "sample"
+            and (not casenames or m.casename in casenames)
+            and (not producers or m.producer in producers)
+            and (not paths or m.path in paths)
+        ]
+        sidecars = {str(checksums_path(m.path)) for m in samples}
+        return samples + [
+            m for m in self.members if m.kind == "checksums" and m.path in sidecars
+        ]
+
+    def open(self, member: BundleMember) -> IO[bytes]:
+        """
+        Open a file in the bundle for reading, in place if it is stored
+        uncompressed.  An HDF5 file opened in place can be read with
+        ``h5py.File(bundle.open(member), "r")``.
+        """
+        if member.compressed:
+            return self.zip.open(member.member)
+        return io.BufferedReader(
+            MemberFile(self.path, member.offset, member.size), 1 << 16
+        )
+
+    def extract(self, member: BundleMember, samples_path: Union[str, Path]) -> Path:
+        """
+        Extract a file into the samples directory it was packed from, checking
+        its content against its digest, and return its path
+        """
+        path = Path(samples_path, *PurePosixPath(member.path).parts)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmppath = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        digest = sha256()
+        try:
+            with self.open(member) as fp, tmppath.open("wb") as out:
+                for block in iter(lambda: fp.read(1 << 20), b""):
+                    digest.update(block)
+                    out.write(block)
+            if digest.hexdigest() != member.sha256:
+                raise ValueError(
+                    f"{self.path}: {member.path} does not match its digest"
+                )
+            os.replace(str(tmppath), str(path))
+        except BaseException:
+            if tmppath.exists():
+                tmppath.unlink()
+            raise
+        return path
+
+    def unpack(
+        self, members: Iterable[BundleMember], samples_path: Union[str, Path]
+    ) -> List[Path]:
+        """
+        Extract the given files into a samples directory and add the manifest
+        entries of their cases to the directory's manifests
+        """
+        root = Path(samples_path)
+        members = list(members)
+        paths = [self.extract(m, root) for m in members]
+        cases: Dict[str, Set[Optional[str]]] = {}
+        for m in members:
+            cases.setdefault(m.environment, set()).add(m.case)
+        for m in self.members:
+            if m.kind == "manifest" and m.environment in cases:
+                with self.open(m) as fp:
+                    entries = json.load(fp)
+                envdir = (
+                    root if m.environment == ROOT_ENVIRONMENT else root / m.environment
+                )
+                manifest = Manifest(envdir / MANIFEST_NAME)
+                for entry_id in cases[m.environment] & set(entries):
+                    manifest.entries[entry_id] = entries[entry_id]
+                manifest.save()
+        return paths
+
+
+class MemberFile(io.RawIOBase):
+    """
+    A read-only file object for a range of bytes (an uncompressed member) of
+    a bundle, read with ``pread`` so that each one has its own position
+    """
+
+    def __init__(self, path: Union[str, Path], offset: int, size: int) -> None:
+        super().__init__()
+        self.fd = os.open(str(path), os.O_RDONLY)
+        self.offset = offset
+        self.size = size
+        self.pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, pos: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            pos += self.pos
+        elif whence == io.SEEK_END:
+            pos += self.size
+        if pos < 0:
+            raise ValueError(f"Negative seek position {pos}")
+        self.pos = pos
+        return pos
+
+    def tell(self) -> int:
+        return self.pos
+
+    def readinto(self, buf: Any) -> int:
+        n = max(0, min(len(buf), self.size - self.pos))
+        data = os.pread(self.fd, n, self.offset + self.pos) if n else b""
+        buf[: len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            os.close(self.fd)
+        super().close()
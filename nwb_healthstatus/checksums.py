@@ -0,0 +1,127 @@
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import h5py
+
+from .h5hash import get_extents, hash_extent, hash_values
+
+#: Checksum algorithm recorded in (and required of) checksum files
+ALGORITHM = "blake2b-128"
+
+
+def checksums_path(filepath: Union[str, Path]) -> Path:
+    """
+    Return the path of the (hidden, so as not to be taken for a sample)
+    checksum file of a sample file
+    """
+    p = Path(filepath)
+    return p.with_name(f".{p.name}.checksums.json")
+
+
+def compute_checksums(
+    filepath: Union[str, Path], workers: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Compute a checksum of each dataset in an HDF5 file.  Datasets whose
+    values are fully determined by their stored bytes are checksummed from
+    those bytes, chunk by chunk, read straight from the file by up to
+    ``workers`` threads; the others (those with variable-length or reference
+    values) are checksummed from their values, read in blocks via h5py.
+    """
+    datasets: List[h5py.Dataset] = []
+    with h5py.File(str(filepath), "r") as f:
+        f.visititems(
+            lambda _, obj: (
+                datasets.append(obj) if isinstance(obj, h5py.Dataset) else None
+            )
+        )
+        checksums = {}
+        fd = os.open(str(filepath), os.O_RDONLY)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                stored = {}
+                for dset in datasets:
+                    extents = get_extents(dset)
+                    if extents is not None:
+                        stored[dset.name] = [
+                            (e.key, pool.submit(hash_extent, fd, e)) for e in extents
+                        ]
+                # Hash the remaining datasets while the threads are busy
+                for dset in datasets:
+                    if dset.name not in stored:
+                        checksums[dset.name] = {
+                            "method": "values",
+                            "digest": hash_values(dset),
+                        }
+                for name, chunks in stored.items():
+                    digest = blake2b(digest_size=16)
+                    for key, future in chunks:
+                        digest.update(f"{key}:{future.result()}\n".encode("utf-8"))
+                    checksums[name] = {
+                        "method": "stored",
+                        "chunks": len(chunks),
+                        "digest": digest.hexdigest(),
+                    }
+        finally:
+            os.close(fd)
+        for dset in datasets:
+            checksums[dset.name].update(
+                dtype=str(dset.dtype),
+                shape=list(dset.shape) if dset.shape is not None else None,
+            )
+    return {
+        "algorithm": ALGORITHM,
+        "size": os.stat(str(filepath)).st_size,
+        "datasets": dict(sorted(checksums.items())),
+    }
+
+
+def write_checksums(
+    filepath: Union[str, Path], workers: Optional[int] = None
+) -> Dict[str, Any]:
+    """Compute the checksums of a sample file and save them in its checksum file"""
+    checksums = compute_checksums(filepath, workers)
+    path = checksums_path(filepath)
+    tmppath = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmppath.open("w") as fp:
+        json.dump(checksums, fp, indent=1)
+    os.replace(str(tmppath), str(path))
+    return checksums
+
+
+def verify_file(
+    filepath: Union[str, Path], workers: Optional[int] = None
+) -> Optional[List[str]]:
+    """
+    Recompute the checksums of a sample file and return descriptions of how
+    they differ from those in its checksum file, or `None` if it has no
+    checksum file
+    """
+    try:
+        with checksums_path(filepath).open() as fp:
+            expected = json.load(fp)
+    except FileNotFoundError:
+        return None
+    if expected.get("algorithm") != ALGORITHM:
+        return [f"unsupported checksum algorithm {expected.get('algorithm')!r}"]
+    actual = compute_checksums(filepath, workers)
+    problems = []
+    if actual["size"] != expected["size"]:
+        problems.append(f"size is {actual['size']}, expected {expected['size']}")
+    for name in sorted(set(expected["datasets"]) | set(actual["datasets"])):
+        exp = expected["datasets"].get(name)
+        act = actual["datasets"].get(name)
+        if act is None:
+            problems.append(f"{name}: missing")
+        elif exp is None:
+            problems.append(f"{name}: not in checksum file")
+        elif act != exp:
+            changed = [
+                k for k in sorted(set(act) | set(exp)) if act.get(k) != exp.get(k)
+            ]
+            problems.append(f"{name}: {', '.join(changed)} changed")
+    return problems
@@ -0,0 +1,376 @@
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+import os
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import h5py
+import numpy as np
+
+from .base import iter_blocks
+from .h5hash import (
+    PIECE_BYTES,
+    Extent,
+    dereference,
+    get_extents,
+    get_layout,
+    hash_extent,
+    read_values,
+)
+
+#: Patterns of paths (with attributes as ``path@name``) that differ between
+#: any two NWB files and so are ignored by default
+DEFAULT_IGNORE = ["*@object_id", "/file_create_date"]
+
+#: Dataset creation properties compared between datasets
+STORAGE_PROPERTIES = [
+    "chunks",
+    "compression",
+    "compression_opts",
+    "shuffle",
+    "fletcher32",
+    "scaleoffset",
+]
+
+
+class Difference(NamedTuple):
+    #: Path of the differing object in the files, with attributes given as
+    #: ``path@name``
+    path: str
+    #: What differs, e.g., ``"missing"``, ``"type"``, ``"dtype"``, or
+    #: ``"data"``
+    kind: str
+    #: Descriptions of the differing property in each file (`None` for
+    #: ``"missing"`` if the object is not in that file)
+    a: Optional[str] = None
+    b: Optional[str] = None
+
+    def __str__(self) -> str:
+        if self.kind == "missing":
+            return f"{self.path}: only in {'A' if self.b is None else 'B'}"
+        return f"{self.path}: {self.kind} differs: {self.a} != {self.b}"
+
+
+class DiffReport(NamedTuple):
+    differences: List[Difference]
+    groups: int
+    datasets: int
+    #: Number of bytes hashed to compare the datasets' stored data
+    hashed: int
+
+
+class _DatasetPair(NamedTuple):
+    path: str
+    a: h5py.Dataset
+    b: h5py.Dataset
+    #: Stored extents of each dataset, if their stored bytes can be compared
+    extents: Optional[Tuple[List[Extent], List[Extent]]]
+
+
+def diff_files(
+    path_a: Union[str, Path],
+    path_b: Union[str, Path],
+    ignore: Iterable[str] = DEFAULT_IGNORE,
+    workers: Optional[int] = None,
+) -> DiffReport:
+    """
+    Compare two HDF5 files structurally: their groups, links, attributes,
+    datasets' dtypes, shapes & storage settings, and datasets' contents.
+    Objects & attributes whose paths match any of the ``ignore`` patterns
+    are skipped.
+
+    Datasets stored alike in both files are compared by hashing their
+    stored chunks (up to ``workers`` at once), read straight from the files;
+    only chunks whose stored bytes differ are read through HDF5 and compared
+    value by value.  Other datasets are compared value by value in blocks.
+    """
+    ignore = list(ignore)
+    differences: List[Difference] = []
+    pairs: List[_DatasetPair] = []
+    counts = {"groups": 0, "datasets": 0}
+    with h5py.File(str(path_a), "r") as fa, h5py.File(str(path_b), "r") as fb:
+        _walk_groups(fa, fb, ignore, differences, pairs, counts)
+        hashed = _compare_data(str(path_a), str(path_b), pairs, differences, workers)
+    # Report data differences in tree order, after the other differences of
+    # the same dataset
+    differences.sort(key=lambda d: (d.path.split("@")[0].split("/"), d.kind == "data"))
+    return DiffReport(differences, counts["groups"], counts["datasets"], hashed)
+
+
+def _ignored(path: str, ignore: List[str]) -> bool:
+    return any(fnmatch(path, pat) for pat in ignore)
+
+
+def _walk_groups(
+    ga: h5py.Group,
+    gb: h5py.Group,
+    ignore: List[str],
+    differences: List[Difference],
+    pairs: List[_DatasetPair],
+    counts: Dict[str, int],
+) -> None:
+    counts["groups"] += 1
+    _compare_attrs(ga, gb, ignore, differences)
+    for name in sorted(set(ga.keys()) | set(gb.keys())):
+        path = f"{ga.name.rstrip('/')}/{name}"
+        if _ignored(path, ignore):
+            continue
+        la = ga.get(name, getlink=True)
+        lb = gb.get(name, getlink=True)
+        if la is None or lb is None:
+            differences.append(
+                Difference(
+                    path,
+                    "missing",
+                    None if la is None else _describe_link(la),
+                    None if lb is None else _describe_link(lb),
+                )
+            )
+            continue
+        if not isinstance(la, h5py.HardLink) or not isinstance(lb, h5py.HardLink):
+            # Compare links by their targets rather than following them
+            if _describe_link(la) != _describe_link(lb):
+                differences.append(
+                    Difference(path, "link", _describe_link(la), _describe_link(lb))
+                )
+            continue
+        oa = ga[name]
+        ob = gb[name]
+        if isinstance(oa, h5py.Group) and isinstance(ob, h5py.Group):
+            _walk_groups(oa, ob, ignore, differences, pairs, counts)
+        elif isinstance(oa, h5py.Dataset) and isinstance(ob, h5py.Dataset):
+            _compare_datasets(path, oa, ob, ignore, differences, pairs)
+            counts["datasets"] += 1
+        else:
+            differences.append(
+                Difference(path, "type", type(oa).__name__, type(ob).__name__)
+            )
+
+
+def _describe_link(link: Any) -> str:
+    if isinstance(link, h5py.SoftLink):
+        return f"soft link to {link.path}"
+    elif isinstance(link, h5py.ExternalLink):
+        return f"external link to {link.filename}:{link.path}"
+    else:
+        return "object"
+
+
+def _compare_attrs(
+    oa: Any, ob: Any, ignore: List[str], differences: List[Difference]
+) -> None:
+    for name in sorted(set(oa.attrs.keys()) | set(ob.attrs.keys())):
+        path = f"{oa.name}@{name}"
+        if _ignored(path, ignore):
+            continue
+        if name not in oa.attrs or name not in ob.attrs:
+            differences.append(
+                Difference(
+                    path,
+                    "missing",
+                    "attribute" if name in oa.attrs else None,
+                    "attribute" if name in ob.attrs else None,
+                )
+            )
+            continue
+        ida = oa.attrs.get_id(name)
+        idb = ob.attrs.get_id(name)
+        if ida.dtype != idb.dtype:
+            differences.append(
+                Difference(path, "attribute dtype", str(ida.dtype), str(idb.dtype))
+            )
+        elif ida.shape != idb.shape:
+            differences.append(
+                Difference(path, "attribute shape", str(ida.shape), str(idb.shape))
+            )
+        else:
+            va = _dereference_attr(oa.attrs[name], oa.file)
+            vb = _dereference_attr(ob.attrs[name], ob.file)
+            if not _values_equal(va, vb):
+                differences.append(
+                    Difference(path, "attribute value", _brief(va), _brief(vb))
+                )
+
+
+def _dereference_attr(value: Any, f: h5py.File) -> Any:
+    if isinstance(value, h5py.Empty):
+        return None
+    if isinstance(value, h5py.Reference) or (
+        isinstance(value, np.ndarray) and value.dtype.hasobject
+    ):
+        return dereference(value, f)
+    return value
+
+
+def _compare_datasets(
+    path: str,
+    da: h5py.Dataset,
+    db: h5py.Dataset,
+    ignore: List[str],
+    differences: List[Difference],
+    pairs: List[_DatasetPair],
+) -> None:
+    _compare_attrs(da, db, ignore, differences)
+    comparable = True
+    for kind, va, vb in [
+        ("dtype", da.dtype, db.dtype),
+        ("shape", da.shape, db.shape),
+        ("maxshape", da.maxshape, db.maxshape),
+    ]:
+        if va != vb:
+            differences.append(Difference(path, kind, str(va), str(vb)))
+            if kind != "maxshape":
+                comparable = False
+    storage_a = [get_layout(da)] + [getattr(da, p) for p in STORAGE_PROPERTIES]
+    storage_b = [get_layout(db)] + [getattr(db, p) for p in STORAGE_PROPERTIES]
+    for prop, va, vb in zip(["layout"] + STORAGE_PROPERTIES, storage_a, storage_b):
+        if va != vb:
+            differences.append(Difference(path, prop, str(va), str(vb)))
+    if not comparable:
+        return
+    extents = None
+    if storage_a == storage_b:
+        ea = get_extents(da)
+        eb = get_extents(db)
+        if ea is not None and eb is not None:
+            extents = (ea, eb)
+    pairs.append(_DatasetPair(path, da, db, extents))
+
+
+def _compare_data(
+    path_a: str,
+    path_b: str,
+    pairs: List[_DatasetPair],
+    differences: List[Difference],
+    workers: Optional[int],
+) -> int:
+    jobs = [
+        (i, e)
+        for p in pairs
+        if p.extents is not None
+        for i, extents in enumerate(p.extents)
+        for e in extents
+    ]
+    fds = [os.open(path_a, os.O_RDONLY), os.open(path_b, os.O_RDONLY)]
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            digests = dict(
+                zip(jobs, pool.map(lambda job: hash_extent(fds[job[0]], job[1]), jobs))
+            )
+    finally:
+        for fd in fds:
+            os.close(fd)
+    for p in pairs:
+        if p.extents is None:
+            diff = _first_difference(p.a, p.b, iter_blocks(p.a))
+        else:
+            diff = _first_difference(p.a, p.b, _mismatched_selections(p, digests))
+        if diff is not None:
+            differences.append(Difference(p.path, "data", *diff))
+    return sum(e.size for _, e in jobs)
+
+
+def _mismatched_selections(
+    pair: _DatasetPair, digests: Dict[Tuple[int, Extent], str]
+) -> Iterator[Any]:
+    """
+    Yield selections of the parts of the datasets whose stored bytes differ.
+    Stored bytes may differ even though the values do not (e.g., when a
+    chunk of fill values is written in one file but not in the other), so
+    the values still need to be compared.
+    """
+    by_key = [
+        {e.key: digests[i, e] for e in extents}
+        for i, extents in enumerate(pair.extents)
+    ]
+    mismatched = sorted(
+        k
+        for k in set(by_key[0]) | set(by_key[1])
+        if by_key[0].get(k) != by_key[1].get(k)
+    )
+    if pair.a.chunks is None:
+        # Contiguous data is hashed in pieces of PIECE_BYTES bytes
+        if not pair.a.shape:
+            yield ()
+            return
+        row_bytes = pair.a.dtype.itemsize * int(
+            np.prod(pair.a.shape[1:], dtype=np.int64)
+        )
+        row_bytes = max(row_bytes, 1)
+        for (start,) in mismatched:
+            yield slice(start // row_bytes, -(-(start + PIECE_BYTES) // row_bytes))
+    else:
+        for key in mismatched:
+            yield tuple(
+                slice(o, min(o + c, n))
+                for o, c, n in zip(key, pair.a.chunks, pair.a.shape)
+            )
+
+
+def _first_difference(
+    da: h5py.Dataset, db: h5py.Dataset, selections: Iterable[Any]
+) -> Optional[Tuple[str, str]]:
+    """
+    Compare the values of the datasets in the given selections, returning
+    descriptions of the first differing values
+    """
+    if not da.shape:
+        va, vb = read_values(da), read_values(db)
+        return None if _values_equal(va, vb) else (_brief(va), _brief(vb))
+    for sel in selections:
+        va = read_values(da, sel)
+        vb = read_values(db, sel)
+        if _values_equal(va, vb):
+            continue
+        if isinstance(va, np.ndarray) and isinstance(vb, np.ndarray):
+            unequal = va != vb
+            if va.dtype.kind in "fc":
+                unequal &= ~(np.isnan(va) & np.isnan(vb))
+            index = tuple(int(i[0]) for i in np.nonzero(unequal))
+        else:
+            index = next(
+                (i,) for i, (x, y) in enumerate(zip(va, vb)) if not _values_equal(x, y)
+            )
+        starts = [s.start for s in (sel if isinstance(sel, tuple) else (sel,))]
+        starts += [0] * (len(index) - len(starts))
+        position = [start + i for start, i in zip(starts, index)]
+        return (
+            f"{_brief(_item(va, index))} at {position}",
+            _brief(_item(vb, index)),
+        )
+    return None
+
+
+def _item(values: Any, index: Tuple[int, ...]) -> Any:
+    for i in index:
+        values = values[i]
+    return values
+
+
+def _values_equal(va: Any, vb: Any) -> bool:
+    if isinstance(va, np.ndarray) or isinstance(vb, np.ndarray):
+        va = np.asarray(va)
+        vb = np.asarray(vb)
+        if va.shape != vb.shape or va.dtype.kind != vb.dtype.kind:
+            return False
+        if va.dtype.kind in "fc":
+            return bool(np.array_equal(va, vb, equal_nan=True))
+        return bool(np.array_equal(va, vb))
+    return va == vb
+
+
+def _brief(value: Any, limit: int = 80) -> str:
+    if isinstance(value, (np.ndarray, np.generic)):
+        value = value.tolist()
+    s = repr(value)
+    return s if len(s) <= limit else s[: limit - 3] + "..."
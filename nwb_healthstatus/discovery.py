@@ -0,0 +1,188 @@
+from hashlib import sha256
+import json
+import os
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Union
+
+from appdirs import user_cache_dir
+
+from .pool import run_jobs
+
+#: Default location of the cached case discovery index
+DEFAULT_INDEX_PATH = Path(user_cache_dir("nwb-healthstatus", "dandi"), "cases.json")
+
+#: Prefix of the environment variables with which case files may be
+#: configured, such as ``NWB_HEALTHSTATUS_EPHY_TESTING_DATA``
+ENV_PREFIX = "NWB_HEALTHSTATUS_"
+
+
+class IndexedCase(NamedTuple):
+    name: str
+    extensions: List[str]
+    #: The case's ``FILENAME``, if it has one
+    filename: Optional[str]
+    inputs: List[str]
+    #: The case's size parameters (``PARAMS``) and their default values
+    params: Dict[str, float] = {}
+    #: The case's ``NUM_SAMPLES``, if it has one
+    num_samples: Optional[int] = None
+
+
+class IndexedFile(NamedTuple):
+    path: str
+    producer: str
+    cases: List[IndexedCase]
+    #: Top-level packages imported by the case file
+    packages: List[str]
+
+
+def parse_scale(spec: str) -> Dict[str, Union[int, float]]:
+    """
+    Parse size parameters given as comma-separated ``name=value`` pairs
+    (e.g., ``"ncells=10000,serie_length=1e6"``), converting integral
+    values to ints.
+    """
+    scale = {}
+    for item in spec.split(","):
+        name, sep, value = item.partition("=")
+        name = name.strip()
+        if not sep or not name:
+            raise ValueError(f"Invalid size parameter {item!r}; expected NAME=VALUE")
+        v = float(value)
+        scale[name] = int(v) if v.is_integer() else v
+    return scale
+
+
+def get_scale_dir(scale: Optional[Dict[str, Union[int, float]]]) -> str:
+    """
+    Return the name of the directory (relative to the producer's directory)
+    in which the samples created with the given size parameters are stored,
+    or the empty string if no parameters are given
+    """
+    if not scale:
+        return ""
+    return "scale-" + ",".join(f"{k}={v}" for k, v in sorted(scale.items()))
+
+
+def get_sample_files(
+    producer: str,
+    case: IndexedCase,
+    samples_path: Union[str, Path],
+    scale: Optional[Dict[str, Union[int, float]]] = None,
+) -> List[Path]:
+    """
+    Return the paths of the sample files for the given case (created with
+    the given size parameters, if any): either its ``FILENAME`` or, for
+    cases producing multiple files, all files under a directory named after
+    the case class
+    """
+    base = Path(samples_path, producer, get_scale_dir(scale))
+    if case.filename is not None:
+        return [base / case.filename]
+    casedir = base / case.name
+    return sorted(
+        p for p in casedir.rglob("*") if p.is_file() and not p.name.startswith(".")
+    )
+
+
+def describe_casefile(casefile: str) -> Dict[str, Any]:
+    """
+    Execute a case file and return a JSON-able description of it for the
+    index.  This imports whatever the case file imports, and so should be run
+    in a separate process.
+    """
+    from .base import get_cases_in_namespace
+    from .runner import load_casefile
+
+    _, namespace = load_casefile(casefile)
+    packages = set()
+    for obj in namespace.values():
+        if isinstance(obj, ModuleType):
+            packages.add(obj.__name__.split(".")[0])
+        elif isinstance(getattr(obj, "__module__", None), str):
+            packages.add(obj.__module__.split(".")[0])
+    packages.discard("builtins")
+    return {
+        "cases": [
+            {
+                "name": casecls.__name__,
+                "extensions": sorted(casecls.EXTENSIONS),
+                "filename": getattr(casecls, "FILENAME", None),
+                "inputs": [str(p) for p in getattr(casecls, "INPUTS", [])],
+                "params": dict(getattr(casecls, "PARAMS", {})),
+                "num_samples": getattr(casecls, "NUM_SAMPLES", None),
+            }
+            for casecls in get_cases_in_namespace(namespace)
+        ],
+        "packages": sorted(packages),
+    }
+
+
+def hash_casefile(path: Union[str, Path]) -> str:
+    """
+    Return the key of a case file's index entry: a digest of its content
+    and of the `ENV_PREFIX` environment variables, on which what the case
+    file defines (e.g., a case's ``INPUTS``) may depend
+    """
+    with open(path, "rb") as fp:
+        digest = sha256(fp.read())
+    for name, value in sorted(os.environ.items()):
+        if name.startswith(ENV_PREFIX):
+            digest.update(f"\0{name}={value}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class CaseIndex:
+    """
+    A cache, stored in a JSON file, of the sample cases defined in each case
+    file, keyed by the hash of the file's content (see `hash_casefile`), so
+    that cases can be listed and scheduled without executing their case files
+    """
+
+    def __init__(self, path: Union[str, Path] = DEFAULT_INDEX_PATH) -> None:
+        self.path = Path(path)
+        try:
+            with self.path.open() as fp:
+                self.entries = json.load(fp)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+        self.changed = False
+
+    def scan(
+        self, casefiles: Iterable[Union[str, Path]], workers: int = 1
+    ) -> Dict[str, IndexedFile]:
+        """
+        Return the index entries for the given case files (keyed by the paths
+        as given), describing any files not yet in the index (up to
+        ``workers`` at once) in separate processes.  Raises `RuntimeError` if
+        a case file cannot be executed.
+        """
+        digests = {str(p): hash_casefile(p) for p in casefiles}
+        missing = sorted({(p,) for p, d in digests.items() if d not in self.entries})
+        for (path,), outcome in run_jobs(
+            f"{__name__}:describe_casefile", missing, workers, isolate=True
+        ):
+            if not outcome.ok:
+                raise RuntimeError(f"Could not load case file {path}:\n{outcome.error}")
+            self.entries[digests[path]] = outcome.value
+            self.changed = True
+        return {
+            p: IndexedFile(
+                path=p,
+                producer=Path(p).resolve().parent.name,
+                cases=[IndexedCase(**c) for c in self.entries[d]["cases"]],
+                packages=self.entries[d]["packages"],
+            )
+            for p, d in digests.items()
+        }
+
+    def save(self) -> None:
+        if not self.changed:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmppath = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with tmppath.open("w") as fp:
+            json.dump(self.entries, fp, indent=2, sort_keys=True)
+        os.replace(str(tmppath), str(self.path))
+        self.changed = False
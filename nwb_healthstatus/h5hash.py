@@ -0,0 +1,156 @@
+from hashlib import blake2b
+import os
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+import h5py
+import numpy as np
+
+from .base import DEFAULT_BLOCK_BYTES, iter_blocks
+
+#: Size of the pieces into which contiguous datasets are split for hashing
+PIECE_BYTES = 64 * 1024 * 1024
+
+
+class Extent(NamedTuple):
+    """A range of bytes in an HDF5 file storing (part of) a dataset"""
+
+    #: The offset in the dataset of the chunk stored in the extent, or, for a
+    #: contiguous dataset, the offset in bytes of the piece within it
+    key: Tuple[int, ...]
+    #: Offset of the extent in the file
+    offset: int
+    size: int
+    #: Mask of the filters *not* applied to the chunk
+    filter_mask: int = 0
+
+
+def get_layout(dset: h5py.Dataset) -> str:
+    """
+    Return how a dataset is stored: ``"chunked"``, ``"contiguous"``,
+    ``"compact"``, ``"external"``, or ``"virtual"``
+    """
+    if dset.is_virtual:
+        return "virtual"
+    if dset.external:
+        return "external"
+    layout = dset.id.get_create_plist().get_layout()
+    if layout == h5py.h5d.CHUNKED:
+        return "chunked"
+    elif layout == h5py.h5d.CONTIGUOUS:
+        return "contiguous"
+    else:
+        return "compact"
+
+
+def has_raw_values(dtype: np.dtype) -> bool:
+    """
+    Returns true iff the stored bytes of data of the given dtype determine
+    its values, i.e., it has no variable-length or reference types, which
+    are stored as pointers into the file
+    """
+    return not dtype.hasobject
+
+
+def get_extents(dset: h5py.Dataset) -> Optional[List[Extent]]:
+    """
+    Return the extents of the file storing the dataset's data as is (i.e.,
+    after any filters, such as compression), in order, or `None` if the
+    data's stored bytes cannot be used in its place (because the dataset has
+    variable-length or reference values, or is not stored in the file
+    itself).  Chunks which have not been written are omitted.
+    """
+    if not has_raw_values(dset.dtype):
+        return None
+    layout = get_layout(dset)
+    if layout == "contiguous":
+        offset = dset.id.get_offset()
+        if offset is None:
+            return []
+        size = dset.id.get_storage_size()
+        return [
+            Extent((start,), offset + start, min(PIECE_BYTES, size - start))
+            for start in range(0, size, PIECE_BYTES)
+        ]
+    elif layout == "chunked":
+        extents = []
+
+        def add(info: Any) -> None:
+            extents.append(
+                Extent(
+                    tuple(info.chunk_offset),
+                    info.byte_offset,
+                    info.size,
+                    info.filter_mask,
+                )
+            )
+
+        try:
+            dset.id.chunk_iter(add)
+        except (AttributeError, NotImplementedError):  # h5py < 3.8 or HDF5 < 1.12.3
+            extents = []
+            for i in range(dset.id.get_num_chunks()):
+                add(dset.id.get_chunk_info(i))
+        return extents
+    else:
+        return None
+
+
+def hash_extent(fd: int, extent: Extent) -> str:
+    """Compute the BLAKE2 digest of an extent of the file open as ``fd``"""
+    digest = blake2b(digest_size=16)
+    digest.update(extent.filter_mask.to_bytes(4, "little"))
+    pos = extent.offset
+    end = extent.offset + extent.size
+    while pos < end:
+        block = os.pread(fd, min(1 << 22, end - pos), pos)
+        if not block:
+            raise OSError(f"Unexpected end of file at offset {pos}")
+        digest.update(block)
+        pos += len(block)
+    return digest.hexdigest()
+
+
+def read_values(dset: h5py.Dataset, selection: Any = ()) -> Any:
+    """
+    Read (a selection of) a dataset, with any references replaced by the
+    names of the objects they point to, so that the values can be compared
+    with those of a dataset in another file
+    """
+    values = dset[selection]
+    if isinstance(values, np.ndarray) and not values.dtype.hasobject:
+        return values
+    return dereference(values, dset.file)
+
+
+def dereference(value: Any, f: h5py.File) -> Any:
+    """
+    Replace any references in a value read from an HDF5 file (converting
+    arrays to lists) with the names of the objects they point to
+    """
+    if isinstance(value, h5py.Reference):
+        return f[value].name if value else None
+    elif isinstance(value, np.ndarray):
+        return dereference(value.tolist(), f)
+    elif isinstance(value, (list, tuple)):
+        return [dereference(v, f) for v in value]
+    else:
+        return value
+
+
+def hash_values(dset: h5py.Dataset, max_bytes: int = DEFAULT_BLOCK_BYTES) -> str:
+    """
+    Compute the BLAKE2 digest of a dataset's dtype, shape and values, read
+    in blocks of at most ``max_bytes`` bytes
+    """
+    digest = blake2b(digest_size=16)
+    digest.update(f"{dset.dtype.str}{dset.shape}".encode("utf-8"))
+    if dset.shape is None:
+        return digest.hexdigest()
+    blocks = iter_blocks(dset, max_bytes) if dset.shape else [()]
+    for sl in blocks:
+        values = read_values(dset, sl)
+        if isinstance(values, np.ndarray):
+            digest.update(np.ascontiguousarray(values).tobytes())
+        else:
+            digest.update(repr(values).encode("utf-8"))
+    return digest.hexdigest()
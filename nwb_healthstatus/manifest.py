@@ -0,0 +1,183 @@
+from hashlib import sha256
+from importlib import import_module
+import json
+import os
+from pathlib import Path
+import platform
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+#: Name of the file, at the top of the samples directory, in which the keys
+#: of the created samples are recorded
+MANIFEST_NAME = "manifest.json"
+
+#: Packages whose versions always contribute to a sample's key
+CORE_PACKAGES = ["h5py", "hdmf", "numpy", "pynwb"]
+
+#: Modules of this package which take part in creating and writing samples
+#: (the helpers used by case files, and `runner.write_nwbfile`), whose
+#: sources always contribute to a sample's key
+HELPER_MODULES = ["base", "runner"]
+
+
+def get_versions(packages: Iterable[str] = ()) -> Dict[str, str]:
+    """
+    Return the versions of Python, the core packages, and those of the given
+    top-level packages that are installed distributions
+    """
+    versions = {"python": platform.python_version()}
+    for name in sorted(set(CORE_PACKAGES).union(packages)):
+        version = get_package_version(name)
+        if version is not None:
+            versions[name] = version
+    return versions
+
+
+def get_package_version(name: str) -> Optional[str]:
+    """
+    Return the version of the installed distribution with the given name,
+    looked up without importing it where possible
+    """
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:  # Python < 3.8
+        try:
+            module = import_module(name)
+        except ImportError:
+            return None
+        v = getattr(module, "__version__", None)
+        return str(v) if v is not None else None
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return None
+
+
+def hash_inputs(paths: List[Union[str, Path]], base: Path) -> str:
+    """
+    Compute a digest of the given files and directories (relative paths are
+    resolved against ``base``) without reading them: symlinks are hashed by
+    their targets, so that git-annex'ed files are hashed by their annex
+    keys, and other files by their sizes and modification times.  ``.git``
+    directories are skipped.
+    """
+    digest = sha256()
+    for p in paths:
+        p = base / p
+        digest.update(str(p).encode("utf-8"))
+        if not p.exists() and not p.is_symlink():
+            digest.update(b"\0missing")
+            continue
+        files = [p] if not p.is_dir() else _walk_files(p)
+        for f in files:
+            digest.update(b"\0" + str(f.relative_to(p)).encode("utf-8"))
+            if f.is_symlink():
+                digest.update(b"\0->" + os.readlink(str(f)).encode("utf-8"))
+            else:
+                st = f.stat()
+                digest.update(f"\0{st.st_size}:{st.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def hash_helpers() -> str:
+    """Compute a digest of the sources of the `HELPER_MODULES`"""
+    digest = sha256()
+    for name in HELPER_MODULES:
+        digest.update(Path(__file__).with_name(f"{name}.py").read_bytes())
+    return digest.hexdigest()
+
+
+def _walk_files(dirpath: Path) -> List[Path]:
+    files = []
+    for root, dirs, filenames in os.walk(str(dirpath)):
+        dirs[:] = sorted(d for d in dirs if d != ".git")
+        files.extend(Path(root, f) for f in sorted(filenames))
+    return files
+
+
+def get_case_key(
+    casefile: Union[str, Path], inputs: List[str], packages: Iterable[str]
+) -> Dict[str, Any]:
+    """
+    Return a description of everything the samples created by a case depend
+    on (the case file's source, the case's declared ``INPUTS``, the sources
+    of the `HELPER_MODULES`, and the versions of the packages the case file
+    imports), with the overall digest of it all stored under ``"key"``
+    """
+    p = Path(casefile)
+    description = {
+        "source": sha256(p.read_bytes()).hexdigest(),
+        "helpers": hash_helpers(),
+        "inputs": hash_inputs(inputs, p.resolve().parent),
+        "versions": get_versions(packages),
+    }
+    description["key"] = sha256(
+        json.dumps(description, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return description
+
+
+class Manifest:
+    """
+    A record, stored in a JSON file, of the key each sample case had when its
+    samples were last created and of the files it created
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        try:
+            with self.path.open() as fp:
+                self.entries = json.load(fp)
+        except FileNotFoundError:
+            self.entries = {}
+
+    def is_current(self, entry_id: str, key: Dict[str, Any]) -> bool:
+        """
+        Returns true iff the case's recorded key matches ``key``, all of its
+        samples were created, and all of the case's recorded files still exist
+        """
+        entry = self.entries.get(entry_id)
+        return (
+            entry is not None
+            and entry["key"] == key["key"]
+            and entry.get("complete", True)
+            and all((self.path.parent / f).exists() for f in entry["files"])
+        )
+
+    def is_stale(self, entry_id: str, key: Dict[str, Any]) -> bool:
+        """
+        Returns true unless the case has an entry recorded with ``key``,
+        i.e., unless any existing files of the case are known to have been
+        created from the current inputs (those of an incomplete entry
+        included)
+        """
+        entry = self.entries.get(entry_id)
+        return entry is None or entry["key"] != key["key"]
+
+    def record(
+        self,
+        entry_id: str,
+        key: Dict[str, Any],
+        files: List[str],
+        complete: bool = True,
+    ) -> None:
+        """
+        Record the files created by a case.  The files of a case whose
+        samples have not all been created (yet) are recorded with
+        ``complete`` false, and the entry is not current until they are.
+        """
+        self.entries[entry_id] = {
+            "key": key["key"],
+            "depends": {k: v for k, v in key.items() if k != "key"},
+            "files": sorted(str(Path(f).relative_to(self.path.parent)) for f in files),
+            "complete": complete,
+        }
+
+    def discard(self, entry_id: str) -> None:
+        self.entries.pop(entry_id, None)
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmppath = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with tmppath.open("w") as fp:
+            json.dump(self.entries, fp, indent=2, sort_keys=True)
+        os.replace(str(tmppath), str(self.path))
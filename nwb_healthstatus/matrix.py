@@ -0,0 +1,303 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import os
+from pathlib import Path
+import shlex
+import subprocess
+import sys
+from time import monotonic
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from .pool import Outcome
+from .results import RESULTS_DB_NAME
+
+if TYPE_CHECKING:
+    from .spec import Environment, Spec
+
+#: Directory containing the case files of each producer, one subdirectory per
+#: producer
+PRODUCERS_DIR = Path(__file__).with_name("producers")
+
+#: Root of the source tree of this package, installed into each environment
+SOURCE_DIR = Path(__file__).resolve().parent.parent
+
+
+class MatrixJob(NamedTuple):
+    #: One of "setup", "write", or "read"
+    kind: str
+    producer: Optional[str] = None
+    writer: Optional[str] = None
+    reader: Optional[str] = None
+
+    def __str__(self) -> str:
+        if self.kind == "setup":
+            return f"setup {self.reader}"
+        elif self.kind == "write":
+            return f"write {self.producer} in {self.writer}"
+        else:
+            return f"read {self.producer} from {self.writer} in {self.reader}"
+
+
+def expand_matrix(spec: "Spec") -> Dict[MatrixJob, List[MatrixJob]]:
+    """
+    Expand a spec into the graph of jobs needed to write every producer's
+    samples in each of its environments and read them back in every
+    environment.  The result maps each job to the jobs it depends on.
+    """
+    env_names = [env.name for env in spec.environments]
+    unknown = sorted(
+        {e for p in spec.producers for e in p.environments} - set(env_names)
+    )
+    if unknown:
+        raise ValueError(f"Producers refer to undefined environments: {unknown}")
+    graph = {MatrixJob("setup", reader=name): [] for name in env_names}
+    for producer in spec.producers:
+        for writer in producer.environments:
+            write = MatrixJob("write", producer.name, writer)
+            graph[write] = [MatrixJob("setup", reader=writer)]
+            for reader in env_names:
+                graph[MatrixJob("read", producer.name, writer, reader)] = [
+                    write,
+                    MatrixJob("setup", reader=reader),
+                ]
+    return graph
+
+
+class Executor(ABC):
+    """
+    Runs ``nwb-healthstatus`` commands inside the environments of a spec.
+    Paths passed to `run` must be expressed via `source_path` and
+    `samples_path`, as they may differ inside an environment.
+    """
+
+    def __init__(self, workdir: Union[str, Path], samples_dir: Union[str, Path]):
+        self.workdir = Path(workdir)
+        self.samples_dir = Path(samples_dir)
+
+    @abstractmethod
+    def setup(self, env: "Environment") -> str:
+        """Prepare the environment for running commands, returning the log"""
+        ...
+
+    @abstractmethod
+    def run(self, env: "Environment", args: List[str]) -> str:
+        """
+        Run ``nwb-healthstatus`` with the given arguments in the environment,
+        returning its output.  Raises `subprocess.CalledProcessError` on
+        failure.
+        """
+        ...
+
+    def source_path(self, path: Path) -> str:
+        return str(path)
+
+    def samples_path(self, *parts: str) -> str:
+        return str(Path(self.samples_dir, *parts))
+
+
+class LocalExecutor(Executor):
+    """
+    Runs environments as virtualenvs under ``workdir``, with the environments'
+    ``pip`` requirements and ``on_startup`` script applied once on creation.
+    The base image and apt packages of an environment cannot be reproduced
+    and are ignored.
+    """
+
+    def venv_dir(self, env: "Environment") -> Path:
+        return self.workdir / "venvs" / env.name
+
+    def setup(self, env: "Environment") -> str:
+        venv = self.venv_dir(env)
+        if (venv / ".nwb-healthstatus-ready").exists():
+            return f"Reusing virtualenv at {venv}\n"
+        pip = [str(venv / "bin" / "python"), "-m", "pip", "install", "-q"]
+        log = _check_output([sys.executable, "-m", "venv", "--clear", str(venv)])
+        if env.pip:
+            log += _check_output(pip + env.pip)
+        log += _check_output(pip + [str(SOURCE_DIR)])
+        if env.on_startup:
+            log += _check_output(["sh", "-c", env.on_startup], env=self._env(env))
+        (venv / ".nwb-healthstatus-ready").touch()
+        return log
+
+    def run(self, env: "Environment", args: List[str]) -> str:
+        return _check_output(
+            [str(self.venv_dir(env) / "bin" / "nwb-healthstatus")] + args,
+            env=self._env(env),
+        )
+
+    def _env(self, env: "Environment") -> Dict[str, str]:
+        venv = self.venv_dir(env)
+        return dict(
+            os.environ,
+            VIRTUAL_ENV=str(venv),
+            PATH=f"{venv / 'bin'}{os.pathsep}{os.environ.get('PATH', '')}",
+        )
+
+
+class DockerExecutor(Executor):
+    """
+    Runs environments as Docker containers built from the Dockerfiles
+    generated by ``environments make-dockerfiles``, with the source tree and
+    the samples directory mounted into each container
+    """
+
+    def __init__(
+        self,
+        workdir: Union[str, Path],
+        samples_dir: Union[str, Path],
+        dockerfiles_dir: Union[str, Path],
+    ):
+        super().__init__(workdir, samples_dir)
+        self.dockerfiles_dir = Path(dockerfiles_dir)
+
+    @staticmethod
+    def image(env: "Environment") -> str:
+        return f"nwb-healthstatus:{env.name}"
+
+    def setup(self, env: "Environment") -> str:
+        return _check_output(
+            [
+                "docker",
+                "build",
+                "-t",
+                self.image(env),
+                "-f",
+                str(self.dockerfiles_dir / f"Dockerfile.{env.name}"),
+                str(self.dockerfiles_dir),
+            ]
+        )
+
+    def run(self, env: "Environment", args: List[str]) -> str:
+        self.samples_dir.mkdir(parents=True, exist_ok=True)
+        script = "python3 -m pip install -q /src && nwb-healthstatus " + " ".join(
+            shlex.quote(a) for a in args
+        )
+        return _check_output(
+            [
+                "docker",
+                "run",
+                "--rm",
+                "-v",
+                f"{SOURCE_DIR}:/src",
+                "-v",
+                f"{self.samples_dir.resolve()}:/samples",
+                self.image(env),
+                "sh",
+                "-c",
+                script,
+            ]
+        )
+
+    def source_path(self, path: Path) -> str:
+        return str(Path("/src", path.resolve().relative_to(SOURCE_DIR)))
+
+    def samples_path(self, *parts: str) -> str:
+        return str(Path("/samples", *parts))
+
+
+def get_casefiles(producer: str, producers_dir: Path = PRODUCERS_DIR) -> List[Path]:
+    pdir = producers_dir / producer
+    if not pdir.is_dir():
+        raise FileNotFoundError(f"No case directory for producer {producer!r}")
+    return sorted(p for p in pdir.glob("*.py") if p.name != "__init__.py")
+
+
+def run_job(
+    job: MatrixJob,
+    envs: Dict[str, "Environment"],
+    executor: Executor,
+    producers_dir: Path = PRODUCERS_DIR,
+) -> Outcome:
+    start = monotonic()
+    try:
+        if job.kind == "setup":
+            output = executor.setup(envs[job.reader])
+        else:
+            casefiles = [
+                executor.source_path(p)
+                for p in get_casefiles(job.producer, producers_dir)
+            ]
+            samples = executor.samples_path(job.writer)
+            if job.kind == "write":
+                args = ["sample", "create", "--samples-path", samples]
+                env = envs[job.writer]
+            else:
+                args = [
+                    "sample",
+                    "test",
+                    "--samples-path",
+                    samples,
+                    "--results-db",
+                    executor.samples_path(RESULTS_DB_NAME),
+                    "--environment",
+                    job.reader,
+                    "--writer-environment",
+                    job.writer,
+                ]
+                env = envs[job.reader]
+            output = executor.run(env, args + casefiles)
+    except subprocess.CalledProcessError as e:
+        return Outcome(False, error=e.output, duration=monotonic() - start)
+    except Exception as e:
+        return Outcome(
+            False, error=f"{type(e).__name__}: {e}", duration=monotonic() - start
+        )
+    return Outcome(True, output, duration=monotonic() - start)
+
+
+def run_matrix(
+    spec: "Spec",
+    executor: Executor,
+    workers: int = 1,
+    producers_dir: Path = PRODUCERS_DIR,
+) -> Iterator[Tuple[MatrixJob, Outcome]]:
+    """
+    Run all jobs of the spec's compatibility matrix with up to ``workers``
+    jobs at a time, each job starting as soon as the jobs it depends on have
+    succeeded, and yield ``(job, outcome)`` pairs as the jobs complete.  Each
+    writer's samples are created once and then read by all environments in
+    parallel.  Jobs whose dependencies failed are reported as failed without
+    being run.
+    """
+    graph = expand_matrix(spec)
+    envs = {env.name: env for env in spec.environments}
+    done: Dict[MatrixJob, Outcome] = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while len(done) < len(graph):
+            scheduled = set(running.values())
+            for job, deps in graph.items():
+                if job in done or job in scheduled:
+                    continue
+                failed = [str(d) for d in deps if d in done and not done[d].ok]
+                if failed:
+                    done[job] = Outcome(
+                        False, error=f"Not run as dependencies failed: {failed}"
+                    )
+                    yield job, done[job]
+                elif all(d in done for d in deps):
+                    fut = pool.submit(run_job, job, envs, executor, producers_dir)
+                    running[fut] = job
+            if not running:
+                continue
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for fut in finished:
+                job = running.pop(fut)
+                done[job] = fut.result()
+                yield job, done[job]
+
+
+def _check_output(cmd: List[str], env: Optional[Dict[str, str]] = None) -> str:
+    return subprocess.check_output(
+        cmd, env=env, stderr=subprocess.STDOUT, universal_newlines=True
+    )
@@ -0,0 +1,342 @@
+from collections import deque
+from importlib import import_module
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import signal
+from time import monotonic
+from traceback import format_exc
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+
+class Outcome(NamedTuple):
+    ok: bool
+    value: Any = None
+    error: Optional[str] = None
+    duration: float = 0.0
+
+
+#: How often (in seconds) to check running workers against their limits
+POLL_INTERVAL = 0.1
+
+
+#: A job function, or a reference to one in the form ``"module:function"``
+JobFunc = Union[Callable, str]
+
+
+def resolve(func: JobFunc) -> Callable:
+    """Return the function referred to by a `JobFunc`"""
+    if isinstance(func, str):
+        modname, _, funcname = func.partition(":")
+        return getattr(import_module(modname), funcname)
+    return func
+
+
+def run_jobs(
+    func: JobFunc,
+    jobs: Iterable[tuple],
+    workers: int = 1,
+    timeout: Optional[float] = None,
+    max_rss: Optional[int] = None,
+    isolate: bool = False,
+) -> Iterator[Tuple[tuple, Outcome]]:
+    """
+    Run ``func(*args)`` for each ``args`` tuple in ``jobs`` and yield
+    ``(args, outcome)`` pairs as the calls complete.  ``func`` may be given as
+    a ``"module:function"`` reference, in which case its module is only
+    imported once there are jobs to run, so that commands which run none
+    do not pay for the heavy dependencies of job functions.  The module is
+    imported in the calling process, before any child is forked, so that
+    children inherit it instead of each importing it anew.
+
+    With ``workers`` greater than 1, each call runs in its own child process
+    with at most ``workers`` children alive at once, so an exception, a crash
+    or a hard exit in one call is reported as a failed `Outcome` instead of
+    taking down the whole run.  With ``workers`` equal to 1, no limits
+    given, and ``isolate`` false, calls are made in the current process, one
+    after another.
+
+    If ``timeout`` (in seconds) or ``max_rss`` (in bytes) is given, each call
+    is run in a child process (even if ``workers`` is 1), and a child that
+    runs for longer than ``timeout`` or whose resident set grows beyond
+    ``max_rss`` is killed and its call reported as failed.  Memory usage is
+    only checked on platforms with a ``/proc`` filesystem.
+    """
+    limited = timeout is not None or max_rss is not None
+    if workers <= 1 and not limited and not isolate:
+        func = resolve(func)
+        for args in jobs:
+            start = monotonic()
+            try:
+                value = func(*args)
+            except Exception:
+                yield args, Outcome(
+                    False, error=format_exc(), duration=monotonic() - start
+                )
+            else:
+                yield args, Outcome(True, value, duration=monotonic() - start)
+        return
+    pending = deque(jobs)
+    if pending:
+        func = resolve(func)
+    running = []
+    while pending or running:
+        while pending and len(running) < workers:
+            running.append(_Worker(func, pending.popleft()))
+        wait(
+            [w.conn for w in running] + [w.process.sentinel for w in running],
+            timeout=POLL_INTERVAL if limited else None,
+        )
+        still_running = []
+        for w in running:
+            outcome = w.poll(timeout, max_rss)
+            if outcome is None:
+                still_running.append(w)
+            else:
+                yield w.args, outcome
+        running = still_running
+
+
+class _Worker:
+    def __init__(self, func: JobFunc, args: tuple) -> None:
+        self.args = args
+        self.start = monotonic()
+        self.conn, child_conn = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(
+            target=_work, args=(child_conn, func, args), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    def poll(
+        self, timeout: Optional[float] = None, max_rss: Optional[int] = None
+    ) -> Optional[Outcome]:
+        """
+        Return the outcome of the call if it has finished (successfully or
+        not) or exceeded one of the given limits, or `None` if it is still
+        running
+        """
+        if self.conn.poll():
+            try:
+                ok, value, error = self.conn.recv()
+            except EOFError:
+                self.process.join()
+            else:
+                self.finish()
+                return Outcome(ok, value, error, monotonic() - self.start)
+        if not self.process.is_alive():
+            return self.fail(f"Worker exited with code {self.process.exitcode}")
+        if timeout is not None and monotonic() - self.start > timeout:
+            return self.fail(f"Timed out after {timeout} seconds")
+        if max_rss is not None:
+            rss = get_rss(self.process.pid)
+            if rss is not None and rss > max_rss:
+                return self.fail(f"Resident memory exceeded {max_rss} bytes ({rss})")
+        return None
+
+    def fail(self, error: str) -> Outcome:
+        if self.process.is_alive():
+            self.process.terminate()
+        self.finish()
+        return Outcome(False, error=error, duration=monotonic() - self.start)
+
+    def finish(self) -> None:
+        self.process.join()
+        self.conn.close()
+
+
+class WarmPool:
+    """
+    A pool of long-lived worker processes which each run ``init()`` once when
+    started and then make the calls of ``func`` given to them, one at a
+    time, so that the cost of importing (and setting up) the dependencies of
+    ``func`` is paid once per worker rather than once per call.  ``func`` and
+    ``init`` may be given as ``"module:function"`` references, as for
+    `run_jobs`.
+
+    Calls are started with `start` on idle workers (those done with
+    ``init``) and collected with `poll`, so that the pool can be driven by a
+    caller's own event loop, waiting on `waitables`.  A worker whose call
+    crashes it, runs for longer than ``timeout`` seconds, or grows its
+    resident set beyond ``max_rss`` bytes is killed (as in `run_jobs`) and
+    replaced by a fresh one.
+    """
+
+    def __init__(
+        self,
+        func: JobFunc,
+        workers: int = 1,
+        init: Optional[JobFunc] = None,
+        timeout: Optional[float] = None,
+        max_rss: Optional[int] = None,
+    ) -> None:
+        self.func = func
+        self.init = init
+        self.timeout = timeout
+        self.max_rss = max_rss
+        self.workers = [_WarmWorker(func, init) for _ in range(workers)]
+
+    @property
+    def limited(self) -> bool:
+        return self.timeout is not None or self.max_rss is not None
+
+    def idle(self) -> int:
+        """Return the number of workers ready for a call"""
+        return sum(1 for w in self.workers if w.ready and w.key is None)
+
+    def start(self, key: Any, args: tuple) -> None:
+        """
+        Start the call ``func(*args)`` on an idle worker; its outcome will be
+        returned by `poll` along with ``key``
+        """
+        worker = next(w for w in self.workers if w.ready and w.key is None)
+        worker.run(key, args)
+
+    def waitables(self) -> list:
+        """
+        Return the objects to `multiprocessing.connection.wait` on for a
+        worker to become ready or the outcome of a running call (to be
+        retrieved with `poll`)
+        """
+        busy = [w for w in self.workers if not w.ready or w.key is not None]
+        return [w.conn for w in busy] + [w.process.sentinel for w in busy]
+
+    def poll(self) -> List[Tuple[Any, Outcome]]:
+        """
+        Return the ``(key, outcome)`` pairs of the calls that have finished or
+        exceeded a limit since the last poll, replacing any workers killed.
+        Raises `RuntimeError` if a worker dies while running ``init``.
+        """
+        finished = []
+        for i, w in enumerate(self.workers):
+            if not w.ready:
+                w.poll_ready()
+                continue
+            if w.key is None:
+                continue
+            key = w.key
+            outcome = w.poll(self.timeout, self.max_rss)
+            if outcome is not None:
+                finished.append((key, outcome))
+                if not w.process.is_alive():
+                    w.close()
+                    self.workers[i] = _WarmWorker(self.func, self.init)
+        return finished
+
+    def close(self) -> None:
+        for w in self.workers:
+            w.close()
+
+
+class _WarmWorker(_Worker):
+    # Reuses `_Worker.poll`, which sees a live worker's process as that of
+    # the current call
+
+    def __init__(self, func: JobFunc, init: Optional[JobFunc]) -> None:
+        self.key: Any = None
+        self.ready = False
+        self.args = ()
+        self.start = monotonic()
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_work_warm, args=(child_conn, func, init), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    def poll_ready(self) -> None:
+        if self.conn.poll():
+            try:
+                self.conn.recv()
+            except EOFError:
+                pass
+            else:
+                self.ready = True
+                return
+        if not self.process.is_alive():
+            self.close()
+            raise RuntimeError(
+                f"Worker exited with code {self.process.exitcode} while starting up"
+            )
+
+    def run(self, key: Any, args: tuple) -> None:
+        self.key = key
+        self.args = args
+        self.start = monotonic()
+        self.conn.send(args)
+
+    def poll(
+        self, timeout: Optional[float] = None, max_rss: Optional[int] = None
+    ) -> Optional[Outcome]:
+        outcome = super().poll(timeout, max_rss)
+        if outcome is not None:
+            self.key = None
+        return outcome
+
+    def fail(self, error: str) -> Outcome:
+        outcome = super().fail(error)
+        self.close()
+        return outcome
+
+    def finish(self) -> None:
+        # The worker stays up for the next call
+        pass
+
+    def close(self) -> None:
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+def get_rss(pid: int) -> Optional[int]:
+    """
+    Return the resident set size in bytes of the process with the given PID,
+    or `None` if it cannot be determined
+    """
+    try:
+        with open(f"/proc/{pid}/statm") as fp:
+            pages = int(fp.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def _work(conn, func: JobFunc, args: tuple) -> None:
+    try:
+        value = resolve(func)(*args)
+    except BaseException:
+        conn.send((False, None, format_exc()))
+    else:
+        conn.send((True, value, None))
+    conn.close()
+
+
+def _work_warm(conn, func: JobFunc, init: Optional[JobFunc]) -> None:
+    # Leave it to the parent to stop the worker when interrupted
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if init is not None:
+        resolve(init)()
+    func = resolve(func)
+    conn.send(None)
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            break
+        try:
+            value = func(*args)
+        except BaseException:
+            conn.send((False, None, format_exc()))
+        else:
+            conn.send((True, value, None))
@@ -3,8 +3,16 @@ from pathlib import Path
 
 import numpy as np
 import pynwb
+from pynwb.epoch import TimeIntervals
+
+from nwb_healthstatus.base import (
+    DEFAULT_BLOCK_BYTES,
+    assert_data_equal,
+    build_table,
+    iter_random_blocks,
+    stream_data,
+)
 
-np.random.seed(42)
 metadata = dict(
     session_description="my first synthetic recording",
     identifier="EXAMPLE_ID",
@@ -17,32 +25,84 @@ metadata = dict(
     experiment_description="I went on an adventure with thirteen dwarves to reclaim vast treasures.",
     session_id="LONELYMTN",
 )
-CONST = {"serie_length": 10, "ncells": 10, "pix_dim": 150}
 timeseries = {
     "name1": "my_awesome_timeserie1",
     "name2": "my_awesome_timeserie2",
-    "data": np.random.random(CONST["serie_length"]),
-    "timestamps": np.linspace(0, 0.1, CONST["serie_length"]),
     "unit": "squirrel squared",
     "trials": np.arange(0, 0.1, 0.02),
 }
 ophys = {
-    "Ly": CONST["pix_dim"],
-    "Lx": CONST["pix_dim"],
     "filelist": ["/path/to/tiff/files"],
     "fs": 4.5,
     "nplanes": 3,
-    "ypix": np.random.randint(0, CONST["pix_dim"], CONST["ncells"]),
-    "xpix": np.random.randint(0, CONST["pix_dim"], CONST["ncells"]),
-    "lam": np.random.random(CONST["ncells"]),
-    "iscell": np.random.choice(2, CONST["ncells"]),
-    "traces": 100 * np.random.rand(CONST["ncells"], CONST["serie_length"]),
 }
 
+PIXEL_MASK_DTYPE = np.dtype([("x", "u4"), ("y", "u4"), ("weight", "f4")])
+
+
+def iter_timestamps(serie_length, max_bytes=DEFAULT_BLOCK_BYTES):
+    """Yield evenly spaced timestamps from 0 to 0.1 in blocks"""
+    step = max(1, max_bytes // 8)
+    for start in range(0, serie_length, step):
+        stop = min(start + step, serie_length)
+        yield 0.1 * np.arange(start, stop) / max(serie_length - 1, 1)
+
 
 class FleischmannLab:
     EXTENSIONS = set()
     FILENAME = "fleischmann.nwb"
+    PARAMS = {"serie_length": 10, "ncells": 10, "pix_dim": 150}
+    OBJECTS = [
+        f"acquisition/{timeseries['name1']}",
+        "acquisition/TwoPhotonSeries",
+        f"stimulus/presentation/{timeseries['name2']}",
+        "intervals/trials",
+        "processing/ophys",
+    ]
+
+    def __init__(self, serie_length, ncells, pix_dim):
+        self.serie_length = serie_length
+        self.ncells = ncells
+        self.pix_dim = pix_dim
+        #: Whether the sample is scaled up from the default sizes, in which
+        #: case its data is generated in blocks and streamed into the file;
+        #: the default sample keeps its values and plain storage
+        self.scaled = (
+            dict(serie_length=serie_length, ncells=ncells, pix_dim=pix_dim)
+            != self.PARAMS
+        )
+        rng = np.random.RandomState(42)
+        if not self.scaled:
+            self.data = rng.random_sample(serie_length)
+        # Per-cell values are small enough to generate up front
+        self.ypix = rng.randint(0, pix_dim, ncells)
+        self.xpix = rng.randint(0, pix_dim, ncells)
+        self.lam = rng.random_sample(ncells)
+        self.iscell = rng.choice(2, ncells)
+        if not self.scaled:
+            self.traces = 100 * rng.rand(ncells, serie_length)
+
+    def get_data(self):
+        if not self.scaled:
+            return self.data
+        return iter_random_blocks((self.serie_length,), seed=1)
+
+    def get_timestamps(self):
+        if not self.scaled:
+            return np.linspace(0, 0.1, self.serie_length)
+        return iter_timestamps(self.serie_length)
+
+    def get_traces(self):
+        if not self.scaled:
+            return self.traces
+        return (
+            100 * block
+            for block in iter_random_blocks((self.ncells, self.serie_length), seed=2)
+        )
+
+    def store(self, values, **kwargs):
+        """Return values to store in the sample, streamed if it is scaled"""
+        return stream_data(values, **kwargs) if self.scaled else values
 
     def create(self):
         nwbfile = pynwb.NWBFile(**metadata)
@@ -50,24 +110,28 @@ class FleischmannLab:
         # TimeSeries
         timeserie1 = pynwb.TimeSeries(
             name=timeseries["name1"],
-            data=timeseries["data"],
-            timestamps=timeseries["timestamps"],
+            data=self.store(self.get_data()),
+            timestamps=self.store(self.get_timestamps()),
             unit=timeseries["unit"],
         )
         timeserie2 = pynwb.TimeSeries(
             name=timeseries["name2"],
-            data=timeseries["data"],
-            timestamps=timeseries["timestamps"],
+            data=self.store(self.get_data()),
+            timestamps=self.store(self.get_timestamps()),
             unit=timeseries["unit"],
         )
         nwbfile.add_acquisition(timeserie1)
         nwbfile.add_stimulus(timeserie2)
-        for trial in timeseries["trials"]:
-            nwbfile.add_trial(
-                start_time=trial,
-                stop_time=trial
-                + (timeseries["trials"][1] - timeseries["trials"][0]) / 2,
-            )
+        trials = timeseries["trials"]
+        nwbfile.trials = build_table(
+            TimeIntervals,
+            {
+                "start_time": trials,
+                "stop_time": trials + (trials[1] - trials[0]) / 2,
+            },
+            name="trials",
+            description="experimental trials",
+        )
 
         # Ophys
         device = nwbfile.create_device(
@@ -94,7 +158,7 @@ class FleischmannLab:
         )
         image_series = pynwb.ophys.TwoPhotonSeries(
             name="TwoPhotonSeries",
-            dimension=[ophys["Ly"], ophys["Lx"]],
+            dimension=[self.pix_dim, self.pix_dim],
             external_file=(ophys["filelist"] if "filelist" in ophys else [""]),
             imaging_plane=imaging_plane,
             starting_frame=[0],
@@ -103,36 +167,38 @@ class FleischmannLab:
             rate=ophys["fs"] * ophys["nplanes"],
         )
         nwbfile.add_acquisition(image_series)
-        img_seg = pynwb.ophys.ImageSegmentation()
-        ps = img_seg.create_plane_segmentation(
+        # One pixel per ROI
+        pixel_mask = np.empty(self.ncells, dtype=PIXEL_MASK_DTYPE)
+        pixel_mask["x"] = self.ypix
+        pixel_mask["y"] = self.xpix
+        pixel_mask["weight"] = self.lam
+        ps = build_table(
+            pynwb.ophys.PlaneSegmentation,
+            {"pixel_mask": pixel_mask, "iscell": self.iscell},
+            indices={"pixel_mask": np.arange(1, self.ncells + 1)},
+            descriptions={"iscell": "two columns - iscell & probcell"},
             name="PlaneSegmentation",
             description="suite2p output",
             imaging_plane=imaging_plane,
             reference_images=image_series,
         )
+        img_seg = pynwb.ophys.ImageSegmentation()
+        img_seg.add_plane_segmentation(ps)
         ophys_module = nwbfile.create_processing_module(
             name="ophys", description="optical physiology processed data"
         )
         ophys_module.add(img_seg)
 
-        for n in range(CONST["ncells"]):
-            pixel_mask = np.array(
-                [
-                    ophys["ypix"][n],
-                    ophys["xpix"][n],
-                    ophys["lam"][n],
-                ]
-            )
-            ps.add_roi(pixel_mask=pixel_mask.reshape((1, 3)))
-        ps.add_column("iscell", "two columns - iscell & probcell", ophys["iscell"])
         rt_region = ps.create_roi_table_region(
-            region=list(np.arange(0, CONST["ncells"])), description="all ROIs"
+            region=list(np.arange(0, self.ncells)), description="all ROIs"
         )
 
         roi_resp_series = (
             pynwb.ophys.RoiResponseSeries(
                 name="Plane_1",
-                data=ophys["traces"],
+                data=self.store(
+                    self.get_traces(), maxshape=(self.ncells, self.serie_length)
+                ),
                 rois=rt_region,
                 unit="lumens",
                 rate=ophys["fs"],
@@ -148,23 +214,19 @@ class FleischmannLab:
     def test(self, nwbfile):
         for f, v in metadata.items():
             assert getattr(nwbfile, f) == v, f"{f}: {getattr(nwbfile, f)!r} vs. {v!r}"
-        np.testing.assert_array_equal(
-            nwbfile.acquisition[timeseries["name1"]].data[:], timeseries["data"]
-        )
-        np.testing.assert_array_equal(
-            nwbfile.acquisition[timeseries["name1"]].timestamps[:],
-            timeseries["timestamps"],
+        assert_data_equal(
+            nwbfile.acquisition[timeseries["name1"]].data, self.get_data()
         )
-        np.testing.assert_array_equal(
-            nwbfile.stimulus[timeseries["name2"]].data[:], timeseries["data"]
+        assert_data_equal(
+            nwbfile.acquisition[timeseries["name1"]].timestamps,
+            self.get_timestamps(),
         )
-        np.testing.assert_array_equal(
-            nwbfile.stimulus[timeseries["name2"]].timestamps[:],
-            timeseries["timestamps"],
-        )
-        np.testing.assert_array_equal(
-            nwbfile.trials.columns[0].data[:], timeseries["trials"]
+        assert_data_equal(nwbfile.stimulus[timeseries["name2"]].data, self.get_data())
+        assert_data_equal(
+            nwbfile.stimulus[timeseries["name2"]].timestamps,
+            self.get_timestamps(),
         )
+        assert_data_equal(nwbfile.trials.columns[0].data, timeseries["trials"])
         PlaneSegmentation = (
             nwbfile.processing["ophys"]
             .data_interfaces["ImageSegmentation"]
@@ -178,17 +240,15 @@ class FleischmannLab:
         assert (
             nwbfile.acquisition["TwoPhotonSeries"].external_file[:] == ophys["filelist"]
         )
-        np.testing.assert_array_equal(
-            nwbfile.acquisition["TwoPhotonSeries"].dimension[:],
-            [ophys["Ly"], ophys["Lx"]],
-        )
-        np.testing.assert_array_equal(
-            PlaneSegmentation["iscell"].data[:], ophys["iscell"]
+        assert_data_equal(
+            nwbfile.acquisition["TwoPhotonSeries"].dimension,
+            [self.pix_dim, self.pix_dim],
         )
+        assert_data_equal(PlaneSegmentation["iscell"].data, self.iscell)
 
         roi_resp = (
             nwbfile.processing["ophys"]
             .data_interfaces["Fluorescence"]
             .roi_response_series["Plane_1"]
         )
-        np.testing.assert_array_equal(roi_resp.data[:], ophys["traces"])
+        assert_data_equal(roi_resp.data, self.get_traces())
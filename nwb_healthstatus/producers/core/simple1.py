@@ -18,9 +18,12 @@ metadata = dict(
 
 class Simple1:
     EXTENSIONS = set()
+    FILENAME = "simple1.nwb"
+    # The test only looks at the file's metadata
+    OBJECTS = []
 
     def create(self):
-        yield ("core", "simple1.nwb", pynwb.NWBFile(**metadata))
+        yield ("core", self.FILENAME, pynwb.NWBFile(**metadata))
 
     def test(self, nwbfile):
         # TODO: make it more specific to this example
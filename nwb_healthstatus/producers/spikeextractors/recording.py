@@ -1,30 +1,247 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import datetime
+import fcntl
+import os
 from pathlib import Path
-import tempfile
+import time
 
 from appdirs import user_cache_dir
-import datalad.api as dl
 from pynwb import NWBFile
-import spikeextractors as se
+from pynwb.ecephys import ElectricalSeries
+
+from nwb_healthstatus.base import DEFAULT_BLOCK_BYTES, staged_nwbfile, stream_data
+
+# A directory containing (a subset of) the testing data to use as is instead
+# of the clone from GIN, e.g. for testing the producer itself
+LOCAL_DATA = os.environ.get("NWB_HEALTHSTATUS_EPHY_TESTING_DATA")
+# The testing data the samples are converted from: the local copy, if given,
+# and otherwise the clone from GIN
+TESTING_DATA = (
+    Path(LOCAL_DATA).resolve()
+    if LOCAL_DATA
+    else Path(user_cache_dir("nwb-healthstatus", "dandi"), "ephy_testing_data")
+)
+# Number of upcoming scenarios whose data is fetched while converting one
+PREFETCH_DEPTH = int(os.environ.get("NWB_HEALTHSTATUS_PREFETCH_DEPTH", "2"))
+# Don't update the clone from GIN if it was updated less than this many
+# seconds ago
+UPDATE_TTL = float(os.environ.get("NWB_HEALTHSTATUS_UPDATE_TTL", "3600"))
+
+
+def install_dataset(path):
+    """
+    Install the testing data from GIN at ``path`` or, if already installed
+    and not updated within the last `UPDATE_TTL` seconds, update it.
+    Concurrent callers (e.g., parallel workers) are serialized by a lock file,
+    so only the first of them updates the dataset.
+    """
+    import datalad.api as dl
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    stamp = path.with_name(path.name + ".updated")
+    with open(str(path.with_name(path.name + ".lock")), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        existant = path.exists()
+        dataset = dl.install(
+            source="https://gin.g-node.org/NeuralEnsemble/ephy_testing_data",
+            path=path,
+        )
+        if existant and (
+            not stamp.exists() or time.time() - stamp.stat().st_mtime > UPDATE_TTL
+        ):
+            dataset.update(merge=True)  # to ensure that up to date if existed before
+        stamp.touch()
+    return dataset
+
+
+def prefetched(scenarios, fetch, depth=PREFETCH_DEPTH):
+    """
+    Yield the scenarios in order, each one once ``fetch(dataset_path)`` has
+    completed for it, while fetching the next ``depth`` scenarios' data in
+    background threads
+    """
+    if depth < 1:
+        for scenario in scenarios:
+            fetch(scenario[1])
+            yield scenario
+        return
+    scenarios = iter(scenarios)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=depth) as pool:
+
+        def fill():
+            while len(pending) <= depth:
+                scenario = next(scenarios, None)
+                if scenario is None:
+                    break
+                pending.append((scenario, pool.submit(fetch, scenario[1])))
+
+        fill()
+        while pending:
+            scenario, future = pending.popleft()
+            future.result()
+            fill()
+            yield scenario
+
+
+def read_ahead(blocks):
+    """
+    Yield the items of an iterable in order while the next one is read from
+    it in a background thread, e.g. the next block of a recording's traces
+    while the current one is compressed and written.  With scenarios
+    converted one per job, this is what overlaps reading the data with
+    writing it, which `prefetched` cannot do within a single scenario.
+    """
+    blocks = iter(blocks)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(next, blocks, None)
+        while True:
+            block = future.result()
+            if block is None:
+                break
+            future = pool.submit(next, blocks, None)
+            yield block
+
+
+def iter_scaled_traces(recording, block_bytes=DEFAULT_BLOCK_BYTES):
+    """
+    Yield the scaled traces of a recording as ``(frames, channels)`` arrays of
+    consecutive blocks of frames, each of at most ``block_bytes`` bytes
+    """
+    nframes = recording.get_num_frames()
+    dtype = recording.get_traces(end_frame=1, return_scaled=True).dtype
+    step = max(1, block_bytes // (recording.get_num_channels() * dtype.itemsize))
+    for start in range(0, nframes, step):
+        traces = recording.get_traces(
+            start_frame=start, end_frame=min(start + step, nframes), return_scaled=True
+        )
+        # NWB stores time along the first axis
+        yield traces.T
+
+
+def can_write_blocks():
+    """
+    Return whether the installed spikeextractors has the helpers of
+    ``NwbRecordingExtractor`` that `write_recording_blocks` relies on;
+    recordings are written with ``write_recording`` by the versions that don't
+    """
+    import spikeextractors as se
+
+    return all(
+        hasattr(se.NwbRecordingExtractor, name)
+        for name in [
+            "add_devices",
+            "add_electrode_groups",
+            "add_electrodes",
+            "add_epochs",
+            "get_nwb_metadata",
+        ]
+    )
+
+
+def write_recording_blocks(recording, nwbfile, block_bytes=DEFAULT_BLOCK_BYTES):
+    """
+    Add a recording to an NWB file like ``se.NwbRecordingExtractor.write_recording(
+    recording, nwbfile=nwbfile, write_scaled=True)`` does, except that the
+    scaled traces are read from the recording and written to the file in
+    blocks of at most ``block_bytes`` bytes when the file is written, so that
+    memory use does not depend on the length of the recording.  Each block is
+    read while the one before is written (see `read_ahead`).
+    """
+    import spikeextractors as se
+
+    metadata = getattr(recording, "nwb_metadata", None)
+    if metadata is None:
+        metadata = se.NwbRecordingExtractor.get_nwb_metadata(recording=recording)
+    for add in [
+        se.NwbRecordingExtractor.add_devices,
+        se.NwbRecordingExtractor.add_electrode_groups,
+    ]:
+        add(recording=recording, nwbfile=nwbfile, metadata=metadata)
+    se.NwbRecordingExtractor.add_electrodes(
+        recording=recording, nwbfile=nwbfile, metadata=metadata, write_scaled=True
+    )
+    electrode_ids = list(nwbfile.electrodes.id[:])
+    electrodes = nwbfile.create_electrode_table_region(
+        region=[electrode_ids.index(ch) for ch in recording.get_channel_ids()],
+        description="electrode_table_region",
+    )
+    nframes = recording.get_num_frames()
+    nchannels = recording.get_num_channels()
+    es_metadata = metadata.get("Ecephys", {}).get("ElectricalSeries", {})
+    nwbfile.add_acquisition(
+        ElectricalSeries(
+            name=es_metadata.get("name", "ElectricalSeries"),
+            description=es_metadata.get("description", "Raw acquired data."),
+            comments="Generated from SpikeInterface::NwbRecordingExtractor",
+            electrodes=electrodes,
+            data=stream_data(
+                read_ahead(iter_scaled_traces(recording, block_bytes)),
+                dtype=recording.get_traces(end_frame=1, return_scaled=True).dtype,
+                maxshape=(nframes, nchannels),
+            ),
+            # Scaled traces are in uV
+            conversion=1e-6,
+            starting_time=recording.frame_to_time(0),
+            rate=float(recording.get_sampling_frequency()),
+        )
+    )
+    se.NwbRecordingExtractor.add_epochs(
+        recording=recording, nwbfile=nwbfile, metadata=metadata
+    )
 
 
 class _CommonBase:
     EXTENSIONS = set()
+    INPUTS = [TESTING_DATA]
 
-    # To be defined in subclass
+    # To be defined in subclass: ``(se_class_name, dataset_path, se_kwargs)``
+    # with the names of the extractor classes, so that spikeextractors is only
+    # imported when creating samples, not when testing them in environments
+    # without it
     SCENARIOS = None
 
+    # Keyword arguments of extractors which are paths relative to the dataset
+    PATH_KWARGS = [
+        "filename",
+        "file_or_folder_path",
+        "file_path",
+        "dirname",
+        "folder_path",
+        "settings_file",
+    ]
+
     def __init__(self):
-        self.pt = Path(user_cache_dir("nwb-healthstatus", "dandi"), "ephy_testing_data")
-        existant = self.pt.exists()
-        self.dataset = dl.install(
-            source="https://gin.g-node.org/NeuralEnsemble/ephy_testing_data",
-            path=self.pt,
-        )
-        if existant:
-            self.dataset.update(
-                merge=True
-            )  # to ensure that up to date if existed before
+        self.pt = self.INPUTS[0]
+        # Installed by `iter_scenarios`, so that testing the samples does not
+        # need the testing data
+        self.dataset = None
+
+    def fetch(self, dataset_path):
+        if self.dataset is not None:
+            self.dataset.get(dataset_path)
+
+    def iter_scenarios(self, only=None):
+        """
+        Yield the ``(se_class, dataset_path, se_kwargs)`` scenarios (only the
+        one with index ``only``, if given) with paths in ``se_kwargs`` made
+        absolute, fetching each scenario's data before it is yielded
+        """
+        import spikeextractors as se
+
+        if self.dataset is None and not LOCAL_DATA:
+            self.dataset = install_dataset(self.pt)
+        scenarios = self.SCENARIOS if only is None else [self.SCENARIOS[only]]
+        for se_name, dataset_path, se_kwargs in prefetched(scenarios, self.fetch):
+            se_class = getattr(se, se_name)
+            se_kwargs = dict(se_kwargs)
+            for k in self.PATH_KWARGS:
+                if k in se_kwargs:
+                    se_kwargs[k] = self.pt / se_kwargs[k]
+            if "filename" in se_kwargs:
+                se_kwargs["filename"] = str(se_kwargs["filename"])
+            yield se_class, dataset_path, se_kwargs
 
     def test(self, nwbfile):
         # TODO: not yet sure if anything
@@ -32,12 +249,24 @@ class _CommonBase:
 
 
 class Extractors(_CommonBase):
+    #: Size of the blocks of traces (two of which are held in memory at once)
+    #: in which recordings are written with `write_recording_blocks`, or
+    #: `None` to convert recordings with
+    #: ``se.NwbRecordingExtractor.write_recording`` (which reads whole
+    #: channels at once), as the samples are meant to show what spikeextractors
+    #: writes, unless they are larger than `LARGE_RECORDING_BYTES`
+    BLOCK_BYTES = None
+    #: Size of the scaled traces of a recording above which it is written in
+    #: blocks of `DEFAULT_BLOCK_BYTES` even if `BLOCK_BYTES` is `None`, or
+    #: `None` to always use ``write_recording`` then
+    LARGE_RECORDING_BYTES = 4 * 1024**3
+
     # TODO: propose PR to spikeextractors to have these defined in accessible atribute/constant so
     # we do not have to copy/paste them
     # Changes introduced: removed Path.cwd() / "ephy_testing_data"  prefix -- should be a relpath under self.dataset
     SCENARIOS = [
         (
-            se.BlackrockRecordingExtractor,
+            "BlackrockRecordingExtractor",
             "blackrock/blackrock_2_1",
             dict(
                 filename=Path("blackrock", "blackrock_2_1", "l101210-001"),
@@ -46,30 +275,30 @@ class Extractors(_CommonBase):
             ),
         ),
         (
-            se.IntanRecordingExtractor,
+            "IntanRecordingExtractor",
             "intan",
             dict(file_path=Path("intan", "intan_rhd_test_1.rhd")),
         ),
         (
-            se.IntanRecordingExtractor,
+            "IntanRecordingExtractor",
             "intan",
             dict(file_path=Path("intan", "intan_rhs_test_1.rhs")),
         ),
         # Klusta - no .prm config file in ephy_testing
         # (
-        #     se.KlustaRecordingExtractor,
+        #     "KlustaRecordingExtractor",
         #     "kwik",
         #     dict(folder_path=Path("kwik")),
         # ),
         #
         # Fails with assertion error:
         # (
-        #     se.MEArecRecordingExtractor,
+        #     "MEArecRecordingExtractor",
         #     "mearec/mearec_test_10s.h5",
         #     dict(file_path=Path("mearec", "mearec_test_10s.h5")),
         # ),
         (
-            se.NeuralynxRecordingExtractor,
+            "NeuralynxRecordingExtractor",
             "neuralynx/Cheetah_v5.7.4/original_data",
             dict(
                 dirname=Path("neuralynx", "Cheetah_v5.7.4", "original_data"),
@@ -77,28 +306,28 @@ class Extractors(_CommonBase):
             ),
         ),
         (
-            se.NeuroscopeRecordingExtractor,
+            "NeuroscopeRecordingExtractor",
             "neuroscope/test1",
             dict(file_path=Path("neuroscope", "test1", "test1.dat")),
         ),
         # Nixio - RuntimeError: Cannot open non-existent file in ReadOnly mode!
         # (
-        #     se.NIXIORecordingExtractor,
+        #     "NIXIORecordingExtractor",
         #     "nix",
         #     dict(file_path=str(Path("neoraw.nix"))),
         # ),
         (
-            se.OpenEphysRecordingExtractor,
+            "OpenEphysRecordingExtractor",
             "openephys/OpenEphys_SampleData_1",
             dict(folder_path=Path("openephys", "OpenEphys_SampleData_1")),
         ),
         (
-            se.OpenEphysRecordingExtractor,
+            "OpenEphysRecordingExtractor",
             "openephysbinary/v0.4.4.1_with_video_tracking",
             dict(folder_path=Path("openephysbinary", "v0.4.4.1_with_video_tracking")),
         ),
         (
-            se.OpenEphysNPIXRecordingExtractor,
+            "OpenEphysNPIXRecordingExtractor",
             "openephysbinary/v0.5.3_two_neuropixels_stream",
             dict(
                 folder_path=Path(
@@ -109,7 +338,7 @@ class Extractors(_CommonBase):
             ),
         ),
         (
-            se.NeuropixelsDatRecordingExtractor,
+            "NeuropixelsDatRecordingExtractor",
             "openephysbinary/v0.5.3_two_neuropixels_stream",
             dict(
                 file_path=Path(
@@ -131,18 +360,18 @@ class Extractors(_CommonBase):
             ),
         ),
         (
-            se.PhyRecordingExtractor,
+            "PhyRecordingExtractor",
             "phy/phy_example_0",
             dict(folder_path=Path("phy", "phy_example_0")),
         ),
         # Plexon - AssertionError: This file have several channel groups spikeextractors support only one groups
         # (
-        #     se.PlexonRecordingExtractor,
+        #     "PlexonRecordingExtractor",
         #     "plexon",
         #     dict(filename=Path("plexon", "File_plexon_2.plx")),
         # ),
         (
-            se.SpikeGLXRecordingExtractor,
+            "SpikeGLXRecordingExtractor",
             "spikeglx/Noise4Sam_g0",
             dict(
                 file_path=Path(
@@ -154,21 +383,12 @@ class Extractors(_CommonBase):
             ),
         ),
     ]
+    NUM_SAMPLES = len(SCENARIOS)
 
-    def create(self):
-        for se_class, dataset_path, se_kwargs in self.SCENARIOS:
-            self.dataset.get(dataset_path)
-            for k in [
-                "filename",
-                "file_path",
-                "dirname",
-                "folder_path",
-                "settings_file",
-            ]:
-                if k in se_kwargs:
-                    se_kwargs[k] = self.pt / se_kwargs[k]
-            if "filename" in se_kwargs:
-                se_kwargs["filename"] = str(se_kwargs["filename"])
+    def create(self, only=None):
+        import spikeextractors as se
+
+        for se_class, dataset_path, se_kwargs in self.iter_scenarios(only):
             recording = se_class(**se_kwargs)
             nwbfile = NWBFile(
                 identifier="testing",
@@ -177,18 +397,38 @@ class Extractors(_CommonBase):
                     1970, 1, 1, tzinfo=datetime.timezone.utc
                 ),
             )
-            se.NwbRecordingExtractor.write_recording(
-                recording, nwbfile=nwbfile, write_scaled=True
-            )
+            block_bytes = self.get_block_bytes(recording)
+            if block_bytes is None:
+                se.NwbRecordingExtractor.write_recording(
+                    recording, nwbfile=nwbfile, write_scaled=True
+                )
+            else:
+                write_recording_blocks(recording, nwbfile, block_bytes)
             yield "spikeextractors", f"{self.__class__.__name__}/{se_class.__name__}/{dataset_path}", nwbfile
 
+    def get_block_bytes(self, recording):
+        """
+        Return the block size with which to write a recording with
+        `write_recording_blocks`, or `None` to write it with
+        ``write_recording``
+        """
+        if not can_write_blocks():
+            return None
+        if self.BLOCK_BYTES is not None:
+            return self.BLOCK_BYTES
+        if self.LARGE_RECORDING_BYTES is None:
+            return None
+        itemsize = recording.get_traces(end_frame=1, return_scaled=True).dtype.itemsize
+        size = recording.get_num_frames() * recording.get_num_channels() * itemsize
+        return DEFAULT_BLOCK_BYTES if size > self.LARGE_RECORDING_BYTES else None
+
 
 class Sorters(_CommonBase):
     # TODO: propose PR to spikeextractors to have these defined in accessible atribute/constant so
     # we do not have to copy/paste them
     SCENARIOS = [
         (
-            se.BlackrockSortingExtractor,
+            "BlackrockSortingExtractor",
             "blackrock/blackrock_2_1",
             dict(
                 filename=Path("blackrock", "blackrock_2_1", "l101210-001"),
@@ -197,14 +437,14 @@ class Sorters(_CommonBase):
             ),
         ),
         (
-            se.KlustaSortingExtractor,
+            "KlustaSortingExtractor",
             "kwik",
             dict(file_or_folder_path=Path("kwik", "neo.kwik")),
         ),
         # Neuralynx - units_ids = nwbfile.units.id[:] - AttributeError: 'NoneType' object has no attribute 'id'
         # Is the GIN data OK? Or are there no units?
         # (
-        #     se.NeuralynxSortingExtractor,
+        #     "NeuralynxSortingExtractor",
         #     "neuralynx/Cheetah_v5.7.4/original_data",
         #     dict(
         #         dirname=Path("neuralynx", "Cheetah_v5.7.4", "original_data"),
@@ -214,27 +454,27 @@ class Sorters(_CommonBase):
         # NIXIO - return [int(da.label) for da in self._spike_das]
         # TypeError: int() argument must be a string, a bytes-like object or a number, not 'NoneType'
         # (
-        #     se.NIXIOSortingExtractor,
+        #     "NIXIOSortingExtractor",
         #     "nix/nixio_fr.nix",
         #     dict(file_path=Path("nix", "nixio_fr.nix")),
         # ),
         (
-            se.MEArecSortingExtractor,
+            "MEArecSortingExtractor",
             "mearec/mearec_test_10s.h5",
             dict(file_path=Path("mearec", "mearec_test_10s.h5")),
         ),
         (
-            se.PhySortingExtractor,
+            "PhySortingExtractor",
             "phy/phy_example_0",
             dict(folder_path=Path("phy", "phy_example_0")),
         ),
         (
-            se.PlexonSortingExtractor,
+            "PlexonSortingExtractor",
             "plexon",
             dict(filename=Path("plexon", "File_plexon_2.plx")),
         ),
         (
-            se.SpykingCircusSortingExtractor,
+            "SpykingCircusSortingExtractor",
             "spykingcircus/spykingcircus_example0",
             dict(
                 file_or_folder_path=Path(
@@ -244,29 +484,17 @@ class Sorters(_CommonBase):
         ),
         # # Tridesclous - dataio error, GIN data is not correct?
         # (
-        #     se.TridesclousSortingExtractor,
+        #     "TridesclousSortingExtractor",
         #     "tridesclous/tdc_example0",
         #     dict(folder_path=Path("tridesclous", "tdc_example0")),
         # )
     ]
+    NUM_SAMPLES = len(SCENARIOS)
 
-    def create(self):
-        # Disabled because trying to convert the data to an NWBFile isn't
-        # working
-        return
-        for se_class, dataset_path, se_kwargs in self.SCENARIOS:
-            self.dataset.get(dataset_path)
-            for k in [
-                "filename",
-                "file_or_folder_path",
-                "file_path",
-                "dirname",
-                "folder_path",
-            ]:
-                if k in se_kwargs:
-                    se_kwargs[k] = self.pt / se_kwargs[k]
-            if "filename" in se_kwargs:
-                se_kwargs["filename"] = str(se_kwargs["filename"])
+    def create(self, only=None):
+        import spikeextractors as se
+
+        for se_class, dataset_path, se_kwargs in self.iter_scenarios(only):
             sorting = se_class(**se_kwargs)
             sf = sorting.get_sampling_frequency()
             if (
@@ -274,8 +502,14 @@ class Sorters(_CommonBase):
             ):  # need to set dummy sampling frequency since no associated acquisition in file
                 sf = 30000
                 sorting.set_sampling_frequency(sf)
-            with tempfile.NamedTemporaryFile() as tf:
-                se.NwbSortingExtractor.write_sorting(sorting, tf.name)
-                with pynwb.NWBHDF5IO(tf.name, mode="r") as io:
-                    nwbfile = io.read()
-                yield "spikeextractors", f"{self.__class__.__name__}/{se_class.__name__}/{dataset_path}", nwbfile
+            nwbfile = NWBFile(
+                identifier="testing",
+                session_description="testing",
+                session_start_time=datetime.datetime(
+                    1970, 1, 1, tzinfo=datetime.timezone.utc
+                ),
+            )
+            se.NwbSortingExtractor.write_sorting(sorting, nwbfile=nwbfile)
+            # The sample is the sorting as written to and read back from a file
+            with staged_nwbfile(nwbfile) as staged:
+                yield "spikeextractors", f"{self.__class__.__name__}/{se_class.__name__}/{dataset_path}", staged
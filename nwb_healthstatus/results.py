@@ -0,0 +1,164 @@
+import json
+from pathlib import Path
+import sqlite3
+from time import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+#: Name of the results database created at the top of a samples directory by
+#: ``matrix run``
+RESULTS_DB_NAME = "results.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    producer TEXT NOT NULL,
+    casename TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    writer_env TEXT NOT NULL,
+    reader_env TEXT NOT NULL,
+    writer_versions TEXT NOT NULL,
+    reader_versions TEXT NOT NULL,
+    status TEXT NOT NULL,
+    duration REAL,
+    warnings TEXT NOT NULL,
+    error TEXT,
+    recorded_at REAL NOT NULL,
+    PRIMARY KEY (
+        producer,
+        casename,
+        filename,
+        writer_env,
+        reader_env,
+        writer_versions,
+        reader_versions
+    )
+);
+CREATE INDEX IF NOT EXISTS results_by_cell
+    ON results (producer, writer_env, reader_env, recorded_at);
+CREATE INDEX IF NOT EXISTS results_by_time ON results (recorded_at);
+"""
+
+#: Columns identifying a cell of the matrix for a single sample file
+SAMPLE_KEY = ["producer", "casename", "filename", "writer_env", "reader_env"]
+
+
+class ResultsStore:
+    """
+    An SQLite database of sample test outcomes, with one row per sample file,
+    writer & reader environment, and set of writer & reader package versions.
+    Recording an outcome for an existing key replaces the earlier outcome,
+    while outcomes under new package versions are added alongside the old
+    ones.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Multiple processes (e.g., parallel matrix jobs) may write at once
+        self.db = sqlite3.connect(str(self.path), timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.executescript(SCHEMA)
+
+    def __enter__(self) -> "ResultsStore":
+        return self
+
+    def __exit__(self, *_exc: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def record(
+        self,
+        producer: str,
+        casename: str,
+        filename: str,
+        writer_env: str,
+        reader_env: str,
+        writer_versions: Dict[str, str],
+        reader_versions: Dict[str, str],
+        status: str,
+        duration: Optional[float] = None,
+        warnings: Optional[List[str]] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results VALUES"
+                " (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    producer,
+                    casename,
+                    filename,
+                    writer_env,
+                    reader_env,
+                    json.dumps(writer_versions, sort_keys=True),
+                    json.dumps(reader_versions, sort_keys=True),
+                    status,
+                    duration,
+                    json.dumps(warnings or []),
+                    error,
+                    time(),
+                ),
+            )
+
+    def latest(
+        self,
+        producer: Optional[str] = None,
+        writer_env: Optional[str] = None,
+        reader_env: Optional[str] = None,
+    ) -> List[sqlite3.Row]:
+        """
+        Return the most recently recorded outcome for each sample file and
+        writer & reader environment, optionally restricted to the given
+        producer and environments
+        """
+        query, params = _latest_query(producer, writer_env, reader_env)
+        return self.db.execute(
+            f"{query} ORDER BY {', '.join(SAMPLE_KEY)}", params
+        ).fetchall()
+
+    def summary(
+        self,
+        producer: Optional[str] = None,
+        writer_env: Optional[str] = None,
+        reader_env: Optional[str] = None,
+    ) -> List[sqlite3.Row]:
+        """
+        Return, for each producer and writer & reader environment, the number
+        of sample files whose latest outcome is a success or a failure
+        """
+        query, params = _latest_query(producer, writer_env, reader_env)
+        return self.db.execute(
+            f"SELECT producer, writer_env, reader_env,"
+            f" SUM(status = 'ok') AS ok, SUM(status != 'ok') AS failed"
+            f" FROM ({query})"
+            f" GROUP BY producer, writer_env, reader_env"
+            f" ORDER BY producer, writer_env, reader_env",
+            params,
+        ).fetchall()
+
+
+def _latest_query(
+    producer: Optional[str], writer_env: Optional[str], reader_env: Optional[str]
+) -> Tuple[str, List[str]]:
+    where = []
+    params = []
+    for col, value in [
+        ("producer", producer),
+        ("writer_env", writer_env),
+        ("reader_env", reader_env),
+    ]:
+        if value is not None:
+            where.append(f"{col} = ?")
+            params.append(value)
+    cond = f"WHERE {' AND '.join(where)}" if where else ""
+    key = ", ".join(SAMPLE_KEY)
+    return (
+        f"SELECT results.* FROM results JOIN ("
+        f" SELECT {key}, MAX(recorded_at) AS recorded_at FROM results"
+        f" {cond} GROUP BY {key}"
+        f") USING ({key}, recorded_at)",
+        params,
+    )
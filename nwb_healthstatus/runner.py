@@ -0,0 +1,349 @@
+from importlib import import_module
+import os
+from pathlib import Path, PurePosixPath
+from traceback import format_exc
+from typing import (
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
+import warnings
+
+from hdmf.build import BuildManager, GroupBuilder, TypeMap
+import pynwb
+
+from .base import SampleCase, get_cases_in_namespace
+from .checksums import write_checksums
+from .discovery import get_scale_dir
+from . import base
+from .trace import phase
+
+#: Type maps with the namespaces of each set of extensions loaded, as built
+#: (once per process) by `get_type_map`
+_TYPE_MAPS: Dict[FrozenSet[str], TypeMap] = {}
+
+
+class _LoadedCasefile(NamedTuple):
+    """A case file loaded by `get_case` while caching is enabled"""
+
+    #: ``(inode, size, mtime)`` of the file when it was loaded
+    stamp: Tuple[int, int, int]
+    producer: str
+    cases: List[Type[SampleCase]]
+    #: Sample cases constructed from the file, by name and size parameters
+    instances: Dict[Tuple[str, tuple], SampleCase]
+
+
+#: Case files loaded by `get_case`, by real path, once caching is enabled by
+#: `warm_up` (in the long-lived workers of ``sample serve``), or `None`
+_LOADED: Optional[Dict[str, _LoadedCasefile]] = None
+
+
+class SampleResult(NamedTuple):
+    path: str
+    #: One of "created", "skipped", or "failed"
+    status: str
+    error: Optional[str] = None
+
+
+def load_casefile(casefile: Union[str, Path]) -> Tuple[str, dict]:
+    """
+    Execute a case file and return the name of its producer along with the
+    resulting namespace
+    """
+    p = Path(casefile)
+    producer = p.resolve().parent.name
+    namespace = {}
+    with phase("exec", casefile=str(casefile)):
+        exec(p.read_text(), namespace)
+    return producer, namespace
+
+
+def load_cases(casefile: Union[str, Path]) -> Tuple[str, List[Type[SampleCase]]]:
+    """
+    Execute a case file and return the name of its producer along with the
+    sample cases defined in it
+    """
+    producer, namespace = load_casefile(casefile)
+    return producer, list(get_cases_in_namespace(namespace))
+
+
+def get_case(
+    casefile: Union[str, Path],
+    casename: str,
+    scale: Optional[Dict[str, Union[int, float]]] = None,
+) -> Tuple[str, SampleCase]:
+    """
+    Construct the named sample case from a case file, with the given size
+    parameters overriding the defaults in its ``PARAMS``.  Once caching is
+    enabled by `warm_up`, case files are only executed again, and cases only
+    constructed again, when the case file changes.
+    """
+    if _LOADED is None:
+        producer, cases = load_cases(casefile)
+        return producer, _construct_case(cases, casefile, casename, scale)
+    path = os.path.realpath(casefile)
+    st = os.stat(path)
+    stamp = (st.st_ino, st.st_size, st.st_mtime_ns)
+    loaded = _LOADED.get(path)
+    if loaded is None or loaded.stamp != stamp:
+        loaded = _LOADED[path] = _LoadedCasefile(stamp, *load_cases(casefile), {})
+    key = (casename, tuple(sorted((scale or {}).items())))
+    if key not in loaded.instances:
+        loaded.instances[key] = _construct_case(loaded.cases, casefile, casename, scale)
+    return loaded.producer, loaded.instances[key]
+
+
+def _construct_case(
+    cases: List[Type[SampleCase]],
+    casefile: Union[str, Path],
+    casename: str,
+    scale: Optional[Dict[str, Union[int, float]]],
+) -> SampleCase:
+    for casecls in cases:
+        if casecls.__name__ == casename:
+            params = getattr(casecls, "PARAMS", None)
+            unknown = sorted(set(scale or {}) - set(params or {}))
+            if unknown:
+                raise ValueError(
+                    f"Sample case {casename} has no size parameters {unknown}"
+                )
+            with phase("construct", case=casename, scale=scale):
+                if params is None:
+                    return casecls()
+                return casecls(**dict(params, **(scale or {})))
+    raise LookupError(f"No sample case named {casename!r} in {casefile}")
+
+
+def get_type_map(extensions: Iterable[str] = ()) -> TypeMap:
+    """
+    Return a type map with the NWB core namespaces and those of the given
+    extensions (as listed in a case's ``EXTENSIONS``: names of ``ndx-*``
+    packages, whose modules register their namespaces with pynwb when
+    imported).  The type map for each set of extensions is built once per
+    process and then shared by all the samples using it.
+    """
+    key = frozenset(extensions)
+    try:
+        return _TYPE_MAPS[key]
+    except KeyError:
+        pass
+    with phase("type-map", extensions=sorted(key)):
+        for ext in sorted(key):
+            import_module(ext.replace("-", "_"))
+        type_map = _TYPE_MAPS[key] = pynwb.get_type_map()
+    return type_map
+
+
+def open_sample(filepath: Union[str, Path], type_map: TypeMap) -> pynwb.NWBHDF5IO:
+    """
+    Open a sample file for reading with the given (cached) type map if the
+    namespaces cached in the file are all loaded in it, at the same
+    versions, and otherwise with the namespaces cached in the file, as pynwb
+    does by default
+    """
+    get_namespaces = getattr(pynwb.NWBHDF5IO, "get_namespaces", None)
+    if get_namespaces is not None:
+        catalog = type_map.namespace_catalog
+        cached = get_namespaces(path=str(filepath))
+        if all(
+            name in catalog.namespaces
+            and catalog.get_namespace(name).version == version
+            for name, version in cached.items()
+        ):
+            return pynwb.NWBHDF5IO(
+                str(filepath), mode="r", manager=BuildManager(type_map)
+            )
+    return pynwb.NWBHDF5IO(str(filepath), mode="r")
+
+
+def read_objects(io: pynwb.NWBHDF5IO, paths: Iterable[str]) -> pynwb.NWBFile:
+    """
+    Read an NWB file, constructing only the objects at the given paths in
+    the file (along with the file's own metadata, the groups which merely
+    organize objects, such as ``/acquisition``, and whatever the objects
+    link to) rather than the whole container hierarchy.  Other objects are
+    missing from the returned `NWBFile`.  The file's builders are read in
+    full (their datasets are read lazily); the other objects are only
+    skipped when constructing the `NWBFile`.
+    """
+    keep = [PurePosixPath(p.strip("/")).parts for p in paths]
+    builder = io.read_builder()
+    for parts in keep:
+        if not _has_builder(builder, parts):
+            raise ValueError(f"No object at {'/'.join(parts)!r} in {io.source}")
+    root = _prune_builder(builder, keep, io.manager.type_map)
+    nwbfile = io.manager.construct(root)
+    nwbfile.read_io = io
+    return nwbfile
+
+
+def _has_builder(builder: GroupBuilder, parts: Tuple[str, ...]) -> bool:
+    for i, name in enumerate(parts):
+        if name in builder.groups:
+            builder = builder.groups[name]
+        elif name in builder.links:
+            builder = builder.links[name].builder
+        else:
+            return name in builder.datasets and i == len(parts) - 1
+    return True
+
+
+def _prune_builder(
+    builder: GroupBuilder, keep: List[Tuple[str, ...]], type_map: TypeMap
+) -> GroupBuilder:
+    """
+    Return a copy of a group builder without the typed subgroups that
+    neither are at nor lead to one of the ``keep`` paths (relative to the
+    group).  Builders are shared with the original tree wherever possible.
+    """
+    groups = []
+    for name, sub in builder.groups.items():
+        subkeep = [parts[1:] for parts in keep if parts[0] == name]
+        if () in subkeep:
+            groups.append(sub)
+        elif subkeep or type_map.get_builder_dt(sub) is None:
+            groups.append(_prune_builder(sub, subkeep, type_map))
+    return GroupBuilder(
+        name=builder.name,
+        groups=groups,
+        datasets=list(builder.datasets.values()),
+        links=list(builder.links.values()),
+        attributes=dict(builder.attributes),
+        source=builder.source,
+    )
+
+
+def write_nwbfile(
+    nwbfile: pynwb.NWBFile, filepath: Path, type_map: Optional[TypeMap] = None
+) -> None:
+    """
+    Write ``nwbfile`` (using ``type_map`` if given) to a temporary file next
+    to ``filepath`` and then move it into place, so that an interrupted
+    write never leaves a partial sample behind.  A file read from another
+    (e.g., one staged in memory) is exported, with its data copied over.
+    """
+    tmppath = filepath.with_name(f".{filepath.stem}.{os.getpid()}.tmp{filepath.suffix}")
+    manager = BuildManager(type_map) if type_map is not None else None
+    try:
+        with pynwb.NWBHDF5IO(str(tmppath), "w", manager=manager) as io:
+            if getattr(nwbfile, "read_io", None) is not None:
+                # Copy the data over rather than linking to the other file
+                io.export(
+                    src_io=nwbfile.read_io,
+                    nwbfile=nwbfile,
+                    write_args={"link_data": False},
+                )
+            else:
+                io.write(nwbfile)  # , cache_spec=cache_spec)
+        os.replace(str(tmppath), str(filepath))
+    except BaseException:
+        if tmppath.exists():
+            tmppath.unlink()
+        raise
+
+
+def create_samples(
+    casefile: str,
+    casename: str,
+    samples_path: str,
+    overwrite: bool,
+    scale: Optional[Dict[str, Union[int, float]]] = None,
+    only: Optional[int] = None,
+) -> List[SampleResult]:
+    """
+    Create and write the samples of a case (only the one with index
+    ``only``, if given, of a case declaring ``NUM_SAMPLES``) and return the
+    result for each file.  If the case fails to produce a sample, the
+    results of the files written so far are returned along with a failed
+    result for the case itself.
+    """
+    producer, case = get_case(casefile, casename, scale)
+    type_map = get_type_map(case.EXTENSIONS)
+    results = []
+    samples = case.create() if only is None else case.create(only=only)
+    while True:
+        with phase("create", case=casename) as info:
+            try:
+                testsuite, filepath, nwbfile = next(samples)
+            except StopIteration:
+                break
+            except Exception:
+                where = f"{casefile}:{casename}" + (
+                    f"[{only}]" if only is not None else ""
+                )
+                results.append(SampleResult(where, "failed", format_exc()))
+                break
+            info["file"] = str(filepath)
+        filepath = Path(samples_path, producer, get_scale_dir(scale), filepath)
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        if overwrite or not filepath.exists():
+            try:
+                with phase("write", case=casename, file=str(filepath)):
+                    write_nwbfile(nwbfile, filepath, type_map)
+                with phase("checksum", case=casename, file=str(filepath)):
+                    write_checksums(filepath)
+            except Exception:
+                results.append(SampleResult(str(filepath), "failed", format_exc()))
+            else:
+                results.append(SampleResult(str(filepath), "created"))
+        else:
+            results.append(SampleResult(str(filepath), "skipped"))
+    return results
+
+
+def warm_up() -> None:
+    """
+    Load what testing a sample needs up front: the dependencies (imported
+    along with this module) and the core NWB type map, and have `get_case`
+    keep the case files and cases it loads.  Run once by each of the
+    long-lived workers of ``sample serve``.
+    """
+    global _LOADED
+    get_type_map()
+    _LOADED = {}
+
+
+def test_sample(
+    casefile: str,
+    casename: str,
+    filepath: str,
+    mmap: bool = True,
+    scale: Optional[Dict[str, Union[int, float]]] = None,
+    full_read: bool = False,
+) -> List[str]:
+    """
+    Read a sample file and run the given case's test on it, returning the
+    messages of any warnings emitted in the process.  The case is constructed
+    with the size parameters the sample was created with.  If ``mmap`` is false,
+    `assert_data_equal` reads datasets through h5py even where they could be
+    memory-mapped.  The file is read with the shared type map for the case's
+    extensions (see `open_sample`), and, if the case declares ``OBJECTS`` and
+    ``full_read`` is false, only the objects declared are constructed.
+    """
+    # Restored afterwards, so as not to leak into later tests run by the
+    # same (warm) worker
+    saved, base.MAP_DATASETS = base.MAP_DATASETS, mmap
+    try:
+        _, case = get_case(casefile, casename, scale)
+        type_map = get_type_map(case.EXTENSIONS)
+        objects = None if full_read else getattr(case, "OBJECTS", None)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            with open_sample(filepath, type_map) as io:
+                with phase("read", case=casename, file=filepath):
+                    if objects is None:
+                        obj = io.read()
+                    else:
+                        obj = read_objects(io, objects)
+                with phase("test", case=casename, file=filepath):
+                    case.test(obj)
+    finally:
+        base.MAP_DATASETS = saved
+    return [f"{w.category.__name__}: {w.message}" for w in caught]
@@ -0,0 +1,372 @@
+from collections import OrderedDict
+import json
+from multiprocessing.connection import wait
+import os
+from pathlib import Path
+import socket
+from time import monotonic
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from .discovery import CaseIndex, IndexedCase, get_sample_files
+from .pool import POLL_INTERVAL, Outcome, WarmPool
+
+#: Name of the socket in the samples directory on which ``sample serve``
+#: accepts check requests by default
+SOCKET_NAME = ".serve.sock"
+
+#: Number of seconds a client of the server has to send its request
+REQUEST_TIMEOUT = 5.0
+
+TEST_SAMPLE = "nwb_healthstatus.runner:test_sample"
+WARM_UP = "nwb_healthstatus.runner:warm_up"
+
+
+class Check(NamedTuple):
+    """A sample file to test with a sample case"""
+
+    casefile: str
+    casename: str
+    filepath: str
+
+
+def _stamp(path: Union[str, Path]) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(str(path))
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class _Request:
+    """A check request received over the socket, awaiting its results"""
+
+    def __init__(self, conn: socket.socket, checks: Iterable[Check]) -> None:
+        self.conn = conn
+        #: Checks which have yet to be started since the request was made
+        self.waiting: Set[Check] = set(checks)
+        #: Checks started since the request was made and still running
+        self.running: Set[Check] = set()
+        self.results: List[Dict[str, Any]] = []
+
+    @property
+    def done(self) -> bool:
+        return not self.waiting and not self.running
+
+    def reply(self, reply: Dict[str, Any]) -> None:
+        try:
+            self.conn.sendall(json.dumps(reply).encode("utf-8") + b"\n")
+        except OSError:
+            # The client has gone away
+            pass
+        self.conn.close()
+
+
+class _Incoming:
+    """A connection to the server whose request has yet to be read in full"""
+
+    def __init__(self, conn: socket.socket) -> None:
+        self.conn = conn
+        self.data = b""
+        self.deadline = monotonic() + REQUEST_TIMEOUT
+
+
+class SampleServer:
+    """
+    Keep testing the sample files of the cases in the given case files (as
+    selected by ``casenames`` and ``scale``, as for ``sample test``) in a
+    `WarmPool` of workers, re-testing a sample whenever it or its case file
+    changes, as seen by polling them every ``interval`` seconds.  Requests
+    to test samples on demand are accepted on a Unix socket at
+    ``socket_path``; see `request_checks`.
+
+    The outcome of each test is passed to ``report``, and problems with case
+    files to ``warn``.  Modules imported by case files are not reloaded by
+    the workers; restart the server after changing them.
+    """
+
+    def __init__(
+        self,
+        casefiles: Iterable[str],
+        samples_path: Union[str, Path],
+        report: Callable[[Check, Outcome], None],
+        warn: Callable[[str], None],
+        casenames: Iterable[str] = (),
+        case_index: Optional[Union[str, Path]] = None,
+        scale: Optional[Dict[str, Union[int, float]]] = None,
+        mmap: bool = True,
+        workers: int = 1,
+        timeout: Optional[float] = None,
+        max_rss: Optional[int] = None,
+        socket_path: Optional[Union[str, Path]] = None,
+        interval: float = 2.0,
+    ) -> None:
+        self.casefiles = list(casefiles)
+        self.samples_path = Path(samples_path)
+        self.report = report
+        self.warn = warn
+        self.casenames = set(casenames)
+        self.index = CaseIndex(case_index) if case_index is not None else CaseIndex()
+        self.scale = scale
+        self.mmap = mmap
+        self.interval = interval
+        self.socket_path = Path(
+            socket_path if socket_path is not None else self.samples_path / SOCKET_NAME
+        )
+        self.casefile_stamps: Dict[str, Optional[Tuple[int, int, int]]] = {}
+        self.cases: Dict[str, List[Tuple[str, IndexedCase]]] = {}
+        self.sample_stamps: Dict[Check, Tuple[int, int, int]] = {}
+        #: Checks to run, in order, as keys (with `None` values)
+        self.pending: "OrderedDict[Check, None]" = OrderedDict()
+        self.running: Set[Check] = set()
+        self.requests: List[_Request] = []
+        self.incoming: List[_Incoming] = []
+        self.listener = self.listen()
+        self.pool = WarmPool(
+            TEST_SAMPLE, workers, init=WARM_UP, timeout=timeout, max_rss=max_rss
+        )
+
+    def listen(self) -> socket.socket:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                probe.connect(str(self.socket_path))
+        except FileNotFoundError:
+            pass
+        except ConnectionRefusedError:
+            # Left behind by a server that did not exit cleanly
+            self.socket_path.unlink()
+        else:
+            raise RuntimeError(f"A server is already listening on {self.socket_path}")
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(str(self.socket_path))
+        listener.listen()
+        listener.setblocking(False)
+        return listener
+
+    def serve_forever(self) -> None:
+        """Serve until interrupted, then stop the workers and remove the socket"""
+        try:
+            next_scan = monotonic()
+            while True:
+                if monotonic() >= next_scan:
+                    self.scan()
+                    next_scan = monotonic() + self.interval
+                self.dispatch()
+                self.expire()
+                wakeup = min([next_scan] + [i.deadline for i in self.incoming])
+                delay = max(0.0, wakeup - monotonic())
+                if self.pool.limited:
+                    delay = min(delay, POLL_INTERVAL)
+                ready = wait(
+                    self.pool.waitables()
+                    + [self.listener]
+                    + [i.conn for i in self.incoming],
+                    timeout=delay,
+                )
+                if self.listener in ready:
+                    self.accept()
+                for inc in [i for i in self.incoming if i.conn in ready]:
+                    self.receive(inc)
+                for check, outcome in self.pool.poll():
+                    self.finish(check, outcome)
+        finally:
+            self.close()
+
+    def scan(self) -> None:
+        """
+        Queue the checks of the samples that are new or have changed (along
+        with their case files) since the last scan
+        """
+        changed = set()
+        for casefile in self.casefiles:
+            stamp = _stamp(casefile)
+            if stamp != self.casefile_stamps.get(casefile, ()):
+                self.casefile_stamps[casefile] = stamp
+                self.cases[casefile] = self.load_cases(casefile)
+                changed.add(casefile)
+        stamps = {}
+        for casefile in self.casefiles:
+            for producer, case in self.cases[casefile]:
+                for filepath in get_sample_files(
+                    producer, case, self.samples_path, self.scale
+                ):
+                    check = Check(casefile, case.name, str(filepath))
+                    stamp = _stamp(filepath)
+                    if stamp is None:
+                        continue
+                    stamps[check] = stamp
+                    if casefile in changed or self.sample_stamps.get(check) != stamp:
+                        self.pending[check] = None
+        self.sample_stamps = stamps
+
+    def load_cases(self, casefile: str) -> List[Tuple[str, IndexedCase]]:
+        try:
+            (entry,) = self.index.scan([casefile]).values()
+        except (OSError, RuntimeError) as e:
+            self.warn(str(e))
+            return []
+        self.index.save()
+        return [
+            (entry.producer, case)
+            for case in entry.cases
+            if (not self.casenames or case.name in self.casenames)
+            and set(self.scale or {}) <= set(case.params)
+        ]
+
+    def dispatch(self) -> None:
+        """Start pending checks on idle workers"""
+        for check in list(self.pending):
+            if not self.pool.idle():
+                break
+            if check in self.running:
+                continue
+            del self.pending[check]
+            self.running.add(check)
+            self.pool.start(check, (*check, self.mmap, self.scale))
+            for req in self.requests:
+                if check in req.waiting:
+                    req.waiting.remove(check)
+                    req.running.add(check)
+
+    def finish(self, check: Check, outcome: Outcome) -> None:
+        self.running.discard(check)
+        self.report(check, outcome)
+        for req in self.requests:
+            if check in req.running:
+                req.running.remove(check)
+                req.results.append(
+                    {
+                        "casefile": check.casefile,
+                        "case": check.casename,
+                        "file": check.filepath,
+                        "ok": outcome.ok,
+                        "duration": outcome.duration,
+                        "warnings": outcome.value if outcome.ok else [],
+                        "error": outcome.error,
+                    }
+                )
+        self.reply_done()
+
+    def accept(self) -> None:
+        """
+        Accept a connection, whose request is then read by `receive` as it
+        arrives, without holding up the tests
+        """
+        try:
+            conn, _ = self.listener.accept()
+        except BlockingIOError:
+            # The client has given up already
+            return
+        conn.setblocking(False)
+        self.incoming.append(_Incoming(conn))
+
+    def receive(self, inc: _Incoming) -> None:
+        """Read what has arrived of a request, and queue it once complete"""
+        try:
+            data = inc.conn.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        inc.data += data
+        if data and b"\n" not in inc.data:
+            return
+        self.incoming.remove(inc)
+        # Replies are sent whole, waiting for the client as needed
+        inc.conn.setblocking(True)
+        inc.conn.settimeout(REQUEST_TIMEOUT)
+        req = _Request(inc.conn, [])
+        try:
+            query = json.loads(inc.data.partition(b"\n")[0])
+            if not isinstance(query, dict):
+                raise ValueError("Request is not a JSON object")
+        except ValueError as e:
+            req.reply({"error": f"Invalid request: {e}"})
+            return
+        # Check against the current state of the samples
+        self.scan()
+        req.waiting = set(self.match(query))
+        for check in sorted(req.waiting):
+            self.pending[check] = None
+        self.requests.append(req)
+        self.reply_done()
+
+    def expire(self) -> None:
+        """Drop the connections whose requests have not arrived in time"""
+        now = monotonic()
+        for inc in [i for i in self.incoming if i.deadline <= now]:
+            self.incoming.remove(inc)
+            inc.conn.setblocking(True)
+            inc.conn.settimeout(REQUEST_TIMEOUT)
+            _Request(inc.conn, []).reply({"error": "Timed out reading request"})
+
+    def match(self, query: Dict[str, Any]) -> List[Check]:
+        """
+        Return the checks selected by a request, which may restrict them to
+        those of the given ``"casefiles"``, ``"cases"`` (names) and
+        ``"files"`` (sample files)
+        """
+        casefiles = {os.path.realpath(p) for p in query.get("casefiles") or []}
+        casenames = set(query.get("cases") or [])
+        files = {os.path.realpath(p) for p in query.get("files") or []}
+        return [
+            check
+            for check in self.sample_stamps
+            if (not casefiles or os.path.realpath(check.casefile) in casefiles)
+            and (not casenames or check.casename in casenames)
+            and (not files or os.path.realpath(check.filepath) in files)
+        ]
+
+    def reply_done(self) -> None:
+        for req in [r for r in self.requests if r.done]:
+            self.requests.remove(req)
+            req.reply({"results": req.results})
+
+    def close(self) -> None:
+        self.pool.close()
+        self.listener.close()
+        for inc in self.incoming:
+            inc.conn.close()
+        for req in self.requests:
+            req.reply({"error": "Server shut down"})
+        try:
+            self.socket_path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def request_checks(
+    socket_path: Union[str, Path],
+    casefiles: Iterable[str] = (),
+    casenames: Iterable[str] = (),
+    files: Iterable[str] = (),
+) -> List[Dict[str, Any]]:
+    """
+    Ask the ``sample serve`` server listening on ``socket_path`` to test the
+    samples of the given case files, cases and sample files (all, if none
+    are given) that it serves, and return the results once they are all in.
+    Raises `RuntimeError` if the server rejects the request.
+    """
+    query = {
+        "casefiles": [os.path.abspath(p) for p in casefiles],
+        "cases": list(casenames),
+        "files": [os.path.abspath(p) for p in files],
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        sock.sendall(json.dumps(query).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as fp:
+            reply = json.loads(fp.readline() or "{}")
+    if "results" not in reply:
+        raise RuntimeError(reply.get("error", "No reply from server"))
+    return reply["results"]
@@ -1,12 +1,19 @@
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
+from hashlib import sha256
+import os
 from pathlib import Path
 import re
 import subprocess
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
-from deepmerge import always_merger
+from appdirs import user_cache_dir
 from pydantic import BaseModel, Field
-import yaml
+
+from .manifest import get_package_version
+
+#: Directory in which generated Dockerfiles are cached
+DOCKERFILE_CACHE_DIR = Path(user_cache_dir("nwb-healthstatus", "dandi"), "dockerfiles")
 
 
 class Environment(BaseModel):
@@ -40,6 +47,14 @@ class Environment(BaseModel):
             cmd += ["--add-to-entrypoint", self.on_startup]
         return subprocess.check_output(cmd, universal_newlines=True)
 
+    def dockerfile_key(self, neurodocker_version: str) -> str:
+        """
+        Return a digest of everything the environment's generated Dockerfile
+        depends on
+        """
+        data = self.json(by_alias=True, sort_keys=True)
+        return sha256(f"{neurodocker_version}\0{data}".encode("utf-8")).hexdigest()
+
 
 class Producer(BaseModel):
     name: str
@@ -52,6 +67,9 @@ class Spec(BaseModel):
 
 
 def load_spec(filename: Union[str, Path]) -> Spec:
+    from deepmerge import always_merger
+    import yaml
+
     with open(filename) as fp:
         data = yaml.safe_load(fp)
     base_env = data.pop("base_environment")
@@ -60,3 +78,49 @@ def load_spec(filename: Union[str, Path]) -> Spec:
         for env in data.get("environments", [])
     ]
     return Spec.parse_obj(data)
+
+
+def get_neurodocker_version() -> str:
+    version = get_package_version("neurodocker")
+    if version is None:
+        version = subprocess.check_output(
+            ["neurodocker", "--version"], universal_newlines=True
+        ).strip()
+    return version
+
+
+def generate_dockerfiles(
+    envs: List[Environment],
+    cache_dir: Optional[Union[str, Path]] = DOCKERFILE_CACHE_DIR,
+    workers: Optional[int] = None,
+) -> Dict[str, str]:
+    """
+    Return the Dockerfiles for the given environments, keyed by environment
+    name.  Dockerfiles are cached in ``cache_dir`` (unless it is `None`) under
+    `Environment.dockerfile_key`; those not in the cache are generated
+    concurrently by up to ``workers`` neurodocker processes.
+    """
+    dockerfiles = {}
+    missing = []
+    if cache_dir is not None:
+        cache_dir = Path(cache_dir)
+        version = get_neurodocker_version()
+        for env in envs:
+            cached = cache_dir / f"{env.dockerfile_key(version)}.Dockerfile"
+            if cached.exists():
+                dockerfiles[env.name] = cached.read_text()
+            else:
+                missing.append((env, cached))
+    else:
+        missing = [(env, None) for env in envs]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for (env, cached), text in zip(
+            missing, pool.map(lambda ec: ec[0].generate_dockerfile(), missing)
+        ):
+            dockerfiles[env.name] = text
+            if cached is not None:
+                cached.parent.mkdir(parents=True, exist_ok=True)
+                tmppath = cached.with_name(f".{cached.name}.{os.getpid()}.tmp")
+                tmppath.write_text(text)
+                os.replace(str(tmppath), str(cached))
+    return dockerfiles
@@ -0,0 +1,283 @@
+from concurrent.futures import ThreadPoolExecutor
+import fcntl
+from hashlib import sha256
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from .manifest import MANIFEST_NAME
+
+#: Directory, at the top of a samples directory, holding one link to (or
+#: clone of) each distinct sample file, named by the SHA-256 digest of its
+#: content
+OBJECTS_DIR = ".objects"
+
+#: Name of the file in `OBJECTS_DIR` caching the digests of the sample files
+DIGESTS_NAME = "digests.json"
+
+#: Name reported for the environment of samples stored directly in the
+#: samples directory rather than in a subdirectory per writer environment (as
+#: ``matrix run`` does)
+ROOT_ENVIRONMENT = "local"
+
+# ioctl request for cloning a file's extents (Linux, on filesystems such as
+# Btrfs and XFS)
+FICLONE = 0x40049409
+
+
+class SampleFile(NamedTuple):
+    environment: str
+    producer: str
+    path: Path
+
+
+class DedupStats(NamedTuple):
+    #: Number of sample files examined
+    files: int
+    #: Number of sample files replaced by a link to an identical file
+    linked: int
+    #: Number of bytes freed by the replacements
+    saved: int
+
+
+class UsageRow(NamedTuple):
+    environment: str
+    producer: str
+    files: int
+    #: Total apparent size of the sample files
+    logical: int
+    #: Disk space used by the distinct inodes among the sample files
+    physical: int
+    #: Size of the HDF5 datasets also present, with identical content, in
+    #: another sample file (only computed on request)
+    shared: Optional[int] = None
+
+
+def iter_environments(samples_path: Union[str, Path]) -> Iterator[Tuple[str, Path]]:
+    """
+    Yield the name and samples directory of each writer environment in a
+    samples directory (see `iter_sample_files`)
+    """
+    root = Path(samples_path)
+    if (root / MANIFEST_NAME).exists():
+        yield ROOT_ENVIRONMENT, root
+    for d in sorted(root.iterdir()):
+        if d.is_dir() and (d / MANIFEST_NAME).exists():
+            yield d.name, d
+
+
+def iter_sample_files(samples_path: Union[str, Path]) -> Iterator[SampleFile]:
+    """
+    Yield the sample files in a samples directory, which is either the
+    samples directory of a single environment (containing a manifest) or, as
+    created by ``matrix run``, one with a samples directory per writer
+    environment, or both.  Producers are found via the manifests; hidden
+    files and directories (e.g., temporary files) are skipped.
+    """
+    for env, envdir in iter_environments(samples_path):
+        with (envdir / MANIFEST_NAME).open() as fp:
+            producers = sorted({entry_id.split("/")[0] for entry_id in json.load(fp)})
+        for producer in producers:
+            for dirpath, dirnames, filenames in os.walk(str(envdir / producer)):
+                dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+                for f in sorted(filenames):
+                    if not f.startswith("."):
+                        yield SampleFile(env, producer, Path(dirpath, f))
+
+
+def hash_file(path: Union[str, Path]) -> str:
+    digest = sha256()
+    with open(str(path), "rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SampleStore:
+    """
+    A content-addressed store of the sample files under a samples directory.
+    Identical sample files (e.g., those written by different environments
+    with the same content) are replaced by hardlinks to (or reflinks of) a
+    single object in `OBJECTS_DIR`, so that they take up space only once.
+    Sample files are only ever replaced whole (see `runner.write_nwbfile`),
+    so hardlinked samples are never modified through one another.
+    """
+
+    def __init__(self, samples_path: Union[str, Path]) -> None:
+        self.root = Path(samples_path)
+        self.objects = self.root / OBJECTS_DIR
+        try:
+            with (self.objects / DIGESTS_NAME).open() as fp:
+                self.digests = json.load(fp)
+        except (FileNotFoundError, ValueError):
+            self.digests = {}
+
+    def object_path(self, digest: str) -> Path:
+        return self.objects / digest[:2] / digest
+
+    def digest(self, path: Path) -> str:
+        """
+        Return the SHA-256 digest of a sample file's content, reusing the
+        cached digest if the file is unchanged since it was computed
+        """
+        key = str(path.relative_to(self.root))
+        st = path.stat()
+        stamp = [st.st_ino, st.st_size, st.st_mtime_ns]
+        cached = self.digests.get(key)
+        if cached is not None and cached["stamp"] == stamp:
+            return cached["digest"]
+        digest = hash_file(path)
+        self.digests[key] = {"stamp": stamp, "digest": digest}
+        return digest
+
+    def dedup(self, reflink: bool = False, workers: int = 1) -> DedupStats:
+        """
+        Hash all sample files (up to ``workers`` at once) and replace each
+        one whose content is already in the store by a hardlink to (or, if
+        ``reflink`` is true, a reflink of) the stored object.  Objects no
+        longer referenced by any sample file are removed.
+        """
+        files = [sf.path for sf in iter_sample_files(self.root)]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            digests = list(pool.map(self.digest, files))
+        linked = saved = 0
+        for path, digest in zip(files, digests):
+            entry = self.digests[str(path.relative_to(self.root))]
+            if entry.get("stored"):
+                continue
+            obj = self.object_path(digest)
+            if not obj.exists():
+                obj.parent.mkdir(parents=True, exist_ok=True)
+                _link(path, obj, reflink)
+            elif not os.path.samefile(str(path), str(obj)):
+                st = path.stat()
+                tmppath = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+                _link(obj, tmppath, reflink)
+                os.replace(str(tmppath), str(path))
+                linked += 1
+                if st.st_nlink == 1:
+                    saved += st.st_blocks * 512
+            st = path.stat()
+            entry["stamp"] = [st.st_ino, st.st_size, st.st_mtime_ns]
+            entry["stored"] = True
+        # Drop objects whose sample files have all been deleted or recreated
+        current = set(digests)
+        for obj in self.objects.glob("??/*"):
+            if obj.name not in current:
+                obj.unlink()
+        keys = {str(p.relative_to(self.root)) for p in files}
+        self.digests = {k: v for k, v in self.digests.items() if k in keys}
+        self.save()
+        return DedupStats(len(files), linked, saved)
+
+    def save(self) -> None:
+        self.objects.mkdir(parents=True, exist_ok=True)
+        path = self.objects / DIGESTS_NAME
+        tmppath = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with tmppath.open("w") as fp:
+            json.dump(self.digests, fp, indent=2, sort_keys=True)
+        os.replace(str(tmppath), str(path))
+
+
+def _link(src: Path, dest: Path, reflink: bool) -> None:
+    if not reflink:
+        os.link(str(src), str(dest))
+        return
+    try:
+        with open(str(src), "rb") as fsrc, open(str(dest), "wb") as fdest:
+            fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        dest.unlink()
+        raise
+
+
+def disk_usage(
+    samples_path: Union[str, Path], datasets: bool = False, workers: int = 1
+) -> Tuple[List[UsageRow], UsageRow]:
+    """
+    Report the logical & physical size of the sample files of each producer
+    and environment in a samples directory, plus the totals (with
+    environment and producer ``"total"``).  Inodes shared between producers
+    or environments count towards the physical size of each, but only once
+    towards the total.  If
+    ``datasets`` is true, also report the size of the datasets each group's
+    files share with other sample files (hashing up to ``workers`` files at
+    once), as an estimate of what storing datasets by content would save.
+    """
+    files = list(iter_sample_files(samples_path))
+    groups: Dict[Tuple[str, str], List[SampleFile]] = {}
+    for sf in files:
+        groups.setdefault((sf.environment, sf.producer), []).append(sf)
+    if datasets:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            hashed = dict(zip(files, pool.map(_hash_sample, files)))
+        occurrences: Dict[Tuple[str, str], int] = {}
+        for dsets in hashed.values():
+            for key in dsets:
+                occurrences[key] = occurrences.get(key, 0) + 1
+    rows = []
+    all_inodes = {}
+    for (env, producer), members in sorted(groups.items()):
+        logical = 0
+        inodes = {}
+        for sf in members:
+            st = sf.path.stat()
+            logical += st.st_size
+            inodes[st.st_dev, st.st_ino] = st.st_blocks * 512
+        all_inodes.update(inodes)
+        shared = None
+        if datasets:
+            shared = sum(
+                size
+                for sf in members
+                for key, size in hashed[sf].items()
+                if occurrences[key] > 1
+            )
+        rows.append(
+            UsageRow(env, producer, len(members), logical, sum(inodes.values()), shared)
+        )
+    total = UsageRow(
+        "total",
+        "total",
+        len(files),
+        sum(r.logical for r in rows),
+        sum(all_inodes.values()),
+        sum(r.shared for r in rows) if datasets else None,
+    )
+    return rows, total
+
+
+def _hash_sample(sf: SampleFile) -> Dict[Tuple[str, str], int]:
+    """
+    Return a mapping from the ``(name, digest)`` of each dataset in a sample
+    file, where the digest covers the dataset's dtype, shape and values (see
+    `hash_values`), to the dataset's size in bytes
+    """
+    import h5py
+
+    from .h5hash import hash_values
+
+    datasets = {}
+
+    def visit(name: str, obj: Any) -> None:
+        if isinstance(obj, h5py.Dataset) and obj.shape is not None:
+            datasets[name, hash_values(obj)] = obj.size * obj.dtype.itemsize
+
+    try:
+        with h5py.File(str(sf.path), "r") as f:
+            f.visititems(visit)
+    except OSError:
+        # Not an HDF5 file
+        return {}
+    return datasets
+
+
+def format_size(size: int) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "TiB"
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
@@ -0,0 +1,175 @@
+import cProfile
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import threading
+from time import time
+from traceback import format_exc
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+from uuid import uuid4
+
+from .pool import JobFunc, Outcome, resolve
+
+#: A function called at the end of each phase with the phase's name, its start
+#: and end times (seconds since the epoch), and its arguments
+PhaseHook = Callable[[str, float, float, Dict[str, Any]], None]
+
+_hooks: List[PhaseHook] = []
+
+
+def add_hook(hook: PhaseHook) -> None:
+    _hooks.append(hook)
+
+
+def remove_hook(hook: PhaseHook) -> None:
+    _hooks.remove(hook)
+
+
+@contextmanager
+def phase(name: str, **args: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Mark a phase of sample creation or testing (e.g., ``"write"``) for any
+    registered hooks.  The yielded dict of arguments may be added to inside
+    the block.  If `tracemalloc` is tracing, the memory in use at the end of
+    the phase (and, on Python 3.9+, the peak during it) is added to the
+    arguments.
+    """
+    if not _hooks:
+        yield args
+        return
+    if tracemalloc.is_tracing() and hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    start = time()
+    try:
+        yield args
+    finally:
+        end = time()
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            args["traced_memory"] = current
+            if hasattr(tracemalloc, "reset_peak"):
+                args["traced_peak"] = peak
+        for hook in list(_hooks):
+            hook(name, start, end, args)
+
+
+class Tracer:
+    """
+    Collects phases as events in the Chrome trace event format, from the
+    current process and from jobs run through functions wrapped with `wrap`
+    """
+
+    def __init__(
+        self,
+        profile_dir: Optional[Union[str, Path]] = None,
+        trace_malloc: bool = False,
+    ) -> None:
+        self.profile_dir = Path(profile_dir) if profile_dir is not None else None
+        self.trace_malloc = trace_malloc
+        self.events: List[Dict[str, Any]] = []
+
+    def __call__(
+        self, name: str, start: float, end: float, args: Dict[str, Any]
+    ) -> None:
+        self.events.append(
+            {
+                "name": name,
+                "cat": "nwb-healthstatus",
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": {k: _jsonable(v) for k, v in args.items()},
+            }
+        )
+
+    def wrap(self, func: JobFunc) -> "TracedCall":
+        """
+        Wrap a job function for `run_jobs` so that its phases (and, if
+        configured, a cProfile profile and tracemalloc statistics) are
+        captured wherever it runs.  Outcomes of the wrapped function must be
+        passed through `collect`.
+        """
+        return TracedCall(func, self.profile_dir, self.trace_malloc)
+
+    def collect(self, args: tuple, outcome: Outcome) -> Outcome:
+        """
+        Record the events returned by a wrapped job, plus a ``"job"`` event
+        spanning the whole job, and return the job's actual outcome
+        """
+        end = time()
+        self(
+            "job",
+            end - outcome.duration,
+            end,
+            {"args": [str(a) for a in args], "ok": outcome.ok},
+        )
+        if not outcome.ok:
+            return outcome
+        events, value, error = outcome.value
+        self.events.extend(events)
+        if error is not None:
+            return Outcome(False, error=error, duration=outcome.duration)
+        return Outcome(True, value, duration=outcome.duration)
+
+    def write(self, path: Union[str, Path]) -> None:
+        with open(path, "w") as fp:
+            json.dump(
+                {"traceEvents": self.events, "displayTimeUnit": "ms"}, fp, indent=1
+            )
+
+
+class TracedCall:
+    def __init__(
+        self, func: JobFunc, profile_dir: Optional[Path], trace_malloc: bool
+    ) -> None:
+        self.func = func
+        self.profile_dir = profile_dir
+        self.trace_malloc = trace_malloc
+
+    def __call__(self, *args: Any) -> tuple:
+        func = resolve(self.func)
+        tracer = Tracer()
+        add_hook(tracer)
+        if self.trace_malloc:
+            tracemalloc.start()
+        profile = cProfile.Profile() if self.profile_dir is not None else None
+        value = error = None
+        try:
+            with phase(func.__name__, args=[str(a) for a in args]):
+                if profile is not None:
+                    profile.enable()
+                try:
+                    value = func(*args)
+                finally:
+                    if profile is not None:
+                        profile.disable()
+        except Exception:
+            error = format_exc()
+        finally:
+            remove_hook(tracer)
+            if self.trace_malloc:
+                tracemalloc.stop()
+        if profile is not None:
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+            # For the job functions in `runner`, the second argument is the
+            # name of the sample case
+            label = args[1] if len(args) > 1 else "job"
+            profile.dump_stats(
+                str(
+                    self.profile_dir / f"{func.__name__}.{label}.{uuid4().hex[:8]}.prof"
+                )
+            )
+        return tracer.events, value, error
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    elif isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    else:
+        return str(value)
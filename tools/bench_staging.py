@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Compare staging a sample which must be written and read back before it is
+saved (as the spikeextractors ``Sorters`` samples are) in a temporary file
+on disk with staging it in memory with
+`nwb_healthstatus.base.staged_nwbfile`.
+
+Builds an NWB file with a Units table of ``--units`` units of ``--spikes``
+spike times each, stages it both ways, writes the sample file from the
+staged file with `nwb_healthstatus.runner.write_nwbfile`, checks that the
+two sample files hold the same spike times, and reports the time taken and
+the number of bytes the process wrote (from ``/proc/self/io``, so Linux
+only) by each.
+"""
+
+from contextlib import contextmanager
+import datetime
+from pathlib import Path
+import tempfile
+from time import perf_counter
+
+import click
+import numpy as np
+import pynwb
+from pynwb.misc import Units
+
+from nwb_healthstatus.base import build_table, staged_nwbfile
+from nwb_healthstatus.runner import write_nwbfile
+
+
+def make_nwbfile(units, spikes, seed=0):
+    rng = np.random.RandomState(seed)
+    nwbfile = pynwb.NWBFile(
+        identifier="testing",
+        session_description="testing",
+        session_start_time=datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc),
+    )
+    nwbfile.units = build_table(
+        Units,
+        {"spike_times": np.sort(rng.random_sample(units * spikes) * 1000)},
+        indices={"spike_times": np.arange(1, units + 1) * spikes},
+        name="units",
+    )
+    return nwbfile
+
+
+@contextmanager
+def staged_on_disk(nwbfile):
+    """Stage a file the way ``Sorters`` used to: in a temporary file"""
+    with tempfile.NamedTemporaryFile(suffix=".nwb") as tf:
+        with pynwb.NWBHDF5IO(tf.name, mode="w") as io:
+            io.write(nwbfile)
+        with pynwb.NWBHDF5IO(tf.name, mode="r") as io:
+            yield io.read()
+
+
+def bytes_written():
+    with open("/proc/self/io") as fp:
+        for line in fp:
+            key, _, value = line.partition(":")
+            if key == "wchar":
+                return int(value)
+    raise RuntimeError("No wchar in /proc/self/io")
+
+
+def spike_times(filepath):
+    with pynwb.NWBHDF5IO(str(filepath), mode="r") as io:
+        return io.read().units["spike_times"].data[:]
+
+
+@click.command()
+@click.option("--spikes", type=int, default=1000, show_default=True)
+@click.option("--units", type=int, default=1000, show_default=True)
+def main(spikes, units):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        click.echo(f"{'staging':<12}{'time':>10}{'written':>14}")
+        written = {}
+        for name, stage in [("on disk", staged_on_disk), ("in memory", staged_nwbfile)]:
+            nwbfile = make_nwbfile(units, spikes)
+            filepath = Path(tmpdir, f"{name.replace(' ', '-')}.nwb")
+            start = perf_counter()
+            wchar = bytes_written()
+            with stage(nwbfile) as staged:
+                write_nwbfile(staged, filepath)
+            wchar = bytes_written() - wchar
+            elapsed = perf_counter() - start
+            written[name] = filepath
+            click.echo(f"{name:<12}{elapsed:>9.3f}s{wchar / 1e6:>11.1f} MB")
+        np.testing.assert_array_equal(*map(spike_times, written.values()))
+
+
+if __name__ == "__main__":
+    main()
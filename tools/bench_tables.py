@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Compare building NWB tables row by row with building them from whole
+columns with `nwb_healthstatus.base.build_table`.
+
+Builds a trials table, a PlaneSegmentation with a pixel mask per ROI, and a
+Units table with ragged spike times, of ``--rows`` rows each, both ways,
+checks that the two tables hold the same values, and reports the time taken
+by each.  Building some tables row by row takes time quadratic in the number
+of rows, so it is stopped after ``--budget`` seconds, in which case its time
+(and the speedup) is a lower bound.
+"""
+
+import datetime
+from time import perf_counter
+
+import click
+import numpy as np
+import pynwb
+from pynwb.epoch import TimeIntervals
+from pynwb.misc import Units
+from pynwb.ophys import PlaneSegmentation
+
+from nwb_healthstatus.base import build_table
+
+PIXEL_MASK_DTYPE = np.dtype([("x", "u4"), ("y", "u4"), ("weight", "f4")])
+
+
+def make_imaging_plane():
+    nwbfile = pynwb.NWBFile(
+        identifier="testing",
+        session_description="testing",
+        session_start_time=datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc),
+    )
+    device = nwbfile.create_device(name="Microscope")
+    return nwbfile.create_imaging_plane(
+        name="ImagingPlane",
+        optical_channel=pynwb.ophys.OpticalChannel(
+            name="OpticalChannel", description="", emission_lambda=500.0
+        ),
+        imaging_rate=30.0,
+        description="",
+        device=device,
+        excitation_lambda=600.0,
+        indicator="GCaMP",
+        location="V1",
+    )
+
+
+def make_data(rows, seed=0):
+    rng = np.random.RandomState(seed)
+    start = np.cumsum(rng.random_sample(rows))
+    pixels = rng.randint(1, 5, rows)
+    pixel_mask = np.empty(pixels.sum(), dtype=PIXEL_MASK_DTYPE)
+    pixel_mask["x"] = rng.randint(0, 512, len(pixel_mask))
+    pixel_mask["y"] = rng.randint(0, 512, len(pixel_mask))
+    pixel_mask["weight"] = rng.random_sample(len(pixel_mask))
+    spikes = rng.randint(0, 20, rows)
+    spike_times = np.sort(rng.random_sample(spikes.sum()) * 1000)
+    return {
+        "start_time": start,
+        "stop_time": start + 0.5,
+        "pixel_mask": pixel_mask,
+        "pixel_mask_index": np.cumsum(pixels),
+        "spike_times": spike_times,
+        "spike_times_index": np.cumsum(spikes),
+    }
+
+
+def split(values, index):
+    return np.split(values, index[:-1])
+
+
+def trials_by_row(data, deadline):
+    table = TimeIntervals(name="trials", description="experimental trials")
+    for start, stop in zip(data["start_time"], data["stop_time"]):
+        if perf_counter() > deadline:
+            break
+        table.add_interval(start_time=start, stop_time=stop)
+    return table
+
+
+def trials_by_column(data):
+    return build_table(
+        TimeIntervals,
+        {"start_time": data["start_time"], "stop_time": data["stop_time"]},
+        name="trials",
+        description="experimental trials",
+    )
+
+
+def rois_by_row(data, deadline, imaging_plane):
+    table = PlaneSegmentation(
+        name="PlaneSegmentation", description="", imaging_plane=imaging_plane
+    )
+    for mask in split(data["pixel_mask"], data["pixel_mask_index"]):
+        if perf_counter() > deadline:
+            break
+        table.add_roi(pixel_mask=[tuple(p) for p in mask.tolist()])
+    return table
+
+
+def rois_by_column(data, imaging_plane):
+    return build_table(
+        PlaneSegmentation,
+        {"pixel_mask": data["pixel_mask"]},
+        indices={"pixel_mask": data["pixel_mask_index"]},
+        name="PlaneSegmentation",
+        description="",
+        imaging_plane=imaging_plane,
+    )
+
+
+def units_by_row(data, deadline):
+    table = Units(name="units")
+    for spikes in split(data["spike_times"], data["spike_times_index"]):
+        if perf_counter() > deadline:
+            break
+        table.add_unit(spike_times=spikes)
+    return table
+
+
+def units_by_column(data):
+    return build_table(
+        Units,
+        {"spike_times": data["spike_times"]},
+        indices={"spike_times": data["spike_times_index"]},
+        name="units",
+    )
+
+
+def column_values(table):
+    """Return the values of each column and column index of a table as floats"""
+    values = {"id": np.asarray(table.id.data)}
+    for col in table.columns:
+        data = col.data.tolist() if isinstance(col.data, np.ndarray) else col.data
+        values[col.name] = np.asarray(data, dtype=float)
+    return values
+
+
+def assert_same_table(a, b):
+    values_a = column_values(a)
+    values_b = column_values(b)
+    assert values_a.keys() == values_b.keys(), (values_a.keys(), values_b.keys())
+    for name, va in values_a.items():
+        np.testing.assert_array_equal(va, values_b[name], err_msg=name)
+
+
+def timed(func, *args):
+    start = perf_counter()
+    value = func(*args)
+    return value, perf_counter() - start
+
+
+@click.command()
+@click.option(
+    "--budget",
+    type=float,
+    default=120,
+    show_default=True,
+    help="Maximum number of seconds to spend building each table row by row",
+)
+@click.option("--rows", type=int, default=100000, show_default=True)
+def main(budget, rows):
+    data = make_data(rows)
+    imaging_plane = make_imaging_plane()
+    benches = [
+        ("trials", trials_by_row, trials_by_column, ()),
+        ("PlaneSegmentation", rois_by_row, rois_by_column, (imaging_plane,)),
+        ("units", units_by_row, units_by_column, ()),
+    ]
+    click.echo(f"{'table':<20}{'by row':>10}{'by column':>12}{'speedup':>10}")
+    for name, by_row, by_column, args in benches:
+        table_a, t_row = timed(by_row, data, perf_counter() + budget, *args)
+        table_b, t_column = timed(by_column, data, *args)
+        if len(table_a) == rows:
+            assert_same_table(table_a, table_b)
+            bound = ""
+        else:
+            bound = ">"
+        click.echo(
+            f"{name:<20}{bound + f'{t_row:.2f}s':>10}{t_column:>11.4f}s"
+            f"{bound + f'{t_row / t_column:.0f}x':>10}"
+            + (f"  (built {len(table_a)} rows by row)" if bound else "")
+        )
+
+
+if __name__ == "__main__":
+    main()
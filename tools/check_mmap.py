@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Check that `nwb_healthstatus.base.map_dataset` maps, and that
+`nwb_healthstatus.h5hash.get_extents` locates, the right bytes of a dataset,
+in files with and without a user block.
+
+Writes a small HDF5 file for each user block size and fails (exit status 1)
+if any of its contiguous datasets is not mapped, or is mapped to values
+other than those read through h5py, or if `assert_data_equal` does not
+accept it as equal to the values it was written with, or if the extents of
+any dataset (contiguous or chunked) do not hold the bytes of its values.
+"""
+
+from pathlib import Path
+import sys
+import tempfile
+
+import click
+import h5py
+import numpy as np
+
+from nwb_healthstatus.base import assert_data_equal, map_dataset
+from nwb_healthstatus.h5hash import get_extents
+
+DATASETS = {
+    "float": np.arange(1000.0),
+    "int2d": np.arange(3000, dtype="i4").reshape(1000, 3),
+}
+
+CHUNK_ROWS = 100
+
+
+def check_mapped(dset, values):
+    mapped = map_dataset(dset)
+    if not isinstance(mapped, np.memmap):
+        return "not mapped"
+    if not np.array_equal(mapped, dset[()]):
+        return "wrong mapped values"
+    try:
+        assert_data_equal(dset, values)
+    except AssertionError:
+        return "assert_data_equal failed"
+    return None
+
+
+def check_extents(path, dset, values):
+    with open(str(path), "rb") as fp:
+        for extent in get_extents(dset):
+            fp.seek(extent.offset)
+            raw = fp.read(extent.size)
+            if dset.chunks is None:
+                start = extent.key[0]
+                expected = values.tobytes()[start : start + extent.size]
+            else:
+                start = extent.key[0]
+                expected = values[start : start + CHUNK_ROWS].tobytes()
+            if raw != expected:
+                return f"wrong bytes in extent {extent.key}"
+    return None
+
+
+@click.command()
+@click.option(
+    "--userblock",
+    "userblocks",
+    type=int,
+    multiple=True,
+    default=[0, 512, 4096],
+    show_default=True,
+    help="User block size of a file to check",
+)
+def main(userblocks):
+    failed = False
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for ub in userblocks:
+            path = Path(tmpdir, f"userblock-{ub}.h5")
+            with h5py.File(str(path), "w", userblock_size=ub) as f:
+                for name, values in DATASETS.items():
+                    f[name] = values
+                    f.create_dataset(
+                        f"{name}-chunked",
+                        data=values,
+                        chunks=(CHUNK_ROWS,) + values.shape[1:],
+                    )
+            with h5py.File(str(path), "r") as f:
+                for name, values in DATASETS.items():
+                    checks = [
+                        (name, "mmap", check_mapped(f[name], values)),
+                        (name, "extents", check_extents(path, f[name], values)),
+                        (
+                            f"{name}-chunked",
+                            "extents",
+                            check_extents(path, f[f"{name}-chunked"], values),
+                        ),
+                    ]
+                    for dname, what, problem in checks:
+                        failed = failed or problem is not None
+                        status = "ok" if problem is None else f"FAILED ({problem})"
+                        click.echo(f"userblock {ub}: {dname}: {what}: {status}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
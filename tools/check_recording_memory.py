@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Check that converting a recording with the spikeextractors producer's
+block-wise writer uses bounded memory.
+
+Writes a synthetic recording, generated on the fly and larger than the
+memory limit, to an NWB file in a separate process limited to ``--max-rss``
+MiB of resident memory, then checks samples of the written traces.  Fails
+(exit status 1) if the process exceeds the limit or the traces differ.
+"""
+
+import datetime
+from pathlib import Path
+import resource
+import sys
+import tempfile
+
+import click
+import numpy as np
+
+from nwb_healthstatus.pool import run_jobs
+
+GAIN = 0.195
+
+
+def make_recording(num_channels, num_frames, sampling_frequency):
+    import spikeextractors as se
+    from spikeextractors.extraction_tools import check_get_traces_args
+
+    class SyntheticRecording(se.RecordingExtractor):
+        """int16 traces computed from the frame & channel indices"""
+
+        def __init__(self):
+            super().__init__()
+            self.has_unscaled = True
+            self.set_channel_gains(GAIN)
+
+        def get_channel_ids(self):
+            return list(range(num_channels))
+
+        def get_num_frames(self):
+            return num_frames
+
+        def get_sampling_frequency(self):
+            return sampling_frequency
+
+        @check_get_traces_args
+        def get_traces(
+            self, channel_ids=None, start_frame=None, end_frame=None, return_scaled=True
+        ):
+            return synthetic_traces(channel_ids, start_frame, end_frame)
+
+    return SyntheticRecording()
+
+
+def synthetic_traces(channel_ids, start_frame, end_frame):
+    frames = np.arange(start_frame, end_frame, dtype=np.int64)
+    channels = np.asarray(channel_ids, dtype=np.int64)[:, np.newaxis]
+    return ((frames * 7 + channels * 131) % 4001 - 2000).astype(np.int16)
+
+
+def convert(filepath, num_channels, num_frames, sampling_frequency, block_bytes):
+    from pynwb import NWBFile
+
+    from nwb_healthstatus.producers.spikeextractors.recording import (
+        write_recording_blocks,
+    )
+    from nwb_healthstatus.runner import write_nwbfile
+
+    recording = make_recording(num_channels, num_frames, sampling_frequency)
+    nwbfile = NWBFile(
+        identifier="testing",
+        session_description="testing",
+        session_start_time=datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc),
+    )
+    write_recording_blocks(recording, nwbfile, block_bytes)
+    write_nwbfile(nwbfile, filepath)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@click.command()
+@click.option("--block-mb", type=int, default=16, show_default=True)
+@click.option("--channels", type=int, default=64, show_default=True)
+@click.option(
+    "--max-rss",
+    type=int,
+    default=384,
+    show_default=True,
+    help="Memory limit in MiB",
+)
+@click.option(
+    "--seconds",
+    type=float,
+    default=120,
+    show_default=True,
+    help="Length of the recording",
+)
+def main(block_mb, channels, max_rss, seconds):
+    import h5py
+
+    sampling_frequency = 30000.0
+    num_frames = int(seconds * sampling_frequency)
+    size = num_frames * channels * np.dtype(np.float32).itemsize
+    click.echo(
+        f"Converting {seconds}s x {channels} channels"
+        f" ({size / 2 ** 20:.0f} MiB of scaled traces) in {block_mb} MiB blocks"
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filepath = Path(tmpdir, "recording.nwb")
+        ((_, outcome),) = run_jobs(
+            convert,
+            [(filepath, channels, num_frames, sampling_frequency, block_mb * 2**20)],
+            max_rss=max_rss * 2**20,
+        )
+        if not outcome.ok:
+            click.echo(f"FAIL: {outcome.error}")
+            sys.exit(1)
+        click.echo(
+            f"Peak RSS {outcome.value / 2 ** 20:.0f} MiB (limit {max_rss} MiB),"
+            f" {outcome.duration:.1f}s"
+        )
+        with h5py.File(filepath, "r") as f:
+            data = f["acquisition/ElectricalSeries/data"]
+            assert data.shape == (num_frames, channels), data.shape
+            for start in [0, num_frames // 2, num_frames - 1000]:
+                expected = synthetic_traces(
+                    range(channels), start, start + 1000
+                ).T.astype(np.float32)
+                np.testing.assert_allclose(
+                    data[start : start + 1000], expected * GAIN, rtol=1e-6
+                )
+    click.echo("ok")
+
+
+if __name__ == "__main__":
+    main()
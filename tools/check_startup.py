@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Check that the nwb-healthstatus CLI starts up quickly.
+
+Runs a few cheap CLI invocations in fresh interpreters and fails (exit status
+1) if the median wall-clock time of any of them exceeds the budget, or if
+importing the CLI module pulls in any of the heavy dependencies that should
+only be loaded by the commands and workers that need them.
+"""
+
+import statistics
+import subprocess
+import sys
+from time import perf_counter
+
+import click
+
+HEAVY_MODULES = [
+    "datalad",
+    "deepmerge",
+    "h5py",
+    "hdmf",
+    "numpy",
+    "pydantic",
+    "pynwb",
+    "spikeextractors",
+    "yaml",
+]
+
+COMMANDS = [
+    ["--help"],
+    ["sample", "--help"],
+    ["environments", "make-dockerfiles", "--help"],
+]
+
+
+@click.command()
+@click.option(
+    "--budget",
+    type=float,
+    default=0.5,
+    show_default=True,
+    help="Maximum median start-up time in seconds",
+)
+@click.option(
+    "-r",
+    "--repeat",
+    type=click.IntRange(min=1),
+    default=7,
+    show_default=True,
+    help="Number of runs of each command",
+)
+def main(budget, repeat):
+    ok = True
+    loaded = subprocess.check_output(
+        [
+            sys.executable,
+            "-c",
+            "import sys, nwb_healthstatus.__main__;"
+            f" print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))",
+        ],
+        universal_newlines=True,
+    ).split()
+    if loaded:
+        click.echo(f"FAIL: importing the CLI loads {', '.join(loaded)}")
+        ok = False
+    for args in COMMANDS:
+        times = []
+        for _ in range(repeat):
+            start = perf_counter()
+            subprocess.run(
+                [sys.executable, "-m", "nwb_healthstatus"] + args,
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            times.append(perf_counter() - start)
+        median = statistics.median(times)
+        status = "ok" if median <= budget else "FAIL"
+        click.echo(f"{status}: {' '.join(args)}: {median:.3f}s (budget {budget}s)")
+        if median > budget:
+            ok = False
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()